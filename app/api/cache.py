@@ -0,0 +1,209 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Pattern, Sequence, Tuple
+
+from fastapi import HTTPException
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+
+# Caché de respuestas HTTP de la API, invalidada por la versión de los datos
+# (META.data_version, ver app/recommender/tables.py). El ETag de cada
+# respuesta es esa versión: un cliente que la envía en If-None-Match recibe
+# 304 sin que se recalcule ni se serialice nada.
+RESPONSE_CACHE_ENTRIES = int(os.environ.get("API_RESPONSE_CACHE_ENTRIES", "1024"))
+# Cada cuánto (s) se relee data_version de la BD para ver escrituras de otros
+# procesos (UI, ETL); las escrituras de la propia API invalidan al momento.
+DATA_VERSION_TTL_SECONDS = float(os.environ.get("API_DATA_VERSION_TTL", "1"))
+# max-age de Cache-Control; con 0 los clientes revalidan siempre con el ETag
+CACHE_MAX_AGE_SECONDS = int(os.environ.get("API_CACHE_MAX_AGE", "0"))
+
+# Cabeceras de la respuesta original que se guardan con el cuerpo
+_STORED_HEADERS = ("content-type", "x-next-cursor")
+
+CacheKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    version: int
+    body: bytes
+    headers: Dict[str, str]
+
+
+class DataVersion:
+    """
+    Última versión de los datos conocida por el proceso. Se relee de la BD
+    (con `loader`) como mucho una vez cada `ttl_seconds`, o en la siguiente
+    petición tras invalidate().
+
+    `on_change(old, new)` se llama al ver una versión distinta de la anterior
+    (escrituras propias o de otros procesos), antes de que current() la
+    devuelva: así las cachés en memoria derivadas de los datos se descartan
+    antes de calcular ninguna respuesta con el ETag nuevo. Se ejecuta con el
+    lock tomado, así que no debe bloquear (nada de esperar a otros locks ni
+    reentrenar modelos).
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], int],
+        ttl_seconds: float = DATA_VERSION_TTL_SECONDS,
+        on_change: Optional[Callable[[int, int], None]] = None,
+    ):
+        self._loader = loader
+        self.ttl_seconds = ttl_seconds
+        self._on_change = on_change
+        self._version: Optional[int] = None
+        self._last_seen: Optional[int] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> int:
+        with self._lock:
+            if self._version is None or time.monotonic() - self._loaded_at >= self.ttl_seconds:
+                version = self._loader()
+                if self._on_change is not None and self._last_seen is not None and version != self._last_seen:
+                    self._on_change(self._last_seen, version)
+                self._version = self._last_seen = version
+                self._loaded_at = time.monotonic()
+            return self._version
+
+    def is_fresh(self) -> bool:
+        """True si current() no necesita ir a la BD."""
+        return self._version is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version = None
+
+
+class ResponseCache:
+    """LRU de respuestas por (ruta, parámetros de la query), con la versión de los datos de cada una."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[CacheKey, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(request: Request) -> CacheKey:
+        return request.url.path, tuple(sorted(request.query_params.multi_items()))
+
+    def get(self, key: CacheKey, version: int) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: CacheKey, entry: CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def etag_for(version: int) -> str:
+    return f'"{version}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCacheMiddleware(BaseHTTPMiddleware):
+    """
+    Sirve desde `cache` las peticiones GET a las rutas de `rules`
+    [(patrón, Cache-Control)] mientras no cambie la versión de los datos.
+
+    - Respuesta cacheada con la versión vigente -> se devuelve tal cual, o
+      304 sin cuerpo si If-None-Match trae el ETag vigente.
+    - Si no, se ejecuta el endpoint y, si responde 200, se guarda (y se
+      responde 304 si el ETag coincide). Los errores se devuelven siempre.
+    """
+
+    def __init__(
+        self,
+        app,
+        cache: ResponseCache,
+        data_version: DataVersion,
+        rules: Sequence[Tuple[str, str]],
+        run_blocking: Callable,
+    ):
+        super().__init__(app)
+        self.cache = cache
+        self.data_version = data_version
+        self.rules: Sequence[Tuple[Pattern, str]] = [(re.compile(p), cc) for p, cc in rules]
+        self._run_blocking = run_blocking
+
+    def _cache_control(self, path: str) -> Optional[str]:
+        for pattern, cache_control in self.rules:
+            if pattern.fullmatch(path):
+                return cache_control
+        return None
+
+    async def dispatch(self, request: Request, call_next):
+        cache_control = self._cache_control(request.url.path) if request.method == "GET" else None
+        if cache_control is None:
+            return await call_next(request)
+
+        if self.data_version.is_fresh():
+            version = self.data_version.current()
+        else:
+            # Lectura de la BD: fuera del event loop
+            try:
+                version = await self._run_blocking(self.data_version.current)
+            except HTTPException as exc:
+                # (las excepciones de un middleware no pasan por los handlers de FastAPI)
+                return JSONResponse({"detail": exc.detail}, status_code=exc.status_code, headers=exc.headers)
+
+        etag = etag_for(version)
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        not_modified = _etag_matches(request.headers.get("if-none-match"), etag)
+
+        # Solo se responde 304 sin ejecutar el endpoint si esta misma petición
+        # ya respondió 200 con la versión vigente: un ETag que coincide no
+        # dice nada de un recurso inexistente (p. ej. /books/99999999 -> 404).
+        key = ResponseCache.key(request)
+        entry = self.cache.get(key, version)
+        if entry is not None:
+            if not_modified:
+                return Response(status_code=304, headers=headers)
+            return Response(content=entry.body, headers={**entry.headers, **headers, "X-Cache": "HIT"})
+
+        response = await call_next(request)
+        if response.status_code != 200:
+            return response
+
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        stored = {k: v for k, v in response.headers.items() if k.lower() in _STORED_HEADERS}
+        self.cache.put(key, CachedResponse(version=version, body=body, headers=stored))
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+        return Response(
+            content=body,
+            status_code=200,
+            headers={**stored, **headers, "X-Cache": "MISS"},
+        )
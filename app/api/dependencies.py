@@ -1,23 +1,114 @@
+import os
 from pathlib import Path
-from typing import Optional  # <-- AÑADIDO
-from sqlalchemy import create_engine
+from typing import Optional
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
 
-# Raíz del proyecto y ruta a la BD SQLite
+# Raíz del proyecto y ruta a la BD SQLite (LIBRARY_DB_PATH para usar otra, p. ej. en los tests)
 BASE_DIR = Path(__file__).resolve().parents[2]
-DB_PATH = BASE_DIR / "app" / "db" / "library.db"
+DB_PATH = Path(os.environ.get("LIBRARY_DB_PATH", BASE_DIR / "app" / "db" / "library.db"))
+
+# Configuración de las conexiones (variables de entorno)
+POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "8"))
+MAX_OVERFLOW = int(os.environ.get("SQLITE_MAX_OVERFLOW", "8"))
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "65536"))
+MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 2**20)))
+
+_engine: Optional[Engine] = None
+_read_engine: Optional[Engine] = None
+
+
+def _connect_pragmas(read_only: bool) -> list:
+    pragmas = [
+        f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+        f"PRAGMA cache_size = -{CACHE_SIZE_KB}",
+        f"PRAGMA mmap_size = {MMAP_SIZE}",
+        "PRAGMA temp_store = MEMORY",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only = ON")
+    else:
+        # WAL: los lectores no se bloquean mientras se escribe un rating (y
+        # viceversa). Con WAL, synchronous=NORMAL es seguro ante caídas del
+        # proceso y evita un fsync por transacción.
+        pragmas += ["PRAGMA journal_mode = WAL", "PRAGMA synchronous = NORMAL"]
+    return pragmas
+
+
+def create_sqlite_engine(
+    db_path: Path = DB_PATH,
+    read_only: bool = False,
+    pool_size: int = POOL_SIZE,
+    max_overflow: int = MAX_OVERFLOW,
+) -> Engine:
+    """
+    Engine de SQLAlchemy para la BD SQLite con un pool de conexiones real
+    (QueuePool) y los PRAGMA de rendimiento aplicados al abrir cada conexión.
+
+    Con read_only=True las conexiones se abren con mode=ro: no pueden
+    escribir y, en modo WAL, leen sin esperar a las escrituras.
+    """
+    if read_only:
+        url = f"sqlite:///file:{quote(Path(db_path).as_posix())}?mode=ro&uri=true"
+    else:
+        url = f"sqlite:///{db_path}"
 
-_engine: Optional[Engine] = None   # <-- sustituye Engine | None por Optional[Engine]
+    engine = create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        connect_args={
+            "check_same_thread": False,  # necesario para FastAPI + SQLite
+            "timeout": BUSY_TIMEOUT_MS / 1000,
+        },
+    )
+    pragmas = _connect_pragmas(read_only)
+
+    @event.listens_for(engine, "connect")
+    def _apply_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for pragma in pragmas:
+            cur.execute(pragma)
+        cur.close()
+
+    return engine
 
 
 def get_engine() -> Engine:
     """
-    Devuelve un engine de SQLAlchemy reutilizable.
+    Devuelve el engine de lectura/escritura compartido (API, UI, recomendador, ETL de precálculo).
     """
     global _engine
     if _engine is None:
-        _engine = create_engine(
-            f"sqlite:///{DB_PATH}",
-            connect_args={"check_same_thread": False},  # necesario para FastAPI + SQLite
-        )
+        _engine = create_sqlite_engine()
     return _engine
+
+
+def get_read_engine() -> Engine:
+    """
+    Devuelve el engine compartido de solo lectura, para las rutas que no escriben.
+    """
+    global _read_engine
+    if _read_engine is None:
+        if DB_PATH.exists():
+            # journal_mode=WAL solo se puede activar con una conexión de
+            # escritura; se hace una vez antes de abrir las de solo lectura
+            with get_engine().connect():
+                pass
+        _read_engine = create_sqlite_engine(read_only=True)
+    return _read_engine
+
+
+def dispose_engines() -> None:
+    """
+    Descarta las conexiones abiertas de los engines compartidos sin cerrarlas
+    (tras un fork, las del proceso padre no deben reutilizarse).
+    """
+    for engine in (_engine, _read_engine):
+        if engine is not None:
+            engine.dispose(close=False)
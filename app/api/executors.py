@@ -0,0 +1,96 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional
+
+from fastapi import HTTPException, status
+
+# Ejecutores de la API async, configurables por variables de entorno:
+# - API_DB_THREADS: hilos para las consultas a SQLite (lecturas por clave,
+#   listados, escrituras de ratings).
+# - API_RECOMMENDER_WORKERS / API_RECOMMENDER_EXECUTOR: pool aparte para el
+#   cálculo de recomendaciones, de hilos ("thread") o de procesos ("process").
+#   Con procesos cada uno tiene sus propias cachés del recomendador, que
+#   pueden ir hasta RECOMMENDER_CACHE_TTL segundos por detrás de los ratings
+#   recién escritos.
+# - API_*_MAX_PENDING: tareas como máximo en curso o en cola por pool; por
+#   encima se responde 503 en vez de acumular peticiones (backpressure).
+DB_THREADS = int(os.environ.get("API_DB_THREADS", "8"))
+DB_MAX_PENDING = int(os.environ.get("API_DB_MAX_PENDING", "256"))
+RECOMMENDER_WORKERS = int(os.environ.get("API_RECOMMENDER_WORKERS", "2"))
+RECOMMENDER_EXECUTOR = os.environ.get("API_RECOMMENDER_EXECUTOR", "thread")
+RECOMMENDER_MAX_PENDING = int(os.environ.get("API_RECOMMENDER_MAX_PENDING", "16"))
+
+# Segundos sugeridos al cliente (cabecera Retry-After) cuando un pool está lleno
+RETRY_AFTER_SECONDS = 1
+
+
+class Bulkhead:
+    """
+    Pool de ejecución acotado para trabajo bloqueante desde endpoints async.
+
+    Cada tipo de trabajo (BD, recomendador) tiene su propio pool, de forma
+    que los cálculos lentos no ocupan los hilos de las consultas baratas. Si
+    ya hay `max_pending` tareas en curso o en cola, run() rechaza la
+    petición con 503.
+    """
+
+    def __init__(self, name: str, executor_factory: Callable[[], Executor], max_pending: int):
+        self.name = name
+        self.max_pending = max_pending
+        self._executor_factory = executor_factory
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        # Solo se modifica desde el hilo del event loop: no hace falta lock
+        if self._pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Servicio saturado ({self.name}); reintente en unos segundos",
+                headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+            )
+        if self._executor is None:
+            self._executor = self._executor_factory()
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+def _recommender_executor() -> Executor:
+    if RECOMMENDER_EXECUTOR == "process":
+        # spawn: no se hereda el estado (hilos, conexiones) del proceso de la API
+        return ProcessPoolExecutor(
+            max_workers=RECOMMENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return ThreadPoolExecutor(max_workers=RECOMMENDER_WORKERS, thread_name_prefix="recommender")
+
+
+db_pool = Bulkhead(
+    "bd",
+    lambda: ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db"),
+    DB_MAX_PENDING,
+)
+recommender_pool = Bulkhead("recomendador", _recommender_executor, RECOMMENDER_MAX_PENDING)
+
+
+def shutdown_executors() -> None:
+    """Cierra los pools (al parar la API)."""
+    db_pool.shutdown()
+    recommender_pool.shutdown()
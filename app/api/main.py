@@ -1,19 +1,106 @@
-from typing import List, Optional
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Dict, List, Optional, Tuple
 
-from fastapi import FastAPI, HTTPException, Query, status
+from fastapi import FastAPI, HTTPException, Query, Response, status
 from pydantic import BaseModel, Field
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
+
+from app.api.cache import (
+    CACHE_MAX_AGE_SECONDS,
+    DataVersion,
+    ResponseCache,
+    ResponseCacheMiddleware,
+)
+from app.api.dependencies import get_engine, get_read_engine
+from app.api.executors import db_pool, recommender_pool, shutdown_executors
+from app.api.pagination import (
+    CATALOG_ORDER,
+    KEYSET_CONDITION,
+    NEXT_CURSOR_HEADER,
+    encode_cursor,
+    keyset_params,
+)
+from app.api.responses import FastJSONResponse, frame_records, row_records
+from app.api.search import BM25_WEIGHTS, BOOK_FTS_TABLE, fts_match_expression
+from app.api.write_queue import RATING_WRITE_MODE, RatingWriteQueue
+from app.recommender.collaborative import (
+    RecommendationMethod,
+    get_recommendations_for_user,
+    get_recommendations_for_users,
+)
+from app.recommender.book_stats import save_rating, save_ratings
+from app.recommender.dashboard import load_dashboard_agg
+from app.recommender.item_cf import note_data_version as note_item_cf_data_version
+from app.recommender.popularity import get_top_books_global, invalidate_popularity_cache
+from app.recommender.tables import get_data_version, has_table
+from app.recommender.user_recs import get_precomputed_recommendations
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    rating_queue.close()
+    shutdown_executors()
 
-from app.api.dependencies import get_engine
-from app.recommender.collaborative import get_recommendations_for_user
 
 app = FastAPI(
+    lifespan=lifespan,
     title="Book Recommender API",
     description="API para catálogo y recomendaciones de la biblioteca",
     version="0.1.0",
 )
 
 engine = get_engine()
+read_engine = get_read_engine()
+
+
+def _load_data_version() -> int:
+    with read_engine.connect() as conn:
+        return get_data_version(conn)
+
+
+def _on_data_version_change(old: int, new: int) -> None:
+    # Otro proceso (ETL, UI, reentrenamiento) o esta API han cambiado los datos:
+    # las cachés en memoria se descartan antes de servir el ETag nuevo. Se
+    # llama con el lock de DataVersion tomado, así que nada de esperar aquí:
+    # item-CF solo anota la versión (se reentrena en segundo plano) y ALS se
+    # recarga solo cuando cambia su meta.json.
+    invalidate_popularity_cache()
+    note_item_cf_data_version(new)
+
+
+# Caché de respuestas GET con ETag = versión de los datos (ver app/api/cache.py)
+data_version = DataVersion(loader=_load_data_version, on_change=_on_data_version_change)
+response_cache = ResponseCache()
+app.add_middleware(
+    ResponseCacheMiddleware,
+    cache=response_cache,
+    data_version=data_version,
+    rules=[
+        (r"/books(/\d+)?", f"public, max-age={CACHE_MAX_AGE_SECONDS}, must-revalidate"),
+        (r"/stats", f"public, max-age={CACHE_MAX_AGE_SECONDS}, must-revalidate"),
+        (r"/users/\d+/recommendations", f"private, max-age={CACHE_MAX_AGE_SECONDS}, must-revalidate"),
+    ],
+    run_blocking=db_pool.run,
+)
+
+
+def _after_rating_writes() -> None:
+    # Las estadísticas cacheadas en memoria y las respuestas cacheadas ya no son válidas
+    invalidate_popularity_cache()
+    data_version.invalidate()
+
+
+def _flush_ratings(ratings: Dict[Tuple[int, int], int]) -> int:
+    with engine.begin() as conn:
+        written = save_ratings(conn, ratings)
+    _after_rating_writes()
+    return written
+
+
+# Cola de escritura por lotes de ratings (modos "batch" y "async", ver app/api/write_queue.py)
+rating_queue = RatingWriteQueue(_flush_ratings)
 
 
 # ---------- MODELOS Pydantic ----------
@@ -36,6 +123,47 @@ class RecommendationOut(BaseModel):
     score: float
 
 
+class BatchRecommendationIn(BaseModel):
+    user_ids: List[int] = Field(..., min_length=1, max_length=10000)
+    n: int = Field(10, ge=1, le=50)
+    min_ratings: int = Field(20, ge=1, le=1000)
+    method: RecommendationMethod = "popularity"
+
+
+class UserRecommendationsOut(BaseModel):
+    user_id: int
+    recommendations: List[RecommendationOut]
+
+
+class BatchRecommendationOut(BaseModel):
+    results: List[UserRecommendationsOut]
+    unknown_user_ids: List[int]
+
+
+class AgeCountOut(BaseModel):
+    age: int
+    num_users: int
+
+
+class YearCountOut(BaseModel):
+    year: int
+    num_books: int
+
+
+class StatsOut(BaseModel):
+    n_users: int
+    n_books: int
+    n_ratings: int
+    top_books: List[RecommendationOut]
+    users_by_age: List[AgeCountOut]
+    books_by_year: List[YearCountOut]
+
+
+# Campos de las respuestas que se serializan sin construir los modelos (ver app/api/responses.py)
+BOOK_FIELDS = tuple(BookOut.model_fields)
+RECOMMENDATION_FIELDS = tuple(RecommendationOut.model_fields)
+
+
 class RatingIn(BaseModel):
     user_id: int
     copy_id: int
@@ -49,63 +177,125 @@ class RatingOut(BaseModel):
     rating: int
 
 
+class RatingBatchIn(BaseModel):
+    ratings: List[RatingIn] = Field(..., min_length=1, max_length=10000)
+
+
+class RatingBatchOut(BaseModel):
+    # Ratings aceptados (los de USER y COPY existentes); si un mismo
+    # (user_id, copy_id) se repite, cuenta una vez y gana el último
+    accepted: int
+    unknown_user_ids: List[int]
+    unknown_copy_ids: List[int]
+    # True si al responder los ratings ya están escritos en la BD
+    committed: bool
+
+
 # ---------- ENDPOINTS ----------
 
 @app.get("/books", response_model=List[BookOut])
-def list_books(
+async def list_books(
     q: Optional[str] = Query(None, description="Buscar en título o autores"),
     language_code: Optional[str] = Query(None, description="Filtrar por código de idioma (ej. 'eng')"),
     year_from: Optional[int] = Query(None, description="Año mínimo de publicación"),
     year_to: Optional[int] = Query(None, description="Año máximo de publicación"),
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(
+        None,
+        description=f"Cursor de la página siguiente (cabecera {NEXT_CURSOR_HEADER} de la respuesta anterior)",
+    ),
 ):
     """
     Lista de libros con filtros básicos.
+
+    Con `q` se busca en el índice de texto completo BOOK_FTS (título, título
+    original y autores, sin distinguir acentos) y los resultados se ordenan
+    por relevancia (bm25). Si la BD no tiene el índice se usa LIKE.
+
+    Sin `q` el listado admite paginación por cursor: si hay más resultados,
+    la respuesta incluye la cabecera X-Next-Cursor, que se pasa como
+    `cursor` para pedir la página siguiente (coste constante sea cual sea la
+    página, a diferencia de `offset`).
     """
-    sql = """
-    SELECT
-        book_id,
-        title,
-        authors,
-        language_code,
-        original_publication_year
-    FROM BOOK
-    WHERE 1=1
-    """
-    params: dict = {}
+    if cursor is not None and (q or offset):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="cursor no se puede combinar con q ni con offset",
+        )
+    try:
+        params: dict = keyset_params(cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+
+    def query():
+        with read_engine.connect() as conn:
+            match = fts_match_expression(q) if q else None
+            use_fts = match is not None and has_table(conn, BOOK_FTS_TABLE)
+
+            sql = """
+            SELECT
+                b.book_id,
+                b.title,
+                b.authors,
+                b.language_code,
+                b.original_publication_year
+            """
+
+            if use_fts:
+                sql += """
+                FROM BOOK_FTS f
+                JOIN BOOK b ON b.book_id = f.rowid
+                WHERE BOOK_FTS MATCH :match
+                """
+                params["match"] = match
+            else:
+                sql += " FROM BOOK b WHERE 1=1"
+                if q:
+                    sql += " AND (LOWER(b.title) LIKE :q OR LOWER(b.authors) LIKE :q)"
+                    params["q"] = f"%{q.lower()}%"
 
-    if q:
-        sql += " AND (LOWER(title) LIKE :q OR LOWER(authors) LIKE :q)"
-        params["q"] = f"%{q.lower()}%"
+            if language_code:
+                sql += " AND b.language_code = :lang"
+                params["lang"] = language_code
 
-    if language_code:
-        sql += " AND language_code = :lang"
-        params["lang"] = language_code
+            if year_from is not None:
+                sql += " AND b.original_publication_year >= :y_from"
+                params["y_from"] = year_from
 
-    if year_from is not None:
-        sql += " AND original_publication_year >= :y_from"
-        params["y_from"] = year_from
+            if year_to is not None:
+                sql += " AND b.original_publication_year <= :y_to"
+                params["y_to"] = year_to
 
-    if year_to is not None:
-        sql += " AND original_publication_year <= :y_to"
-        params["y_to"] = year_to
+            if cursor is not None:
+                sql += KEYSET_CONDITION
 
-    sql += """
-    ORDER BY COALESCE(original_publication_year, 0) DESC, title ASC
-    LIMIT :limit OFFSET :offset
-    """
-    params["limit"] = limit
-    params["offset"] = offset
+            if use_fts:
+                weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+                sql += f" ORDER BY bm25(BOOK_FTS, {weights}), b.book_id"
+            else:
+                sql += f" {CATALOG_ORDER}"
+
+            # Se pide una fila de más para saber si hay página siguiente
+            sql += " LIMIT :limit OFFSET :offset"
+            params["limit"] = limit + 1
+            params["offset"] = offset
 
-    with engine.connect() as conn:
-        rows = conn.execute(text(sql), params).mappings().all()
+            return conn.execute(text(sql), params).mappings().all()
 
-    return [BookOut(**row) for row in rows]
+    rows = await db_pool.run(query)
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if not q:
+            headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1])
+
+    # Las filas ya tienen los campos de BookOut: se serializan sin pasar por el modelo
+    return FastJSONResponse(row_records(rows, BOOK_FIELDS), headers=headers)
 
 
 @app.get("/books/{book_id}", response_model=BookOut)
-def get_book(book_id: int):
+async def get_book(book_id: int):
     """
     Detalle de un libro por book_id.
     """
@@ -120,9 +310,11 @@ def get_book(book_id: int):
     WHERE book_id = :id
     """
 
-    with engine.connect() as conn:
-        row = conn.execute(text(sql), {"id": book_id}).mappings().first()
+    def query():
+        with read_engine.connect() as conn:
+            return conn.execute(text(sql), {"id": book_id}).mappings().first()
 
+    row = await db_pool.run(query)
     if not row:
         raise HTTPException(status_code=404, detail="Book not found")
 
@@ -133,92 +325,252 @@ def get_book(book_id: int):
     "/users/{user_id}/recommendations",
     response_model=List[RecommendationOut],
 )
-def user_recommendations(
+async def user_recommendations(
     user_id: int,
     n: int = Query(10, ge=1, le=50),
     min_ratings: int = Query(20, ge=1, le=1000),
+    method: RecommendationMethod = Query(
+        "popularity",
+        description="Método: 'popularity' (baseline), 'item_cf' (colaborativo item-based) o 'als' (factorización)",
+    ),
 ):
     """
     Recomendaciones para un usuario.
 
-    Usa la función get_recommendations_for_user del módulo collaborative,
-    que aplica un baseline basado en popularidad filtrando libros ya leídos.
+    Si hay precálculo en USER_RECS (python -m app.etl.precompute_recs) se sirve
+    desde ahí; si no (usuario nuevo o con ratings posteriores), se calcula en
+    vivo con get_recommendations_for_user del módulo collaborative: por
+    defecto un baseline basado en popularidad filtrando libros ya leídos,
+    o los modelos colaborativos con method=item_cf / method=als.
+    """
+    def query():
+        # Comprobamos que el usuario existe
+        with read_engine.connect() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM USER WHERE user_id = :uid"),
+                {"uid": user_id},
+            ).first()
+
+            if not exists:
+                raise HTTPException(status_code=404, detail="User not found")
+
+            return get_precomputed_recommendations(
+                conn, user_id=user_id, n=n, min_ratings=min_ratings, method=method
+            )
+
+    df = await db_pool.run(query)
+    if df is None:
+        # Cálculo en vivo en el pool del recomendador (no ocupa los hilos de BD)
+        df = await recommender_pool.run(
+            get_recommendations_for_user, user_id=user_id, n=n, min_ratings=min_ratings, method=method
+        )
+    return FastJSONResponse(frame_records(df, RECOMMENDATION_FIELDS))
+
+
+@app.get("/stats", response_model=StatsOut)
+async def stats(
+    top_n: int = Query(10, ge=1, le=50),
+    min_ratings: int = Query(50, ge=1, le=1000),
+):
+    """
+    Estadísticas de uso para dashboards: nº de usuarios, libros y ratings,
+    libros más populares, usuarios por edad y libros por año de publicación.
+
+    Los agregados se leen de la tabla precalculada DASHBOARD_AGG y el top de
+    la caché de popularidad (BOOK_STATS), sin recorrer RATING.
     """
-    # Comprobamos que el usuario existe
-    with engine.connect() as conn:
-        exists = conn.execute(
-            text("SELECT 1 FROM USER WHERE user_id = :uid"),
-            {"uid": user_id},
-        ).first()
+    def query():
+        with read_engine.connect() as conn:
+            return load_dashboard_agg(conn)
+
+    aggregates = await db_pool.run(query)
+    top = await db_pool.run(get_top_books_global, n=top_n, min_ratings=min_ratings)
+    reference_year = date.today().year
+    return FastJSONResponse(
+        {
+            "n_users": aggregates.n_users,
+            "n_books": aggregates.n_books,
+            "n_ratings": aggregates.n_ratings,
+            "top_books": frame_records(top, RECOMMENDATION_FIELDS),
+            "users_by_age": [
+                {"age": age, "num_users": count}
+                for age, count in aggregates.users_by_age(reference_year).items()
+            ],
+            "books_by_year": [
+                {"year": year, "num_books": count} for year, count in aggregates.books_by_year.items()
+            ],
+        }
+    )
 
-    if not exists:
-        raise HTTPException(status_code=404, detail="User not found")
 
-    df = get_recommendations_for_user(user_id=user_id, n=n, min_ratings=min_ratings)
-    if df.empty:
-        return []
+@app.post("/recommendations/batch", response_model=BatchRecommendationOut)
+async def batch_recommendations(payload: BatchRecommendationIn):
+    """
+    Recomendaciones para muchos usuarios en una sola llamada
+    (campañas de email, precálculo masivo).
 
-    records = df.to_dict(orient="records")
-    return [RecommendationOut(**rec) for rec in records]
+    Los user_id que no existen en USER se devuelven en `unknown_user_ids`.
+    """
+    requested = sorted(set(payload.user_ids))
+
+    def query():
+        with read_engine.connect() as conn:
+            return set(
+                conn.execute(
+                    text("SELECT user_id FROM USER WHERE user_id IN :uids").bindparams(
+                        bindparam("uids", expanding=True)
+                    ),
+                    {"uids": requested},
+                ).scalars()
+            )
+
+    known = await db_pool.run(query)
+    user_ids = [uid for uid in requested if uid in known]
+    df = await recommender_pool.run(
+        get_recommendations_for_users,
+        user_ids, n=payload.n, min_ratings=payload.min_ratings, method=payload.method,
+    )
+
+    grouped = {}
+    for rec in frame_records(df, ("user_id",) + RECOMMENDATION_FIELDS):
+        grouped.setdefault(rec.pop("user_id"), []).append(rec)
+    return FastJSONResponse(
+        {
+            "results": [
+                {"user_id": uid, "recommendations": grouped.get(uid, [])} for uid in user_ids
+            ],
+            "unknown_user_ids": [uid for uid in requested if uid not in known],
+        }
+    )
+
+
+def _unknown_ids(conn, user_ids: List[int], copy_ids: List[int]) -> Tuple[List[int], List[int]]:
+    """user_id y copy_id de la lista que no existen en USER / COPY."""
+    found = {}
+    for table, column, ids in (("USER", "user_id", user_ids), ("COPY", "copy_id", copy_ids)):
+        found[table] = set(
+            conn.execute(
+                text(f"SELECT {column} FROM {table} WHERE {column} IN :ids").bindparams(
+                    bindparam("ids", expanding=True)
+                ),
+                {"ids": ids},
+            ).scalars()
+        )
+    return (
+        [uid for uid in user_ids if uid not in found["USER"]],
+        [cid for cid in copy_ids if cid not in found["COPY"]],
+    )
 
 
 @app.post("/ratings", response_model=RatingOut, status_code=status.HTTP_201_CREATED)
-def create_or_update_rating(payload: RatingIn):
+async def create_or_update_rating(payload: RatingIn, response: Response):
     """
     Inserta o actualiza una valoración de usuario sobre una copia.
 
     - Valida que existan USER y COPY.
     - Si ya existe rating para (user_id, copy_id), lo actualiza.
     - Si no, inserta uno nuevo.
+    - Mantiene BOOK_STATS actualizada aplicando el delta del rating.
+
+    Según API_RATING_WRITE_MODE el rating se escribe en su propia transacción
+    ("sync"), en el siguiente lote esperando a su commit ("batch") o en el
+    siguiente lote sin esperar ("async", responde 202 Accepted).
     """
-    params = {
-        "uid": payload.user_id,
-        "cid": payload.copy_id,
-        "rating": payload.rating,
-    }
+    if RATING_WRITE_MODE != "sync":
+        def validate():
+            with read_engine.connect() as conn:
+                return _unknown_ids(conn, [payload.user_id], [payload.copy_id])
 
-    with engine.begin() as conn:
-        # Comprobar existencia de COPY
-        copy_exists = conn.execute(
-            text("SELECT 1 FROM COPY WHERE copy_id = :cid"),
-            {"cid": payload.copy_id},
-        ).first()
-        if not copy_exists:
+        unknown_users, unknown_copies = await db_pool.run(validate)
+        if unknown_copies:
             raise HTTPException(status_code=400, detail="copy_id does not exist")
-
-        # Comprobar existencia de USER
-        user_exists = conn.execute(
-            text("SELECT 1 FROM USER WHERE user_id = :uid"),
-            {"uid": payload.user_id},
-        ).first()
-        if not user_exists:
+        if unknown_users:
             raise HTTPException(status_code=400, detail="user_id does not exist")
 
-        # Intentar actualizar primero
-        result = conn.execute(
-            text(
-                """
-                UPDATE RATING
-                SET rating = :rating
-                WHERE user_id = :uid AND copy_id = :cid
-                """
-            ),
-            params,
-        )
-        if result.rowcount == 0:
-            # Si no había fila, insertamos
-            conn.execute(
-                text(
-                    """
-                    INSERT INTO RATING (user_id, copy_id, rating)
-                    VALUES (:uid, :cid, :rating)
-                    """
-                ),
-                params,
-            )
+        done = rating_queue.submit([(payload.user_id, payload.copy_id, payload.rating)])
+        if RATING_WRITE_MODE == "batch":
+            await asyncio.wrap_future(done)
+        else:
+            response.status_code = status.HTTP_202_ACCEPTED
+        return RatingOut(user_id=payload.user_id, copy_id=payload.copy_id, rating=payload.rating)
+
+    def write():
+        with engine.begin() as conn:
+            # Comprobar existencia de COPY
+            copy_exists = conn.execute(
+                text("SELECT 1 FROM COPY WHERE copy_id = :cid"),
+                {"cid": payload.copy_id},
+            ).first()
+            if not copy_exists:
+                raise HTTPException(status_code=400, detail="copy_id does not exist")
+
+            # Comprobar existencia de USER
+            user_exists = conn.execute(
+                text("SELECT 1 FROM USER WHERE user_id = :uid"),
+                {"uid": payload.user_id},
+            ).first()
+            if not user_exists:
+                raise HTTPException(status_code=400, detail="user_id does not exist")
+
+            # Insertar o actualizar el rating, manteniendo BOOK_STATS por deltas
+            save_rating(conn, payload.user_id, payload.copy_id, payload.rating)
+
+    await db_pool.run(write)
+    _after_rating_writes()
 
     return RatingOut(
         user_id=payload.user_id,
         copy_id=payload.copy_id,
         rating=payload.rating,
     )
+
+
+@app.post("/ratings/batch", response_model=RatingBatchOut, status_code=status.HTTP_201_CREATED)
+async def create_or_update_ratings(payload: RatingBatchIn, response: Response):
+    """
+    Inserta o actualiza muchas valoraciones en una sola llamada, con un único
+    INSERT ... ON CONFLICT DO UPDATE por lote y BOOK_STATS actualizada con los
+    deltas agregados por libro.
+
+    Los ratings de usuarios o copias inexistentes se descartan y sus ids se
+    devuelven en `unknown_user_ids` / `unknown_copy_ids`. La durabilidad
+    sigue API_RATING_WRITE_MODE, como en POST /ratings (en "async" se
+    responde 202 con committed=false).
+    """
+    ratings: Dict[Tuple[int, int], int] = {
+        (r.user_id, r.copy_id): r.rating for r in payload.ratings
+    }
+    user_ids = sorted({uid for uid, _ in ratings})
+    copy_ids = sorted({cid for _, cid in ratings})
+
+    def validate():
+        with read_engine.connect() as conn:
+            return _unknown_ids(conn, user_ids, copy_ids)
+
+    unknown_users, unknown_copies = await db_pool.run(validate)
+    if unknown_users or unknown_copies:
+        skip_users, skip_copies = set(unknown_users), set(unknown_copies)
+        ratings = {
+            (uid, cid): rating
+            for (uid, cid), rating in ratings.items()
+            if uid not in skip_users and cid not in skip_copies
+        }
+
+    committed = True
+    if ratings:
+        if RATING_WRITE_MODE == "sync":
+            await db_pool.run(_flush_ratings, ratings)
+        else:
+            done = rating_queue.submit((uid, cid, rating) for (uid, cid), rating in ratings.items())
+            if RATING_WRITE_MODE == "batch":
+                await asyncio.wrap_future(done)
+            else:
+                committed = False
+                response.status_code = status.HTTP_202_ACCEPTED
+
+    return RatingBatchOut(
+        accepted=len(ratings),
+        unknown_user_ids=unknown_users,
+        unknown_copy_ids=unknown_copies,
+        committed=committed,
+    )
@@ -0,0 +1,52 @@
+import base64
+import json
+from typing import Optional, Tuple
+
+# Paginación por cursor (keyset) del catálogo /books.
+# El orden del listado es (COALESCE(año, 0) DESC, title, book_id), cubierto por
+# el índice idx_book_year_title; el cursor guarda la clave de la última fila
+# devuelta y la página siguiente empieza justo después con una búsqueda en el
+# índice, sin recorrer las filas anteriores como hace OFFSET.
+
+# Cabecera de respuesta con el cursor de la página siguiente
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+CatalogKey = Tuple[int, str, int]
+
+# Condición "fila posterior al cursor" en el orden del catálogo
+KEYSET_CONDITION = """
+    AND COALESCE(b.original_publication_year, 0) <= :c_year
+    AND (
+        COALESCE(b.original_publication_year, 0) < :c_year
+        OR (b.title, b.book_id) > (:c_title, :c_id)
+    )
+"""
+
+CATALOG_ORDER = "ORDER BY COALESCE(b.original_publication_year, 0) DESC, b.title ASC, b.book_id ASC"
+
+
+def encode_cursor(row) -> str:
+    """Cursor opaco (base64 url-safe) a partir de la última fila de una página."""
+    key = [row["original_publication_year"] or 0, row["title"], row["book_id"]]
+    raw = json.dumps(key, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> CatalogKey:
+    """Clave (año, título, book_id) de un cursor. Lanza ValueError si no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        year, title, book_id = json.loads(raw.decode("utf-8"))
+    except (ValueError, TypeError) as exc:
+        raise ValueError("Cursor no válido") from exc
+    if not (isinstance(year, int) and isinstance(title, str) and isinstance(book_id, int)):
+        raise ValueError("Cursor no válido")
+    return year, title, book_id
+
+
+def keyset_params(cursor: Optional[str]) -> dict:
+    """Parámetros de KEYSET_CONDITION para `cursor` ({} si no hay cursor)."""
+    if cursor is None:
+        return {}
+    year, title, book_id = decode_cursor(cursor)
+    return {"c_year": year, "c_title": title, "c_id": book_id}
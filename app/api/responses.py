@@ -0,0 +1,58 @@
+import json
+from typing import Any, Iterable, List, Sequence
+
+import numpy as np
+import pandas as pd
+from starlette.responses import JSONResponse
+
+# Serialización rápida de las respuestas JSON de la API.
+# Los endpoints de listados devuelven directamente filas / columnas ya con los
+# campos de su response_model, sin construir un modelo Pydantic por fila ni
+# que FastAPI los vuelva a validar: response_model sigue declarado en cada
+# ruta, así que el esquema OpenAPI no cambia. Se usa orjson si está instalado
+# (dependencia opcional) y, si no, json de la biblioteca estándar.
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depende del entorno
+    orjson = None
+
+
+def _default(value: Any):
+    # Escalares de NumPy que json no sabe serializar
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Tipo no serializable a JSON: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """JSON (UTF-8) de `content`, con orjson si está disponible."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse que serializa con dumps() (el contenido ya debe ser JSON nativo)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def row_records(rows: Iterable, fields: Sequence[str]) -> List[dict]:
+    """Filas de SQLAlchemy (mappings) como dicts con solo los campos `fields`."""
+    return [{field: row[field] for field in fields} for row in rows]
+
+
+def frame_records(df: pd.DataFrame, fields: Sequence[str]) -> List[dict]:
+    """
+    Filas de `df` como dicts con las columnas `fields`, convirtiendo cada
+    columna de una vez a tipos de Python (int, float, str, None en vez de NaN)
+    en lugar de recorrer el DataFrame fila a fila.
+    """
+    columns = []
+    for field in fields:
+        values = df[field].to_numpy()
+        if values.dtype == object:
+            values = np.where(pd.isna(values), None, values)
+        columns.append(values.tolist())
+    return [dict(zip(fields, record)) for record in zip(*columns)]
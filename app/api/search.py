@@ -0,0 +1,74 @@
+import re
+from typing import Optional
+
+from sqlalchemy import text
+
+# Índice de texto completo (FTS5) sobre el catálogo para /books?q=.
+# Tabla de contenido externo: el texto vive en BOOK y BOOK_FTS solo guarda el
+# índice invertido; los triggers lo mantienen sincronizado con BOOK.
+# remove_diacritics 2 pliega los acentos: "perez" encuentra "Pérez".
+BOOK_FTS_TABLE = "BOOK_FTS"
+
+# Pesos bm25 por columna (title, original_title, authors)
+BM25_WEIGHTS = (10.0, 5.0, 3.0)
+
+_CREATE_BOOK_FTS = """
+CREATE VIRTUAL TABLE BOOK_FTS USING fts5(
+    title,
+    original_title,
+    authors,
+    content = 'BOOK',
+    content_rowid = 'book_id',
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+_CREATE_BOOK_FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER book_fts_ai AFTER INSERT ON BOOK BEGIN
+        INSERT INTO BOOK_FTS (rowid, title, original_title, authors)
+        VALUES (new.book_id, new.title, new.original_title, new.authors);
+    END
+    """,
+    """
+    CREATE TRIGGER book_fts_ad AFTER DELETE ON BOOK BEGIN
+        INSERT INTO BOOK_FTS (BOOK_FTS, rowid, title, original_title, authors)
+        VALUES ('delete', old.book_id, old.title, old.original_title, old.authors);
+    END
+    """,
+    """
+    CREATE TRIGGER book_fts_au AFTER UPDATE ON BOOK BEGIN
+        INSERT INTO BOOK_FTS (BOOK_FTS, rowid, title, original_title, authors)
+        VALUES ('delete', old.book_id, old.title, old.original_title, old.authors);
+        INSERT INTO BOOK_FTS (rowid, title, original_title, authors)
+        VALUES (new.book_id, new.title, new.original_title, new.authors);
+    END
+    """,
+]
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def build_book_fts(conn) -> None:
+    """
+    (Re)construye BOOK_FTS a partir de BOOK y crea los triggers de
+    sincronización. Se ejecuta en el ETL, después de cargar BOOK.
+    """
+    conn.execute(text(f"DROP TABLE IF EXISTS {BOOK_FTS_TABLE}"))
+    conn.execute(text(_CREATE_BOOK_FTS))
+    conn.execute(text("INSERT INTO BOOK_FTS (BOOK_FTS) VALUES ('rebuild')"))
+    for ddl in _CREATE_BOOK_FTS_TRIGGERS:
+        conn.execute(text(ddl))
+
+
+def fts_match_expression(q: str) -> Optional[str]:
+    """
+    Expresión MATCH para la búsqueda `q`: cada palabra como prefijo y todas
+    obligatorias ("harry pot" -> '"harry"* "pot"*'). Las palabras van entre
+    comillas para que la sintaxis de FTS5 (AND, NEAR, *, ...) no se
+    interprete. Devuelve None si `q` no tiene ninguna palabra.
+    """
+    tokens = _TOKEN_RE.findall(q)
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
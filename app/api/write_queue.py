@@ -0,0 +1,211 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from app.api.executors import RETRY_AFTER_SECONDS
+
+# Escritura de ratings por lotes (write-behind), configurable por entorno:
+# - API_RATING_WRITE_MODE:
+#   "sync"   -> cada petición abre su propia transacción (comportamiento clásico).
+#   "batch"  -> los ratings se encolan y la petición espera al commit del lote
+#               en el que se escriben (group commit): misma durabilidad que
+#               "sync", pero una transacción para muchas peticiones.
+#   "async"  -> se responde 202 en cuanto el rating está en cola; si el proceso
+#               muere antes del siguiente volcado se pierden como mucho los
+#               ratings de los últimos API_RATING_FLUSH_MS.
+# - API_RATING_BATCH_SIZE / API_RATING_FLUSH_MS: el lote se vuelca al llegar a
+#   ese nº de pares (user_id, copy_id) distintos o a esa antigüedad.
+# - API_RATING_MAX_PENDING: por encima de ese nº de ratings en cola (incluido
+#   el lote que se está escribiendo) se responde 503 (backpressure).
+# - API_RATING_FLUSH_RETRIES / API_RATING_RETRY_MS: reintentos de un lote
+#   cuya escritura falla (p. ej. "database is locked"), con espera
+#   exponencial a partir de ese nº de ms.
+RATING_WRITE_MODE = os.environ.get("API_RATING_WRITE_MODE", "sync")
+RATING_BATCH_SIZE = int(os.environ.get("API_RATING_BATCH_SIZE", "500"))
+RATING_FLUSH_MS = int(os.environ.get("API_RATING_FLUSH_MS", "50"))
+RATING_MAX_PENDING = int(os.environ.get("API_RATING_MAX_PENDING", "50000"))
+RATING_FLUSH_RETRIES = int(os.environ.get("API_RATING_FLUSH_RETRIES", "3"))
+RATING_RETRY_MS = int(os.environ.get("API_RATING_RETRY_MS", "100"))
+
+WRITE_MODES = ("sync", "batch", "async")
+if RATING_WRITE_MODE not in WRITE_MODES:
+    raise ValueError(f"API_RATING_WRITE_MODE debe ser uno de {WRITE_MODES}, no {RATING_WRITE_MODE!r}")
+
+RatingKey = Tuple[int, int]
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    def __init__(self):
+        self.ratings: Dict[RatingKey, int] = {}
+        self.created = time.monotonic()
+        self.done: Future = Future()
+
+
+class RatingWriteQueue:
+    """
+    Cola de ratings pendientes de escribir, coalescidos por (user_id, copy_id):
+    si un par se valora varias veces antes del volcado, solo se escribe el
+    último valor.
+
+    Un único hilo escritor vuelca cada lote con `flush_fn(ratings)` en una
+    sola transacción (SQLite admite un escritor a la vez, así que no se gana
+    nada con más). submit() devuelve el Future del lote, que se completa con
+    el resultado de flush_fn tras el commit.
+
+    Si flush_fn falla, el lote se reintenta `max_retries` veces antes de
+    darlo por perdido; cada fallo se registra en el log (en modo "async" el
+    cliente ya tiene su 202 y no vería el error).
+    """
+
+    def __init__(
+        self,
+        flush_fn: Callable[[Dict[RatingKey, int]], int],
+        batch_size: int = RATING_BATCH_SIZE,
+        flush_interval_ms: int = RATING_FLUSH_MS,
+        max_pending: int = RATING_MAX_PENDING,
+        max_retries: int = RATING_FLUSH_RETRIES,
+        retry_ms: int = RATING_RETRY_MS,
+    ):
+        self._flush_fn = flush_fn
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.retry_delay = retry_ms / 1000
+        self._batch: Optional[_Batch] = None
+        # Lote retirado de la cola que el hilo escritor está volcando
+        self._in_flight: Optional[_Batch] = None
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._force = False
+        self._closed = False
+        self.flushed_batches = 0
+        self.flushed_ratings = 0
+        self.failed_batches = 0
+        self.last_error: Optional[BaseException] = None
+
+    @property
+    def pending(self) -> int:
+        with self._cond:
+            return self._pending_count()
+
+    def _pending_count(self) -> int:
+        return sum(len(batch.ratings) for batch in (self._batch, self._in_flight) if batch is not None)
+
+    def submit(self, ratings: Iterable[Tuple[int, int, int]]) -> Future:
+        """Encola (user_id, copy_id, rating); lanza 503 si la cola está llena."""
+        ratings = list(ratings)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("La cola de ratings está cerrada")
+            if self._pending_count() + len(ratings) > self.max_pending:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Cola de ratings saturada; reintente en unos segundos",
+                    headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+                )
+            if self._batch is None:
+                self._batch = _Batch()
+            batch = self._batch
+            for user_id, copy_id, rating in ratings:
+                batch.ratings[(user_id, copy_id)] = rating
+            self._ensure_thread()
+            self._cond.notify()
+            return batch.done
+
+    def flush(self, timeout: Optional[float] = None) -> None:
+        """Vuelca ya el lote en curso y espera a su commit."""
+        with self._cond:
+            batch = self._batch
+            if batch is None:
+                return
+            self._force = True
+            self._cond.notify()
+        batch.done.result(timeout=timeout)
+
+    def close(self) -> None:
+        """Vuelca lo pendiente y para el hilo escritor (al parar la API)."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "pending": self._pending_count(),
+                "flushed_batches": self.flushed_batches,
+                "flushed_ratings": self.flushed_ratings,
+                "failed_batches": self.failed_batches,
+            }
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rating-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _next_batch(self) -> Optional[_Batch]:
+        """Espera a que el lote en curso deba volcarse y lo retira de la cola."""
+        with self._cond:
+            while True:
+                batch = self._batch
+                if batch is None:
+                    if self._closed:
+                        return None
+                    self._cond.wait()
+                    continue
+                wait = batch.created + self.flush_interval - time.monotonic()
+                if self._force or self._closed or wait <= 0 or len(batch.ratings) >= self.batch_size:
+                    self._batch = None
+                    self._in_flight = batch
+                    self._force = False
+                    return batch
+                self._cond.wait(timeout=wait)
+
+    def _flush_with_retries(self, batch: _Batch) -> int:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._flush_fn(batch.ratings)
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(
+                    "Fallo al escribir un lote de %d ratings (intento %d de %d); se reintenta",
+                    len(batch.ratings), attempt + 1, self.max_retries + 1, exc_info=True,
+                )
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                result = self._flush_with_retries(batch)
+            except BaseException as exc:
+                logger.exception(
+                    "No se ha podido escribir un lote de %d ratings tras %d intentos; se descarta",
+                    len(batch.ratings), self.max_retries + 1,
+                )
+                with self._cond:
+                    self.failed_batches += 1
+                    self.last_error = exc
+                    self._in_flight = None
+                batch.done.set_exception(exc)
+            else:
+                with self._cond:
+                    self.flushed_batches += 1
+                    self.flushed_ratings += len(batch.ratings)
+                    self._in_flight = None
+                batch.done.set_result(result)
@@ -1,50 +1,85 @@
 from pathlib import Path
+from typing import Optional, Tuple, Union
+
 import pandas as pd
 
+from app.etl.streaming import process_csv, track_peak_memory
+
 RAW_DIR = Path("data/raw")
 PROCESSED_DIR = Path("data/processed")
 
+# Tipos compactos
+RAW_DTYPES = {"book_id": "int32"}
 
-def clean_books(
-    raw_path: Path = RAW_DIR / "books.csv",
-    out_path: Path = PROCESSED_DIR / "books_clean.csv",
-) -> dict:
-    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
-
-    # Leemos el CSV original; on_bad_lines="skip" para saltar líneas corruptas
-    df = pd.read_csv(raw_path, on_bad_lines="skip")
-
-    n_in = len(df)
-
-    # Eliminamos duplicados por book_id (nos quedamos con la primera aparición)
-    df = df.drop_duplicates(subset=["book_id"], keep="first")
-
-    # Tipos
-    df["book_id"] = df["book_id"].astype(int)
 
+def _clean_books_chunk(df: pd.DataFrame) -> pd.DataFrame:
     # Limpieza básica de strings
     str_cols = ["isbn", "authors", "original_title", "title", "language_code", "image_url"]
     for col in str_cols:
         if col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
+            # (StringDtype conserva los nulos como <NA> en vez de convertirlos en "nan")
+            df[col] = df[col].astype("string").str.strip()
 
     # Año de publicación a entero (cuando se pueda)
     if "original_publication_year" in df.columns:
         df["original_publication_year"] = pd.to_numeric(
             df["original_publication_year"], errors="coerce"
-        ).astype("Int64")
+        ).astype("Int16")
+
+    # Título obligatorio (BOOK.title es NOT NULL): si falta se usa el título
+    # original y, si tampoco hay, se descarta el libro
+    if "title" in df.columns:
+        title = df["title"].replace("", pd.NA)
+        if "original_title" in df.columns:
+            title = title.fillna(df["original_title"].replace("", pd.NA))
+        df["title"] = title
+        df = df[df["title"].notna()]
+
+    return df
+
+
+def clean_books(
+    raw_path: Path = RAW_DIR / "books.csv",
+    out_path: Optional[Path] = PROCESSED_DIR / "books_clean.csv",
+    chunksize: Optional[int] = None,
+    return_frame: bool = False,
+    track_memory: bool = False,
+) -> Union[dict, Tuple[dict, pd.DataFrame]]:
+    """
+    Limpia books.csv. Con `chunksize` se procesa en streaming por trozos.
 
-    n_out = len(df)
+    - out_path=None no exporta el fichero limpio (CSV, o Parquet si termina en .parquet).
+    - return_frame=True devuelve (stats, DataFrame limpio) para usarlo en memoria.
+    - track_memory=True mide el pico de memoria (tracemalloc) en peak_memory_mb.
+    """
+    if out_path is not None:
+        Path(out_path).parent.mkdir(parents=True, exist_ok=True)
 
-    df.to_csv(out_path, index=False)
+    with track_peak_memory(track_memory) as mem:
+        # Leemos el CSV original; on_bad_lines="skip" para saltar líneas corruptas.
+        # Eliminamos duplicados por book_id (nos quedamos con la primera aparición)
+        n_in, n_out, df = process_csv(
+            raw_path,
+            out_path,
+            transform=_clean_books_chunk,
+            key_columns=["book_id"],
+            chunksize=chunksize,
+            collect=return_frame,
+            dtype=RAW_DTYPES,
+            on_bad_lines="skip",
+        )
 
-    return {
+    stats = {
         "table": "books",
         "input_rows": int(n_in),
         "output_rows": int(n_out),
         "dropped_rows": int(n_in - n_out),
-        "output_path": str(out_path),
+        "output_path": str(out_path) if out_path is not None else None,
+        "peak_memory_mb": mem["peak_memory_mb"],
     }
+    if return_frame:
+        return stats, df
+    return stats
 
 
 if __name__ == "__main__":
@@ -1,38 +1,62 @@
 from pathlib import Path
+from typing import Optional, Tuple, Union
+
 import pandas as pd
 
+from app.etl.streaming import process_csv, track_peak_memory
+
 RAW_DIR = Path("data/raw")
 PROCESSED_DIR = Path("data/processed")
 
+# Tipos compactos
+RAW_DTYPES = {"copy_id": "int32", "book_id": "int32"}
 
-def clean_copies(
-    raw_path: Path = RAW_DIR / "copies(ejemplares).csv",
-    out_path: Path = PROCESSED_DIR / "copies_clean.csv",
-) -> dict:
-    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 
-    df = pd.read_csv(raw_path)
+def _clean_copies_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    # Los tipos ya vienen fijados en la lectura (RAW_DTYPES)
+    return df
 
-    n_in = len(df)
 
-    # Tipos
-    df["copy_id"] = df["copy_id"].astype(int)
-    df["book_id"] = df["book_id"].astype(int)
-
-    # Duplicados por copy_id
-    df = df.drop_duplicates(subset=["copy_id"], keep="first")
+def clean_copies(
+    raw_path: Path = RAW_DIR / "copies(ejemplares).csv",
+    out_path: Optional[Path] = PROCESSED_DIR / "copies_clean.csv",
+    chunksize: Optional[int] = None,
+    return_frame: bool = False,
+    track_memory: bool = False,
+) -> Union[dict, Tuple[dict, pd.DataFrame]]:
+    """
+    Limpia copies(ejemplares).csv. Con `chunksize` se procesa en streaming por trozos.
 
-    n_out = len(df)
+    - out_path=None no exporta el fichero limpio (CSV, o Parquet si termina en .parquet).
+    - return_frame=True devuelve (stats, DataFrame limpio) para usarlo en memoria.
+    - track_memory=True mide el pico de memoria (tracemalloc) en peak_memory_mb.
+    """
+    if out_path is not None:
+        Path(out_path).parent.mkdir(parents=True, exist_ok=True)
 
-    df.to_csv(out_path, index=False)
+    with track_peak_memory(track_memory) as mem:
+        # Duplicados por copy_id
+        n_in, n_out, df = process_csv(
+            raw_path,
+            out_path,
+            transform=_clean_copies_chunk,
+            key_columns=["copy_id"],
+            chunksize=chunksize,
+            collect=return_frame,
+            dtype=RAW_DTYPES,
+        )
 
-    return {
+    stats = {
         "table": "copies",
         "input_rows": int(n_in),
         "output_rows": int(n_out),
         "dropped_rows": int(n_in - n_out),
-        "output_path": str(out_path),
+        "output_path": str(out_path) if out_path is not None else None,
+        "peak_memory_mb": mem["peak_memory_mb"],
     }
+    if return_frame:
+        return stats, df
+    return stats
 
 
 if __name__ == "__main__":
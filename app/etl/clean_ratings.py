@@ -1,44 +1,88 @@
 from pathlib import Path
+from typing import Optional, Tuple, Union
+
 import pandas as pd
 
+from app.etl.streaming import CleanChunks, track_peak_memory
+
 RAW_DIR = Path("data/raw")
 PROCESSED_DIR = Path("data/processed")
 
+# Tipos compactos: ids en int32 y rating en int8
+RAW_DTYPES = {"user_id": "int32", "copy_id": "int32"}
 
-def clean_ratings(
-    raw_path: Path = RAW_DIR / "ratings.csv",
-    out_path: Path = PROCESSED_DIR / "ratings_clean.csv",
-) -> dict:
-    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
 
-    df = pd.read_csv(raw_path)
-
-    n_in = len(df)
-
-    # Tipos
-    df["user_id"] = df["user_id"].astype(int)
-    df["copy_id"] = df["copy_id"].astype(int)
-    df["rating"] = pd.to_numeric(df["rating"], errors="coerce").astype("Int64")
+def _clean_ratings_chunk(df: pd.DataFrame) -> pd.DataFrame:
+    df["rating"] = pd.to_numeric(df["rating"], errors="coerce")
 
     # Filtro de ratings válidos (1 a 5)
-    df = df[df["rating"].between(1, 5)]
+    df = df[df["rating"].between(1, 5)].copy()
+    df["rating"] = df["rating"].astype("int8")
+    return df
+
 
-    # Eliminar duplicados (user_id, copy_id)
-    df = df.drop_duplicates(subset=["user_id", "copy_id"], keep="first")
+def ratings_chunks(
+    raw_path: Path = RAW_DIR / "ratings.csv",
+    out_path: Optional[Path] = None,
+    chunksize: Optional[int] = None,
+) -> CleanChunks:
+    """
+    Trozos limpios de ratings.csv, sin acumularlos: run_etl los carga en
+    SQLite según se leen. Tras recorrerlos, ratings_stats() da el informe.
+    """
+    if out_path is not None:
+        Path(out_path).parent.mkdir(parents=True, exist_ok=True)
 
-    n_out = len(df)
+    # Eliminar duplicados (user_id, copy_id) tras filtrar los ratings válidos
+    return CleanChunks(
+        raw_path,
+        out_path,
+        transform=_clean_ratings_chunk,
+        key_columns=["user_id", "copy_id"],
+        chunksize=chunksize,
+        dtype=RAW_DTYPES,
+    )
 
-    df.to_csv(out_path, index=False)
 
+def ratings_stats(stream: CleanChunks, peak_memory_mb: Optional[float] = None) -> dict:
+    """Informe de limpieza de un ratings_chunks() ya recorrido."""
     return {
         "table": "ratings",
-        "input_rows": int(n_in),
-        "output_rows": int(n_out),
-        "dropped_rows": int(n_in - n_out),
-        "output_path": str(out_path),
+        "input_rows": int(stream.n_in),
+        "output_rows": int(stream.n_out),
+        "dropped_rows": int(stream.n_in - stream.n_out),
+        "output_path": str(stream.out_path) if stream.out_path is not None else None,
+        "peak_memory_mb": peak_memory_mb,
     }
 
 
+def clean_ratings(
+    raw_path: Path = RAW_DIR / "ratings.csv",
+    out_path: Optional[Path] = PROCESSED_DIR / "ratings_clean.csv",
+    chunksize: Optional[int] = None,
+    return_frame: bool = False,
+    track_memory: bool = False,
+) -> Union[dict, Tuple[dict, pd.DataFrame]]:
+    """
+    Limpia ratings.csv. Con `chunksize` se procesa en streaming por trozos.
+
+    - out_path=None no exporta el fichero limpio (CSV, o Parquet si termina en .parquet).
+    - return_frame=True devuelve (stats, DataFrame limpio) para usarlo en memoria.
+    - track_memory=True mide el pico de memoria (tracemalloc) en peak_memory_mb.
+    """
+    stream = ratings_chunks(raw_path, out_path, chunksize)
+    with track_peak_memory(track_memory) as mem:
+        parts = []
+        for chunk in stream:
+            if return_frame:
+                parts.append(chunk)
+
+    stats = ratings_stats(stream, mem["peak_memory_mb"])
+    if return_frame:
+        return stats, pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    return stats
+
+
 if __name__ == "__main__":
     stats = clean_ratings()
     print(stats)
@@ -1,27 +1,23 @@
 from pathlib import Path
+from typing import Optional, Tuple, Union
+
 import pandas as pd
 
+from app.etl.streaming import process_csv, track_peak_memory
+
 RAW_DIR = Path("data/raw")
 PROCESSED_DIR = Path("data/processed")
 
+# Tipos compactos
+RAW_DTYPES = {"user_id": "int32"}
 
-def clean_users(
-    raw_path: Path = RAW_DIR / "user_info.csv",
-    out_path: Path = PROCESSED_DIR / "users_clean.csv",
-) -> dict:
-    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
-
-    df = pd.read_csv(raw_path)
-
-    n_in = len(df)
-
-    # Tipos
-    df["user_id"] = df["user_id"].astype(int)
 
+def _clean_users_chunk(df: pd.DataFrame) -> pd.DataFrame:
     # Limpiar strings
     for col in ["sexo", "comentario"]:
         if col in df.columns:
-            df[col] = df[col].astype(str).str.strip()
+            # (StringDtype conserva los nulos como <NA> en vez de convertirlos en "nan")
+            df[col] = df[col].astype("string").str.strip()
 
     # Parsear fecha_nacimiento (DD/MM/YYYY) a fecha
     if "fecha_nacimiento" in df.columns:
@@ -30,20 +26,49 @@ def clean_users(
         )
         df["fecha_nacimiento"] = fechas.dt.date
 
-    # Eliminar posibles duplicados de user_id
-    df = df.drop_duplicates(subset=["user_id"], keep="first")
+    return df
+
+
+def clean_users(
+    raw_path: Path = RAW_DIR / "user_info.csv",
+    out_path: Optional[Path] = PROCESSED_DIR / "users_clean.csv",
+    chunksize: Optional[int] = None,
+    return_frame: bool = False,
+    track_memory: bool = False,
+) -> Union[dict, Tuple[dict, pd.DataFrame]]:
+    """
+    Limpia user_info.csv. Con `chunksize` se procesa en streaming por trozos.
 
-    n_out = len(df)
+    - out_path=None no exporta el fichero limpio (CSV, o Parquet si termina en .parquet).
+    - return_frame=True devuelve (stats, DataFrame limpio) para usarlo en memoria.
+    - track_memory=True mide el pico de memoria (tracemalloc) en peak_memory_mb.
+    """
+    if out_path is not None:
+        Path(out_path).parent.mkdir(parents=True, exist_ok=True)
 
-    df.to_csv(out_path, index=False)
+    with track_peak_memory(track_memory) as mem:
+        # Eliminar posibles duplicados de user_id
+        n_in, n_out, df = process_csv(
+            raw_path,
+            out_path,
+            transform=_clean_users_chunk,
+            key_columns=["user_id"],
+            chunksize=chunksize,
+            collect=return_frame,
+            dtype=RAW_DTYPES,
+        )
 
-    return {
+    stats = {
         "table": "users_info",
         "input_rows": int(n_in),
         "output_rows": int(n_out),
         "dropped_rows": int(n_in - n_out),
-        "output_path": str(out_path),
+        "output_path": str(out_path) if out_path is not None else None,
+        "peak_memory_mb": mem["peak_memory_mb"],
     }
+    if return_frame:
+        return stats, df
+    return stats
 
 
 if __name__ == "__main__":
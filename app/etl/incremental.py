@@ -0,0 +1,143 @@
+import hashlib
+import io
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Huella de los CSV de entrada de la última carga, para que el ETL
+# incremental sepa qué ha cambiado desde entonces.
+ETL_STATE_TABLE = "ETL_STATE"
+
+# Tamaño de bloque para los hashes: un fichero al que solo se le han añadido
+# filas conserva los hashes de todos sus bloques anteriores.
+BLOCK_BYTES = 4 * 2**20
+
+_CREATE_ETL_STATE = """
+CREATE TABLE IF NOT EXISTS ETL_STATE (
+    name         TEXT PRIMARY KEY,
+    size         INTEGER NOT NULL,
+    mtime        REAL    NOT NULL,
+    block_bytes  INTEGER NOT NULL,
+    block_hashes TEXT    NOT NULL,
+    loaded_at    TEXT    NOT NULL
+)
+"""
+
+# Resultados de detect_change()
+UNCHANGED = "unchanged"
+APPENDED = "appended"
+CHANGED = "changed"
+
+
+def _block_hashes(path: Path, limit: int, block_bytes: int = BLOCK_BYTES) -> List[str]:
+    """Hashes de los bloques de `block_bytes` de los primeros `limit` bytes del fichero."""
+    hashes = []
+    remaining = limit
+    with open(path, "rb") as f:
+        while remaining > 0:
+            block = f.read(min(block_bytes, remaining))
+            if not block:
+                break
+            hashes.append(hashlib.blake2b(block, digest_size=16).hexdigest())
+            remaining -= len(block)
+    return hashes
+
+
+def file_fingerprint(path: Path, block_bytes: int = BLOCK_BYTES) -> dict:
+    """Tamaño, mtime y hashes por bloque de un fichero."""
+    st = Path(path).stat()
+    return {
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "block_bytes": block_bytes,
+        "block_hashes": _block_hashes(path, st.st_size, block_bytes),
+    }
+
+
+def load_state(conn: sqlite3.Connection) -> Dict[str, dict]:
+    """Huellas guardadas por la última carga ({} si no hay ninguna)."""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (ETL_STATE_TABLE,)
+    ).fetchone()
+    if not exists:
+        return {}
+
+    state = {}
+    for name, size, mtime, block_bytes, block_hashes in conn.execute(
+        "SELECT name, size, mtime, block_bytes, block_hashes FROM ETL_STATE"
+    ):
+        state[name] = {
+            "size": size,
+            "mtime": mtime,
+            "block_bytes": block_bytes,
+            "block_hashes": json.loads(block_hashes),
+        }
+    return state
+
+
+def save_state(conn: sqlite3.Connection, fingerprints: Dict[str, dict]) -> None:
+    """Guarda (o sustituye) la huella de cada fichero cargado."""
+    conn.execute(_CREATE_ETL_STATE)
+    loaded_at = datetime.now().isoformat(timespec="seconds")
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO ETL_STATE (name, size, mtime, block_bytes, block_hashes, loaded_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (name, fp["size"], fp["mtime"], fp["block_bytes"], json.dumps(fp["block_hashes"]), loaded_at)
+            for name, fp in fingerprints.items()
+        ],
+    )
+
+
+def detect_change(path: Path, previous: Optional[dict]) -> Tuple[str, int, dict]:
+    """
+    Compara `path` con su huella anterior.
+
+    Devuelve (tipo, offset, huella actual):
+    - UNCHANGED: mismo contenido (mismo tamaño y mtime, o mismos hashes).
+    - APPENDED: el contenido anterior está intacto y se han añadido filas al
+      final; `offset` es el byte donde empiezan las filas nuevas.
+    - CHANGED: cualquier otro cambio (o no hay huella); hay que releerlo entero.
+    """
+    current = file_fingerprint(path)
+    if previous is None:
+        return CHANGED, 0, current
+
+    if current["size"] == previous["size"] and current["mtime"] == previous["mtime"]:
+        return UNCHANGED, current["size"], current
+
+    old_size = previous["size"]
+    if current["size"] < old_size or previous["block_bytes"] != current["block_bytes"]:
+        return CHANGED, 0, current
+
+    # Los bloques completos anteriores se comparan directamente; el último
+    # bloque (parcial) hay que recalcularlo solo hasta el tamaño antiguo
+    prefix = _block_hashes(path, old_size, previous["block_bytes"])
+    if prefix != previous["block_hashes"]:
+        return CHANGED, 0, current
+    if current["size"] == old_size:
+        return UNCHANGED, old_size, current
+
+    # Solo se puede continuar desde el final anterior si acababa en salto de línea
+    with open(path, "rb") as f:
+        f.seek(old_size - 1)
+        if f.read(1) != b"\n":
+            return CHANGED, 0, current
+    return APPENDED, old_size, current
+
+
+def read_delta(path: Path, offset: int) -> io.BytesIO:
+    """
+    CSV en memoria con la cabecera de `path` y las filas a partir de `offset`,
+    listo para pasarlo a los limpiadores como si fuera el fichero original.
+    """
+    with open(path, "rb") as f:
+        if offset == 0:
+            return io.BytesIO(f.read())
+        header = f.readline()
+        f.seek(offset)
+        return io.BytesIO(header + f.read())
@@ -0,0 +1,74 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+# Por encima de este id máximo la pertenencia se resuelve con searchsorted
+# sobre el array ordenado en vez de con un bitmap (1 byte por id posible).
+BITMAP_MAX_ID = 1 << 27
+
+
+def sorted_ids(values) -> np.ndarray:
+    """Ids únicos y ordenados (int64) de una Series/array."""
+    return np.unique(np.asarray(values, dtype=np.int64))
+
+
+def member_mask(values, valid_ids: np.ndarray) -> np.ndarray:
+    """
+    Máscara booleana: True si cada elemento de `values` está en `valid_ids`
+    (array ordenado y sin repetidos, ver sorted_ids).
+
+    Con ids no negativos y acotados se usa un bitmap indexado por id (O(n));
+    si no, búsqueda binaria sobre el array ordenado (O(n log m)). En ambos
+    casos sin tablas hash ni objetos de Python por elemento.
+    """
+    values = np.asarray(values)
+    if len(valid_ids) == 0:
+        return np.zeros(len(values), dtype=bool)
+
+    lo, hi = int(valid_ids[0]), int(valid_ids[-1])
+    if lo >= 0 and hi <= BITMAP_MAX_ID:
+        # La última posición del bitmap es siempre False: los ids fuera de
+        # rango (negativos incluidos, vía el índice -1) se recortan a ella
+        bitmap = np.zeros(hi + 2, dtype=bool)
+        bitmap[valid_ids] = True
+        return bitmap[np.clip(values, -1, hi + 1)]
+
+    values = values.astype(np.int64, copy=False)
+    pos = np.minimum(np.searchsorted(valid_ids, values), len(valid_ids) - 1)
+    return valid_ids[pos] == values
+
+
+@dataclass(frozen=True)
+class ForeignKeyResult:
+    """Resultado de filtrar un DataFrame por una clave ajena."""
+
+    frame: pd.DataFrame
+    dropped_rows: int
+    orphan_ids: np.ndarray  # ids referenciados que no existen (únicos y ordenados)
+
+
+def filter_foreign_key(df: pd.DataFrame, column: str, valid_ids: np.ndarray) -> ForeignKeyResult:
+    """Conserva las filas de `df` cuyo `column` está en `valid_ids` e informa de los huérfanos."""
+    mask = member_mask(df[column].to_numpy(), valid_ids)
+    dropped = int(len(mask) - np.count_nonzero(mask))
+    orphans = sorted_ids(df[column].to_numpy()[~mask]) if dropped else np.empty(0, dtype=np.int64)
+    return ForeignKeyResult(frame=df[mask] if dropped else df, dropped_rows=dropped, orphan_ids=orphans)
+
+
+def build_users(user_ids, users_info: pd.DataFrame) -> pd.DataFrame:
+    """
+    Filas de USER para `user_ids`, con los datos demográficos de `users_info`
+    (sin user_id repetidos) alineados por id.
+    """
+    ids = sorted_ids(user_ids).astype(users_info["user_id"].dtype if len(users_info) else np.int64)
+    users = users_info.set_index("user_id").reindex(pd.Index(ids, name="user_id")).reset_index()
+
+    # tiene_info_demografica = True si alguna de las columnas de info no es nula
+    info_cols = ["sexo", "comentario", "fecha_nacimiento"]
+    for col in info_cols:
+        if col not in users.columns:
+            users[col] = pd.NA
+
+    users["tiene_info_demografica"] = users[info_cols].notna().any(axis=1)
+    return users
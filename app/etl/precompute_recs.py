@@ -0,0 +1,103 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from app.api.dependencies import dispose_engines
+from app.recommender.collaborative import RECOMMENDATION_METHODS, get_recommendations_for_users
+from app.recommender.item_cf import ItemCFModel, get_item_cf_model, set_item_cf_model
+from app.recommender.popularity import get_engine
+from app.recommender.tables import bump_data_version
+from app.recommender.user_recs import write_user_recs
+
+# Posiciones que se guardan por usuario (la API permite como mucho n=50)
+PRECOMPUTED_N = 50
+# Usuarios por tarea enviada al pool de procesos
+USERS_PER_TASK = 5000
+
+
+def _init_worker(item_cf_model: Optional[ItemCFModel] = None):
+    # Tras un fork, los engines heredados no deben reutilizar las conexiones del padre
+    dispose_engines()
+    # Los workers usan el modelo item-CF entrenado en el padre en vez de reentrenarlo
+    if item_cf_model is not None:
+        set_item_cf_model(item_cf_model)
+
+
+def _compute_chunk(args) -> pd.DataFrame:
+    user_ids, n, min_ratings, method = args
+    df = get_recommendations_for_users(user_ids, n=n, min_ratings=min_ratings, method=method)
+    return df[["user_id", "rank", "book_id", "score"]]
+
+
+def precompute_recommendations(
+    n: int = PRECOMPUTED_N,
+    min_ratings: int = 20,
+    method: str = "popularity",
+    workers: Optional[int] = None,
+) -> dict:
+    """
+    Calcula el top-N de todos los usuarios de USER y lo guarda en USER_RECS.
+
+    Los usuarios se reparten en tareas de USERS_PER_TASK entre un pool de
+    procesos (workers=1 lo ejecuta en el propio proceso). La API sirve
+    después /users/{id}/recommendations con una lectura por clave primaria.
+    """
+    if method not in RECOMMENDATION_METHODS:
+        raise ValueError(f"Método de recomendación desconocido: {method}")
+
+    t0 = time.perf_counter()
+    engine = get_engine()
+    with engine.connect() as conn:
+        user_ids = conn.execute(text("SELECT user_id FROM USER ORDER BY user_id")).scalars().all()
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+
+    tasks = [
+        (user_ids[start:start + USERS_PER_TASK], n, min_ratings, method)
+        for start in range(0, len(user_ids), USERS_PER_TASK)
+    ]
+    # item-CF se entrena una sola vez, aquí, y se pasa a cada worker al arrancar
+    item_cf_model = get_item_cf_model() if method == "item_cf" else None
+
+    if workers == 1:
+        parts = [_compute_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(item_cf_model,)) as pool:
+            parts = list(pool.map(_compute_chunk, tasks))
+    t_compute = time.perf_counter() - t0
+
+    recs = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+        columns=["user_id", "rank", "book_id", "score"]
+    )
+    with engine.begin() as conn:
+        written = write_user_recs(conn, recs, method=method, min_ratings=min_ratings, top_n=n)
+        bump_data_version(conn)
+
+    return {
+        "users": int(len(user_ids)),
+        "rows": int(written),
+        "method": method,
+        "min_ratings": min_ratings,
+        "top_n": n,
+        "compute_seconds": round(t_compute, 2),
+        "total_seconds": round(time.perf_counter() - t0, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precalcula recomendaciones por usuario en USER_RECS.")
+    parser.add_argument("--n", type=int, default=PRECOMPUTED_N)
+    parser.add_argument("--min-ratings", type=int, default=20)
+    parser.add_argument("--method", choices=RECOMMENDATION_METHODS, default="popularity")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    stats = precompute_recommendations(
+        n=args.n, min_ratings=args.min_ratings, method=args.method, workers=args.workers
+    )
+    print(stats)
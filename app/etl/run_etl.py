@@ -1,80 +1,234 @@
+import argparse
+import os
+import sqlite3
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
 from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+import numpy as np
 import pandas as pd
 from sqlalchemy import create_engine
 
 from app.etl.clean_books import clean_books
 from app.etl.clean_copies import clean_copies
 from app.etl.clean_users import clean_users
-from app.etl.clean_ratings import clean_ratings
+from app.etl.clean_ratings import clean_ratings, ratings_chunks, ratings_stats
+from app.api.dependencies import DB_PATH as API_DB_PATH
+from app.api.search import build_book_fts
+from app.etl.bulk_load import bulk_load, upsert_frame
+from app.etl.integrity import build_users, filter_foreign_key, sorted_ids
+from app.etl.incremental import APPENDED, UNCHANGED, detect_change, file_fingerprint, load_state, read_delta, save_state
+from app.etl.schema import check_query_plans
+from app.etl.streaming import Prefetch, SeenKeys, track_peak_memory
+from app.recommender.age_stats import build_book_age_stats
+from app.recommender.book_stats import build_book_stats, insert_new_ratings
+from app.recommender.dashboard import build_dashboard_agg, refresh_dashboard_catalog
+from app.recommender.tables import bump_data_version
+from app.recommender.user_recs import clear_user_recs
 
 
 BASE_DIR = Path(__file__).resolve().parents[2]  # raíz del proyecto
-RAW_DIR = BASE_DIR / "data" / "raw"
-PROCESSED_DIR = BASE_DIR / "data" / "processed"
-REPORTS_DIR = BASE_DIR / "docs" / "reportes"
-DB_PATH = BASE_DIR / "app" / "db" / "library.db"
+# Rutas configurables por entorno (los tests las apuntan a un directorio temporal)
+DATA_DIR = Path(os.environ.get("LIBRARY_DATA_DIR", BASE_DIR / "data"))
+RAW_DIR = DATA_DIR / "raw"
+PROCESSED_DIR = DATA_DIR / "processed"
+REPORTS_DIR = Path(os.environ.get("ETL_REPORTS_DIR", BASE_DIR / "docs" / "reportes"))
+DB_PATH = API_DB_PATH  # la BD que lee la API (LIBRARY_DB_PATH)
+
+# Ficheros de entrada (nombre lógico -> fichero en data/raw)
+RAW_FILES = {
+    "books": "books.csv",
+    "copies": "copies(ejemplares).csv",
+    "users": "user_info.csv",
+    "ratings": "ratings.csv",
+}
+
+
+# Limpiador de cada fichero de entrada
+CLEANERS = {
+    "books": clean_books,
+    "copies": clean_copies,
+    "users": clean_users,
+    "ratings": clean_ratings,
+}
+
+# Limpiadores que la carga completa ejecuta en el pool de procesos; ratings,
+# el fichero grande, se limpia en streaming mientras tanto (ver run_etl)
+POOLED_CLEANERS = ("books", "copies", "users")
+
+
+class _InlineExecutor(Executor):
+    """Ejecuta las tareas en el propio proceso (workers=1)."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
+
+
+def _clean_task(name: str, raw_path: Path, out_path: Optional[Path], chunksize: Optional[int],
+                track_memory: bool = False):
+    """Tarea de limpieza de un fichero; devuelve (stats, DataFrame, segundos)."""
+    t0 = time.perf_counter()
+    stat, df = CLEANERS[name](raw_path=raw_path, out_path=out_path, chunksize=chunksize,
+                              return_frame=True, track_memory=track_memory)
+    return stat, df, time.perf_counter() - t0
+
+
+def _checked_ratings(chunks: Iterable[pd.DataFrame], copy_ids: np.ndarray, user_ids: SeenKeys, fk: dict):
+    """
+    Filtra por FK (copy_id) cada trozo de ratings camino de la carga, sin
+    juntarlos: solo se guardan los user_id vistos (para USER) y los copy_id
+    huérfanos (para el informe).
+    """
+    for chunk in chunks:
+        checked = filter_foreign_key(chunk, "copy_id", copy_ids)
+        fk["dropped_rows"] += checked.dropped_rows
+        fk["orphan_ids"] = np.union1d(fk["orphan_ids"], checked.orphan_ids)
+        user_ids.add_new(checked.frame["user_id"].to_numpy())
+        yield checked.frame
+
+
+def _users_for(user_ids: SeenKeys, users_info: pd.DataFrame):
+    """USER con los usuarios de los ratings; se construye al cargarla, ya recorrido RATING."""
+    yield build_users(user_ids.values(), users_info)
+
 
+def _clean_output(name: str, export_format: Optional[str]) -> Optional[Path]:
+    """Ruta de exportación del fichero limpio, o None si no se exporta."""
+    if export_format is None:
+        return None
+    return PROCESSED_DIR / f"{name}_clean.{export_format}"
 
-def run_etl():
-    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
+
+def _format_ids(ids, limit: int = 20) -> str:
+    """Lista corta de ids para el informe."""
+    if len(ids) == 0:
+        return "ninguno"
+    shown = ", ".join(str(i) for i in ids[:limit])
+    return f"{shown} … ({len(ids)} en total)" if len(ids) > limit else shown
+
+
+def run_etl(
+    chunksize: Optional[int] = None,
+    export_format: Optional[str] = None,
+    workers: Optional[int] = None,
+    track_memory: bool = False,
+):
+    """
+    Ejecuta el ETL completo.
+
+    - books, copies y user_info (tablas pequeñas) se limpian en paralelo en un
+      pool de `workers` procesos (por defecto uno por fichero; workers=1 los
+      ejecuta en serie en el propio proceso) y vuelven como DataFrames.
+    - ratings.csv se limpia en streaming en un hilo de este proceso mientras
+      trabaja el pool (con workers=1, después); cada trozo se inserta en
+      RATING según llega: nunca está entero en memoria.
+    - Con `chunksize` los CSV se procesan por trozos de ese nº de filas (sin
+      chunksize ratings se lee de una vez, en un único trozo).
+    - Solo se exportan los ficheros limpios a data/processed si export_format
+      es "csv" o "parquet".
+    - track_memory=True mide el pico de memoria de cada limpiador (tracemalloc,
+      más lento).
+    """
     REPORTS_DIR.mkdir(parents=True, exist_ok=True)
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-    stats = []
-
-    # 1. Limpieza individual de ficheros
-    stats.append(clean_books(raw_path=RAW_DIR / "books.csv",
-                             out_path=PROCESSED_DIR / "books_clean.csv"))
-    stats.append(clean_copies(raw_path=RAW_DIR / "copies(ejemplares).csv",
-                              out_path=PROCESSED_DIR / "copies_clean.csv"))
-    stats.append(clean_users(raw_path=RAW_DIR / "user_info.csv",
-                             out_path=PROCESSED_DIR / "users_clean.csv"))
-    stats.append(clean_ratings(raw_path=RAW_DIR / "ratings.csv",
-                               out_path=PROCESSED_DIR / "ratings_clean.csv"))
-
-    # 2. Cargar datos limpios
-    books = pd.read_csv(PROCESSED_DIR / "books_clean.csv")
-    copies = pd.read_csv(PROCESSED_DIR / "copies_clean.csv")
-    ratings = pd.read_csv(PROCESSED_DIR / "ratings_clean.csv")
-    users_info = pd.read_csv(PROCESSED_DIR / "users_clean.csv")
-
-    # 3. Limpieza cruzada e integridad referencial
-
-    # 3.1. Filtrar copies cuyo book_id no exista en books
-    valid_book_ids = set(books["book_id"])
-    copies_before = len(copies)
-    copies = copies[copies["book_id"].isin(valid_book_ids)]
-    copies_dropped_fk = copies_before - len(copies)
-
-    # 3.2. Filtrar ratings cuyo copy_id no exista en copies
-    valid_copy_ids = set(copies["copy_id"])
-    ratings_before = len(ratings)
-    ratings = ratings[ratings["copy_id"].isin(valid_copy_ids)]
-    ratings_dropped_fk = ratings_before - len(ratings)
-
-    # 3.3. Construir tabla USER completa a partir de ratings + user_info
-    all_user_ids = pd.Index(sorted(ratings["user_id"].unique()), name="user_id")
-    users_full = pd.DataFrame(all_user_ids)
-
-    # unir datos demográficos si existen
-    users_full = users_full.merge(users_info, on="user_id", how="left")
-
-    # tiene_info_demografica = True si alguna de las columnas de info no es nula
-    info_cols = ["sexo", "comentario", "fecha_nacimiento"]
-    for col in info_cols:
-        if col not in users_full.columns:
-            users_full[col] = pd.NA
-
-    users_full["tiene_info_demografica"] = users_full[info_cols].notna().any(axis=1)
-
-    # 4. Insertar en SQLite usando SQLAlchemy
+    t_start = time.perf_counter()
+    timings: Dict[str, float] = {}
+
+    # 1. Limpieza de los ficheros pequeños, en paralelo (ficheros independientes).
+    # 2. ratings.csv, el fichero grande, se lee y limpia a la vez en un hilo
+    #    (Prefetch); la carga solo espera a copy_ids para filtrar sus trozos
+    #    por FK. El hilo arranca después de enviar las tareas, cuando el pool
+    #    ya ha creado sus procesos (fork con otros hilos en marcha no es seguro).
+    ratings_stream = ratings_chunks(RAW_DIR / RAW_FILES["ratings"], _clean_output("ratings", export_format), chunksize)
+    rating_users = SeenKeys()
+    ratings_fk = {"dropped_rows": 0, "orphan_ids": np.empty(0, dtype=np.int64)}
+
+    pool = (
+        _InlineExecutor() if workers == 1
+        else ProcessPoolExecutor(max_workers=min(workers or len(POOLED_CLEANERS), len(POOLED_CLEANERS)))
+    )
+    with track_peak_memory(track_memory) as mem, pool:
+        futures = {
+            name: pool.submit(_clean_task, name, RAW_DIR / RAW_FILES[name],
+                              _clean_output(name, export_format), chunksize, track_memory)
+            for name in POOLED_CLEANERS
+        }
+
+        def result(name):
+            stat, df, seconds = futures[name].result()
+            timings[f"limpieza {name}"] = seconds
+            return stat, df
+
+        with Prefetch(ratings_stream) as ratings:
+            # 3. Limpieza cruzada e integridad referencial
+            # 3.1. Filtrar copies cuyo book_id no exista en books
+            (books_stat, books), (copies_stat, copies) = result("books"), result("copies")
+            t0 = time.perf_counter()
+            copies_fk = filter_foreign_key(copies, "book_id", sorted_ids(books["book_id"]))
+            copies = copies_fk.frame
+            copy_ids = sorted_ids(copies["copy_id"])
+            timings["integridad"] = time.perf_counter() - t0
+
+            users_stat, users_info = result("users")
+
+            # 4. Carga masiva en SQLite (esquema explícito, executemany por
+            #    lotes, índices al final). Los ratings pasan trozo a trozo de
+            #    la limpieza a la carga (3.2: filtrado por copy_id) y USER (3.3)
+            #    se construye con los user_id vistos en ellos, por eso se carga
+            #    después de RATING.
+            t0 = time.perf_counter()
+            load_timings = bulk_load(DB_PATH, {
+                "BOOK": books,
+                "COPY": copies,
+                "RATING": _checked_ratings(ratings, copy_ids, rating_users, ratings_fk),
+                "USER": _users_for(rating_users, users_info),
+            })
+            timings["carga SQLite"] = time.perf_counter() - t0
+    timings["limpieza ratings"] = ratings.seconds
+    stats = [books_stat, copies_stat, users_stat, ratings_stats(ratings_stream, mem["peak_memory_mb"])]
+
+    # 4.1. Verificar que las consultas críticas usan los índices y guardar la
+    #      huella de los CSV cargados (base del modo incremental)
+    t0 = time.perf_counter()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        query_plans = check_query_plans(conn)
+        save_state(conn, {name: file_fingerprint(RAW_DIR / f) for name, f in RAW_FILES.items()})
+        conn.commit()
+    finally:
+        conn.close()
+    timings["planes y huellas"] = time.perf_counter() - t0
+
+    # 4.2. Tablas derivadas, usando SQLAlchemy
     engine = create_engine(f"sqlite:///{DB_PATH}")
+    t0 = time.perf_counter()
 
     with engine.begin() as conn:
-        users_full.to_sql("USER", conn, if_exists="replace", index=False)
-        books.to_sql("BOOK", conn, if_exists="replace", index=False)
-        copies.to_sql("COPY", conn, if_exists="replace", index=False)
-        ratings.to_sql("RATING", conn, if_exists="replace", index=False)
+        # Estadísticas materializadas por libro (BOOK_STATS)
+        n_book_stats = build_book_stats(conn)
+
+        # Cubo de popularidad por año de nacimiento × libro (BOOK_AGE_STATS)
+        build_book_age_stats(conn)
+
+        # Índice de texto completo del catálogo (BOOK_FTS)
+        build_book_fts(conn)
+
+        # Agregados de los dashboards (DASHBOARD_AGG)
+        build_dashboard_agg(conn)
+
+        # Las recomendaciones precalculadas (USER_RECS) quedan obsoletas
+        clear_user_recs(conn)
+
+        # Nueva versión de los datos: invalida las respuestas cacheadas de la API
+        bump_data_version(conn)
+
+    derived_seconds = time.perf_counter() - t0
+    timings["tablas derivadas"] = derived_seconds
+    timings["total"] = time.perf_counter() - t_start
 
     # 5. Generar informe simple
     lines = []
@@ -86,22 +240,212 @@ def run_etl():
         lines.append(f"- Filas de entrada: {s['input_rows']}\n")
         lines.append(f"- Filas de salida: {s['output_rows']}\n")
         lines.append(f"- Filas descartadas: {s['dropped_rows']}\n")
-        lines.append(f"- Fichero limpio: `{s['output_path']}`\n\n")
+        lines.append(f"- Fichero limpio: `{s['output_path'] or '(no exportado)'}`\n")
+        peak = s["peak_memory_mb"]
+        lines.append(f"- Pico de memoria: {f'{peak} MB' if peak is not None else 'no medido'}\n\n")
 
     lines.append("## Integridad referencial\n")
-    lines.append(f"- Ejemplares descartados por FK (book_id inexistente): {copies_dropped_fk}\n")
-    lines.append(f"- Ratings descartados por FK (copy_id inexistente): {ratings_dropped_fk}\n")
-    lines.append(f"- Usuarios finales en USER: {len(users_full)}\n")
+    lines.append(f"- Ejemplares descartados por FK (book_id inexistente): {copies_fk.dropped_rows}\n")
+    lines.append(f"  - book_id huérfanos: {_format_ids(copies_fk.orphan_ids)}\n")
+    lines.append(f"- Ratings descartados por FK (copy_id inexistente): {ratings_fk['dropped_rows']}\n")
+    lines.append(f"  - copy_id huérfanos: {_format_ids(ratings_fk['orphan_ids'])}\n")
+    lines.append(f"- Usuarios finales en USER: {load_timings['USER']['rows']}\n")
     lines.append(f"- Libros finales en BOOK: {len(books)}\n")
     lines.append(f"- Ejemplares finales en COPY: {len(copies)}\n")
-    lines.append(f"- Ratings finales en RATING: {len(ratings)}\n")
+    lines.append(f"- Ratings finales en RATING: {load_timings['RATING']['rows']}\n")
+    lines.append(f"- Libros con estadísticas en BOOK_STATS: {n_book_stats}\n\n")
+
+    lines.append("## Carga en SQLite\n")
+    for table, t in load_timings.items():
+        lines.append(
+            f"- {table}: {t['rows']} filas, carga {t['load_seconds']:.2f} s, "
+            f"índices {t['index_seconds']:.2f} s\n"
+        )
+    lines.append(f"- Tablas derivadas (BOOK_STATS, BOOK_AGE_STATS, BOOK_FTS, DASHBOARD_AGG, USER_RECS): {derived_seconds:.2f} s\n\n")
+
+    lines.append("## Tiempos por etapa\n")
+    lines.append(f"- Procesos para la limpieza: {workers or len(POOLED_CLEANERS)} (+ ratings en el proceso principal)\n")
+    for stage, seconds in timings.items():
+        lines.append(f"- {stage}: {seconds:.2f} s\n")
+    lines.append("\n")
+
+    lines.append("## Planes de consulta\n")
+    for p in query_plans:
+        status = "OK" if p["ok"] else f"FALLO (se esperaba {p['expected']})"
+        lines.append(f"- {p['query']}: {status} — `{p['plan']}`\n")
 
     log_path = REPORTS_DIR / "etl_log.md"
     log_path.write_text("\n".join(lines), encoding="utf-8")
 
     print(f"ETL completado. Informe en {log_path}")
     print(f"Base de datos SQLite en {DB_PATH}")
+    return timings
+
+
+def _table_ids(conn: sqlite3.Connection, sql: str) -> np.ndarray:
+    """Ids (únicos y ordenados) devueltos por `sql`."""
+    return sorted_ids(np.fromiter((row[0] for row in conn.execute(sql)), dtype=np.int64))
+
+
+def run_incremental_etl(chunksize: Optional[int] = None) -> dict:
+    """
+    Aplica solo los cambios de los CSV desde la última carga.
+
+    - Compara cada CSV con su huella en ETL_STATE (tamaño, mtime y hashes por
+      bloque). Si solo se han añadido filas al final se limpian únicamente
+      esas filas; si el fichero ha cambiado de otra forma se relee entero.
+    - BOOK, COPY y USER se actualizan con upserts por clave primaria. Las
+      filas nuevas de un fichero ampliado no pisan las existentes (se
+      conserva la primera aparición, como en la carga completa).
+    - RATING: solo se insertan los ratings nuevos (los escritos desde la
+      API/UI desde la última carga se conservan), con los mismos deltas por
+      lotes que save_ratings sobre BOOK_STATS, BOOK_AGE_STATS, DASHBOARD_AGG
+      y USER_RECS.
+    - Las tablas derivadas solo se recalculan enteras si cambia a qué libro
+      apunta un ejemplar (BOOK_STATS, BOOK_AGE_STATS) o la fecha de nacimiento
+      de los usuarios (BOOK_AGE_STATS); los agregados de USER y BOOK de
+      DASHBOARD_AGG se recalculan sin contar RATING.
+    - Las filas eliminadas de los CSV no se borran de la BD; para eso hay que
+      ejecutar la carga completa.
+
+    Todo se aplica en una sola transacción. Sin BD o sin huellas previas se
+    ejecuta la carga completa.
+    """
+    if not DB_PATH.exists():
+        run_etl(chunksize=chunksize)
+        return {"mode": "full"}
+
+    t0 = time.perf_counter()
+    engine = create_engine(f"sqlite:///{DB_PATH}")
+    try:
+        with engine.connect() as sa_conn:
+            state = load_state(sa_conn.connection.dbapi_connection)
+        if not state:
+            engine.dispose()
+            run_etl(chunksize=chunksize)
+            return {"mode": "full"}
+
+        changes = {
+            name: detect_change(RAW_DIR / f, state.get(name)) for name, f in RAW_FILES.items()
+        }
+        changed = {name for name, (kind, _, _) in changes.items() if kind != UNCHANGED}
+
+        def delta(name):
+            kind, offset, _ = changes[name]
+            if kind == UNCHANGED:
+                return None
+            _, df = CLEANERS[name](raw_path=read_delta(RAW_DIR / RAW_FILES[name], offset),
+                                   out_path=None, chunksize=chunksize, return_frame=True)
+            return df
+
+        books = delta("books")
+        copies = delta("copies")
+        ratings = delta("ratings")
+
+        summary = {name: {"change": kind, "delta_rows": 0, "applied_rows": 0}
+                   for name, (kind, _, _) in changes.items()}
+
+        with engine.begin() as sa_conn:
+            # Conexión sqlite3 de la misma transacción (upsert_frame, ETL_STATE)
+            conn = sa_conn.connection.dbapi_connection
+            cur = conn.cursor()
+            if changed:
+                # Primero una escritura, para tomar el bloqueo antes de leer
+                # (ver book_stats.save_ratings)
+                bump_data_version(sa_conn)
+
+            if books is not None:
+                summary["books"]["delta_rows"] = len(books)
+                summary["books"]["applied_rows"] = upsert_frame(
+                    cur, "BOOK", books, ["book_id"], update=changes["books"][0] != APPENDED
+                )
+
+            if copies is not None:
+                summary["copies"]["delta_rows"] = len(copies)
+                copies = filter_foreign_key(copies, "book_id", _table_ids(conn, "SELECT book_id FROM BOOK")).frame
+                summary["copies"]["applied_rows"] = upsert_frame(
+                    cur, "COPY", copies, ["copy_id"], update=changes["copies"][0] != APPENDED
+                )
+
+            # USER: usuarios nuevos de los ratings y, si user_info ha cambiado,
+            # los datos demográficos de los usuarios existentes. user_info es
+            # pequeño, así que se usa completo como tabla de datos demográficos.
+            known_users = _table_ids(conn, "SELECT user_id FROM USER")
+            new_user_ids = np.empty(0, dtype=np.int64)
+            if ratings is not None:
+                summary["ratings"]["delta_rows"] = len(ratings)
+                ratings = filter_foreign_key(ratings, "copy_id", _table_ids(conn, "SELECT copy_id FROM COPY")).frame
+                new_user_ids = np.setdiff1d(ratings["user_id"].unique(), known_users)
+
+            users_changed = "users" in changed
+            if users_changed or len(new_user_ids):
+                _, users_info = clean_users(raw_path=RAW_DIR / RAW_FILES["users"], out_path=None,
+                                            chunksize=chunksize, return_frame=True)
+                target_ids = new_user_ids
+                if users_changed:
+                    summary["users"]["delta_rows"] = len(users_info)
+                    target_ids = np.union1d(target_ids, np.intersect1d(known_users, users_info["user_id"]))
+                summary["users"]["applied_rows"] = upsert_frame(
+                    cur, "USER", build_users(target_ids, users_info), ["user_id"], update=True
+                )
+
+            # Ratings nuevos con sus deltas (también invalida USER_RECS de sus usuarios)
+            if ratings is not None:
+                summary["ratings"]["applied_rows"] = insert_new_ratings(sa_conn, ratings)
+
+            # Tablas derivadas que dependen de datos que no son ratings
+            remapped = "copies" in changed and changes["copies"][0] != APPENDED
+            if remapped:
+                # Un ejemplar puede apuntar ahora a otro libro
+                build_book_stats(sa_conn)
+            if remapped or users_changed:
+                build_book_age_stats(sa_conn)
+            if {"books", "users"} & changed or len(new_user_ids):
+                refresh_dashboard_catalog(sa_conn)
+            if {"books", "copies"} & changed:
+                # Cambia el catálogo de candidatos: todo el precálculo queda obsoleto
+                clear_user_recs(sa_conn)
+
+            save_state(conn, {name: fp for name, (_, _, fp) in changes.items()})
+    finally:
+        engine.dispose()
+
+    return {"mode": "incremental", "files": summary, "seconds": round(time.perf_counter() - t0, 2)}
 
 
 if __name__ == "__main__":
-    run_etl()
+    parser = argparse.ArgumentParser(description="ETL de CSV a la BD SQLite.")
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help="Procesar los CSV en streaming por trozos de este nº de filas",
+    )
+    parser.add_argument(
+        "--export",
+        choices=["csv", "parquet"],
+        default=None,
+        help="Exportar también los ficheros limpios a data/processed",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Procesos para limpiar los CSV en paralelo (1 = en serie)",
+    )
+    parser.add_argument(
+        "--track-memory",
+        action="store_true",
+        help="Medir el pico de memoria de cada limpiador (tracemalloc; más lento)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Aplicar solo los cambios de los CSV desde la última carga",
+    )
+    args = parser.parse_args()
+    if args.incremental:
+        print(run_incremental_etl(chunksize=args.chunksize))
+    else:
+        run_etl(chunksize=args.chunksize, export_format=args.export, workers=args.workers,
+                track_memory=args.track_memory)
@@ -0,0 +1,163 @@
+import sqlite3
+from typing import List
+
+import pandas as pd
+
+# Esquema explícito de las tablas que carga el ETL (ver docs/modelo_datos.md).
+# Las columnas del CSV que no aparezcan aquí se crean con el tipo deducido
+# del dtype de pandas. Las claves "INTEGER PRIMARY KEY" son alias del rowid:
+# la búsqueda por id es directa sobre el B-tree de la tabla.
+TABLE_COLUMNS = {
+    "USER": {
+        "user_id": "INTEGER PRIMARY KEY",
+        "sexo": "TEXT",
+        "comentario": "TEXT",
+        "fecha_nacimiento": "DATE",
+        "tiene_info_demografica": "BOOLEAN NOT NULL DEFAULT 0",
+    },
+    "BOOK": {
+        "book_id": "INTEGER PRIMARY KEY",
+        "isbn": "TEXT",
+        "authors": "TEXT",
+        "original_publication_year": "INTEGER",
+        "original_title": "TEXT",
+        # NOT NULL: el orden del catálogo y el cursor de /books comparan title
+        "title": "TEXT NOT NULL",
+        "language_code": "TEXT",
+        "image_url": "TEXT",
+    },
+    "COPY": {
+        "copy_id": "INTEGER PRIMARY KEY",
+        "book_id": "INTEGER NOT NULL REFERENCES BOOK (book_id)",
+    },
+    "RATING": {
+        "user_id": "INTEGER NOT NULL REFERENCES USER (user_id)",
+        "copy_id": "INTEGER NOT NULL REFERENCES COPY (copy_id)",
+        "rating": "INTEGER NOT NULL CHECK (rating BETWEEN 1 AND 5)",
+    },
+}
+
+# Columnas que no vienen de los CSV y genera SQLite al insertar
+GENERATED_COLUMNS = {
+    "RATING": {
+        "rating_id": "INTEGER PRIMARY KEY",
+    },
+}
+
+# Índices secundarios: se crean DESPUÉS de cargar los datos (mucho más rápido
+# que mantenerlos fila a fila durante los INSERT).
+# - ux_rating_user_copy garantiza un rating por (user_id, copy_id) y, al
+#   empezar por user_id, sirve también para los filtros por usuario.
+# - idx_rating_copy incluye rating: las agregaciones por ejemplar/libro se
+#   resuelven solo con el índice (covering), sin leer la tabla.
+# - idx_copy_book lleva implícito copy_id (rowid), así que también es covering
+#   para COPY -> book_id.
+INDEXES = {
+    "BOOK": [
+        "CREATE INDEX idx_book_lang_year ON BOOK (language_code, original_publication_year)",
+        # Índice de expresión con el orden exacto del catálogo (/books): permite
+        # la paginación por cursor sin ordenar ni saltar filas
+        "CREATE INDEX idx_book_year_title ON BOOK (COALESCE(original_publication_year, 0) DESC, title, book_id)",
+    ],
+    "COPY": [
+        "CREATE INDEX idx_copy_book ON COPY (book_id)",
+    ],
+    "RATING": [
+        "CREATE UNIQUE INDEX ux_rating_user_copy ON RATING (user_id, copy_id)",
+        "CREATE INDEX idx_rating_copy ON RATING (copy_id, rating)",
+    ],
+}
+
+# Consultas críticas de la API / UI / recomendador y el índice que debe
+# aparecer en su plan (EXPLAIN QUERY PLAN). Ver check_query_plans().
+HOT_QUERIES = {
+    "usuario por id": (
+        "SELECT 1 FROM USER WHERE user_id = 1",
+        "INTEGER PRIMARY KEY",
+    ),
+    "ejemplar por id": (
+        "SELECT 1 FROM COPY WHERE copy_id = 1",
+        "INTEGER PRIMARY KEY",
+    ),
+    "libro por id": (
+        "SELECT book_id, title FROM BOOK WHERE book_id = 1",
+        "INTEGER PRIMARY KEY",
+    ),
+    "libros por idioma y año": (
+        "SELECT book_id, title FROM BOOK WHERE language_code = 'eng' AND original_publication_year >= 2000",
+        "idx_book_lang_year",
+    ),
+    "catálogo paginado por cursor": (
+        """
+        SELECT b.book_id, b.title
+        FROM BOOK b
+        WHERE COALESCE(b.original_publication_year, 0) <= 2000
+          AND (COALESCE(b.original_publication_year, 0) < 2000 OR (b.title, b.book_id) > ('x', 1))
+        ORDER BY COALESCE(b.original_publication_year, 0) DESC, b.title ASC, b.book_id ASC
+        LIMIT 21
+        """,
+        "SEARCH b USING INDEX idx_book_year_title",
+    ),
+    "rating de (usuario, ejemplar)": (
+        "SELECT rating FROM RATING WHERE user_id = 1 AND copy_id = 1",
+        "ux_rating_user_copy",
+    ),
+    "actualizar rating": (
+        "UPDATE RATING SET rating = 5 WHERE user_id = 1 AND copy_id = 1",
+        "ux_rating_user_copy",
+    ),
+    "ratings de un usuario": (
+        """
+        SELECT r.copy_id, r.rating, b.book_id, b.title
+        FROM RATING r
+        JOIN COPY c ON r.copy_id = c.copy_id
+        JOIN BOOK b ON c.book_id = b.book_id
+        WHERE r.user_id = 1
+        """,
+        "ux_rating_user_copy",
+    ),
+    "ratings de los ejemplares de un libro": (
+        """
+        SELECT COUNT(r.rating), SUM(r.rating)
+        FROM COPY c
+        JOIN RATING r ON r.copy_id = c.copy_id
+        WHERE c.book_id = 1
+        """,
+        "COVERING INDEX idx_rating_copy",
+    ),
+}
+
+
+def _sqlite_type(series: pd.Series) -> str:
+    if pd.api.types.is_bool_dtype(series):
+        return "BOOLEAN"
+    if pd.api.types.is_integer_dtype(series):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(series):
+        return "REAL"
+    return "TEXT"
+
+
+def create_table_sql(table: str, df: pd.DataFrame) -> str:
+    """CREATE TABLE para `table` con las columnas de `df` en su orden."""
+    declared = TABLE_COLUMNS.get(table, {})
+    cols = [f'"{col}" {ddl}' for col, ddl in GENERATED_COLUMNS.get(table, {}).items()]
+    cols += [
+        f'"{col}" {declared.get(col) or _sqlite_type(df[col])}'
+        for col in df.columns
+    ]
+    return f'CREATE TABLE "{table}" (\n    ' + ",\n    ".join(cols) + "\n)"
+
+
+def check_query_plans(conn: sqlite3.Connection) -> List[dict]:
+    """
+    Comprueba con EXPLAIN QUERY PLAN que cada consulta de HOT_QUERIES usa el
+    índice esperado (y no un recorrido completo de la tabla).
+
+    Devuelve una lista de {"query", "expected", "plan", "ok"}.
+    """
+    results = []
+    for name, (sql, expected) in HOT_QUERIES.items():
+        plan = " | ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"))
+        results.append({"query": name, "expected": expected, "plan": plan, "ok": expected in plan})
+    return results
@@ -0,0 +1,279 @@
+import queue
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class SeenKeys:
+    """
+    Conjunto compacto de claves enteras ya vistas (array int64 ordenado).
+
+    Sustituye a drop_duplicates cuando el fichero se procesa por trozos:
+    6M de pares (user_id, copy_id) ocupan ~48 MB, frente a los cientos de
+    MB de un set de Python con tuplas.
+    """
+
+    def __init__(self):
+        self._keys = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add_new(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Registra `keys` y devuelve una máscara con True en la primera aparición
+        de cada clave que no se hubiera visto antes (equivale a keep="first").
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        uniq, first = np.unique(keys, return_index=True)
+
+        if len(self._keys):
+            pos = np.minimum(np.searchsorted(self._keys, uniq), len(self._keys) - 1)
+            unseen = self._keys[pos] != uniq
+            uniq, first = uniq[unseen], first[unseen]
+
+        mask = np.zeros(len(keys), dtype=bool)
+        mask[first] = True
+        # uniq está ordenado y no contiene claves ya vistas: se inserta cada una
+        # en su posición, en una sola pasada O(n + m) (sin reordenar todo)
+        self._keys = np.insert(self._keys, np.searchsorted(self._keys, uniq), uniq)
+        return mask
+
+    def values(self) -> np.ndarray:
+        """Claves vistas hasta ahora (ordenadas y sin repetidos)."""
+        return self._keys
+
+
+def row_keys(df: pd.DataFrame, columns: Sequence[str]) -> np.ndarray:
+    """
+    Clave int64 por fila a partir de 1 o 2 columnas enteras no negativas
+    (dos columnas se empaquetan como a << 32 | b).
+    """
+    if len(columns) == 1:
+        return df[columns[0]].to_numpy(dtype=np.int64)
+    a, b = (df[c].to_numpy(dtype=np.int64) for c in columns)
+    return (a << 32) | b
+
+
+class _ChunkWriter:
+    """Escribe trozos sucesivos en un CSV o en un Parquet (según la extensión)."""
+
+    def __init__(self, out_path: Path):
+        self.out_path = Path(out_path)
+        self.parquet = self.out_path.suffix == ".parquet"
+        self._writer = None
+        self._first = True
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if self._writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                self._writer = pq.ParquetWriter(self.out_path, table.schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=self._writer.schema, preserve_index=False)
+            self._writer.write_table(table)
+        else:
+            chunk.to_csv(self.out_path, mode="w" if self._first else "a", header=self._first, index=False)
+        self._first = False
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+class CleanChunks:
+    """
+    Trozos limpios de un CSV: se lee `raw_path`, se aplica `transform` a cada
+    trozo y se eliminan los duplicados por `key_columns` (primera aparición).
+
+    Al iterar se entregan los trozos de uno en uno, sin acumularlos, de forma
+    que la memoria no crece con el tamaño del fichero (salvo las claves ya
+    vistas); con chunksize=None se lee el fichero de una vez. Si `out_path`
+    no es None se exportan también (CSV, o Parquet si la extensión es
+    .parquet). Tras recorrerlo, n_in / n_out tienen las filas de entrada y de
+    salida.
+    """
+
+    def __init__(
+        self,
+        raw_path: Path,
+        out_path: Optional[Path],
+        transform: Callable[[pd.DataFrame], pd.DataFrame],
+        key_columns: Sequence[str],
+        chunksize: Optional[int] = None,
+        **read_kwargs,
+    ):
+        self.raw_path = raw_path
+        self.out_path = out_path
+        self.transform = transform
+        self.key_columns = key_columns
+        self.chunksize = chunksize
+        self.read_kwargs = read_kwargs
+        self.n_in = self.n_out = 0
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        if self.chunksize is None:
+            chunks: Iterable[pd.DataFrame] = [pd.read_csv(self.raw_path, **self.read_kwargs)]
+        else:
+            chunks = pd.read_csv(self.raw_path, chunksize=self.chunksize, **self.read_kwargs)
+
+        writer = _ChunkWriter(self.out_path) if self.out_path is not None else None
+        seen = SeenKeys()
+        self.n_in = self.n_out = 0
+        try:
+            for chunk in chunks:
+                self.n_in += len(chunk)
+                chunk = self.transform(chunk)
+                chunk = chunk[seen.add_new(row_keys(chunk, self.key_columns))]
+                if writer is not None:
+                    writer.write(chunk)
+                self.n_out += len(chunk)
+                yield chunk
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+_END = object()
+
+
+class _Failed:
+    """Error del hilo productor de Prefetch, para relanzarlo en el consumidor."""
+
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class Prefetch:
+    """
+    Recorre `chunks` en un hilo aparte y deja hasta `max_pending` trozos
+    preparados en una cola: la lectura y limpieza avanzan mientras quien los
+    consume espera a otra cosa (en run_etl, al pool de limpiadores).
+
+    Al iterar se entregan los trozos en orden; un error del hilo se relanza en
+    el consumidor. `seconds` es el tiempo que el hilo ha pasado produciendo
+    trozos (sin la espera con la cola llena). Se usa como context manager:
+    al salir se para el hilo aunque no se haya recorrido entero.
+    """
+
+    def __init__(self, chunks: Iterable[pd.DataFrame], max_pending: int = 8):
+        self.seconds = 0.0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._produce, args=(chunks,), daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._closed.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, chunks: Iterable[pd.DataFrame]) -> None:
+        iterator = iter(chunks)
+        try:
+            while True:
+                t0 = time.perf_counter()
+                chunk = next(iterator, _END)
+                self.seconds += time.perf_counter() - t0
+                if not self._put(chunk) or chunk is _END:
+                    return
+        except BaseException as exc:
+            self._put(_Failed(exc))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        while True:
+            item = self._queue.get()
+            if item is _END:
+                return
+            if isinstance(item, _Failed):
+                raise item.exc
+            yield item
+
+    def close(self) -> None:
+        self._closed.set()
+        self._thread.join()
+
+    def __enter__(self) -> "Prefetch":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def process_csv(
+    raw_path: Path,
+    out_path: Optional[Path],
+    transform: Callable[[pd.DataFrame], pd.DataFrame],
+    key_columns: Sequence[str],
+    chunksize: Optional[int] = None,
+    collect: bool = False,
+    **read_kwargs,
+) -> Tuple[int, int, Optional[pd.DataFrame]]:
+    """
+    Recorre CleanChunks(raw_path, out_path, transform, key_columns, chunksize).
+
+    Si `collect` es True se devuelve también el DataFrame limpio, para usarlo
+    directamente sin volver a leer el fichero exportado.
+
+    Devuelve (filas de entrada, filas de salida, DataFrame limpio o None).
+    """
+    stream = CleanChunks(raw_path, out_path, transform, key_columns, chunksize, **read_kwargs)
+    parts = []
+    for chunk in stream:
+        if collect:
+            parts.append(chunk)
+
+    frame = None
+    if collect:
+        frame = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    return stream.n_in, stream.n_out, frame
+
+
+@contextmanager
+def track_peak_memory(enabled: bool = True):
+    """
+    Mide el pico de memoria reservada (tracemalloc; incluye los buffers de
+    NumPy/pandas). Uso:
+
+        with track_peak_memory() as mem:
+            ...
+        mem["peak_memory_mb"]
+
+    tracemalloc ralentiza mucho las reservas de memoria, así que los
+    limpiadores solo lo activan si se pide (enabled=False deja
+    peak_memory_mb a None).
+    """
+    result = {"peak_memory_mb": None}
+    if not enabled:
+        yield result
+        return
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    else:
+        tracemalloc.reset_peak()
+    try:
+        yield result
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        result["peak_memory_mb"] = round(peak / 2**20, 1)
+        if started:
+            tracemalloc.stop()
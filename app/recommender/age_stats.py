@@ -0,0 +1,118 @@
+from sqlalchemy import text
+
+from app.recommender.tables import has_table
+
+# Cubo de popularidad por edad: nº de ratings y suma de ratings por
+# (año de nacimiento del usuario, libro). Lo construye el ETL y lo mantienen
+# las escrituras de ratings aplicando deltas, como BOOK_STATS.
+#
+# Se indexa por año de nacimiento y no por edad: la edad depende del año de
+# referencia, que se elige al consultar (get_top_books_for_age_range), así
+# que el cubo no caduca al cambiar de año.
+BOOK_AGE_STATS_TABLE = "BOOK_AGE_STATS"
+
+_CREATE_BOOK_AGE_STATS = """
+CREATE TABLE BOOK_AGE_STATS (
+    birth_year  INTEGER NOT NULL,
+    book_id     INTEGER NOT NULL,
+    num_ratings INTEGER NOT NULL,
+    sum_rating  INTEGER NOT NULL,
+    PRIMARY KEY (birth_year, book_id)
+) WITHOUT ROWID
+"""
+
+# Año de nacimiento de USER u (NULL si no hay fecha válida)
+_BIRTH_YEAR = "CAST(strftime('%Y', u.fecha_nacimiento) AS INTEGER)"
+
+_UPSERT_DELTA = """
+ON CONFLICT (birth_year, book_id) DO UPDATE SET
+    num_ratings = num_ratings + excluded.num_ratings,
+    sum_rating  = sum_rating + excluded.sum_rating
+"""
+
+
+def has_book_age_stats(conn) -> bool:
+    """Indica si la BD ya tiene la tabla BOOK_AGE_STATS."""
+    return has_table(conn, BOOK_AGE_STATS_TABLE)
+
+
+def build_book_age_stats(conn) -> int:
+    """
+    (Re)construye BOOK_AGE_STATS a partir de RATING, USER y COPY (solo los
+    usuarios con fecha de nacimiento). Se ejecuta al final del ETL.
+    Devuelve el nº de celdas (año, libro) del cubo.
+    """
+    conn.execute(text(f"DROP TABLE IF EXISTS {BOOK_AGE_STATS_TABLE}"))
+    conn.execute(text(_CREATE_BOOK_AGE_STATS))
+    conn.execute(
+        text(
+            f"""
+            INSERT INTO BOOK_AGE_STATS (birth_year, book_id, num_ratings, sum_rating)
+            SELECT {_BIRTH_YEAR} AS birth_year, c.book_id, COUNT(*), SUM(r.rating)
+            FROM RATING r
+            JOIN USER u ON u.user_id = r.user_id
+            JOIN COPY c ON c.copy_id = r.copy_id
+            WHERE {_BIRTH_YEAR} IS NOT NULL
+            GROUP BY birth_year, c.book_id
+            """
+        )
+    )
+    return conn.execute(text("SELECT COUNT(*) FROM BOOK_AGE_STATS")).scalar()
+
+
+def apply_age_rating_delta(conn, user_id: int, copy_id: int, rating: int, old_rating=None) -> None:
+    """
+    Actualiza la celda (año de nacimiento del usuario, libro de la copia) tras
+    escribir un rating, igual que apply_rating_delta con BOOK_STATS. No hace
+    nada si el usuario no tiene fecha de nacimiento.
+
+    Debe llamarse dentro de la misma transacción que escribe en RATING.
+    """
+    if not has_book_age_stats(conn):
+        return
+    conn.execute(
+        text(
+            f"""
+            INSERT INTO BOOK_AGE_STATS (birth_year, book_id, num_ratings, sum_rating)
+            SELECT {_BIRTH_YEAR}, c.book_id, :d_num, :d_sum
+            FROM USER u, COPY c
+            WHERE u.user_id = :uid AND c.copy_id = :cid AND {_BIRTH_YEAR} IS NOT NULL
+            {_UPSERT_DELTA}
+            """
+        ),
+        {
+            "uid": user_id,
+            "cid": copy_id,
+            "d_num": int(old_rating is None),
+            "d_sum": rating - (old_rating or 0),
+        },
+    )
+
+
+def apply_age_batch_delta(conn) -> None:
+    """
+    Versión por lotes de apply_age_rating_delta para los ratings de
+    temp.RATING_BATCH (ver book_stats.save_ratings). Debe llamarse antes de
+    escribirlos en RATING, para ver los ratings anteriores.
+    """
+    if not has_book_age_stats(conn):
+        return
+    conn.execute(
+        text(
+            f"""
+            INSERT INTO BOOK_AGE_STATS (birth_year, book_id, num_ratings, sum_rating)
+            SELECT
+                {_BIRTH_YEAR} AS birth_year,
+                c.book_id,
+                SUM(r.rating IS NULL),
+                SUM(b.rating - COALESCE(r.rating, 0))
+            FROM temp.RATING_BATCH b
+            JOIN USER u ON u.user_id = b.user_id
+            JOIN COPY c ON c.copy_id = b.copy_id
+            LEFT JOIN RATING r ON r.user_id = b.user_id AND r.copy_id = b.copy_id
+            WHERE {_BIRTH_YEAR} IS NOT NULL
+            GROUP BY birth_year, c.book_id
+            {_UPSERT_DELTA}
+            """
+        )
+    )
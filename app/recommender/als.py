@@ -0,0 +1,288 @@
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import scipy.sparse as sp
+
+from app.recommender.matrix import UserItemMatrix, load_user_item_matrix
+from app.recommender.popularity import get_engine, get_read_engine
+from app.recommender.tables import bump_data_version
+
+# Carpeta donde se guardan los factores entrenados (.npy, leídos con mmap)
+BASE_DIR = Path(__file__).resolve().parents[2]
+ALS_MODEL_DIR = Path(os.environ.get("ALS_MODEL_DIR", BASE_DIR / "app" / "models" / "als"))
+
+# Tamaño de lote de usuarios/libros que se resuelven juntos con np.linalg.solve
+SOLVE_BATCH_SIZE = 1024
+# Memoria (bytes) de las filas de Y que se recogen a la vez al montar las matrices de un lote
+GATHER_BLOCK_BYTES = 2 * 2**20
+
+
+def _length_groups(counts: np.ndarray, max_gathered: int):
+    """
+    Reparte las filas (con `counts` ratings cada una) en grupos de longitud
+    parecida, para rellenarlas hasta la más larga del grupo sin desperdiciar
+    mucho, y de como mucho `max_gathered` posiciones en total.
+    Genera (índices de las filas, longitud del grupo).
+    """
+    order = np.argsort(counts, kind="stable")
+    lengths = counts[order]
+    start = 0
+    while start < len(order):
+        limit = lengths[start] * 1.25 + 8
+        stop = start + 1
+        while (stop < len(order) and lengths[stop] <= limit
+               and (stop - start + 1) * lengths[stop] <= max_gathered):
+            stop += 1
+        yield order[start:stop], int(lengths[stop - 1])
+        start = stop
+
+
+def _solve_side(
+    R: sp.csr_matrix,
+    Y: np.ndarray,
+    regularization: float,
+    implicit: bool,
+    alpha: float,
+    n_threads: int,
+) -> np.ndarray:
+    """
+    Medio paso de ALS: con Y fijo, resuelve los factores de cada fila de R.
+
+    - Explícito: (Y_I^T Y_I + λI) x = Y_I^T r
+    - Implícito (Hu et al. 2008), con confianza c = 1 + alpha·r:
+      (Y^T Y + Y_I^T diag(alpha·r) Y_I + λI) x = Y_I^T (1 + alpha·r)
+
+    Las filas se procesan en lotes, sin bucles de Python por fila: dentro de
+    cada lote se agrupan por nº de ratings, se recogen las filas de Y de cada
+    grupo (rellenando con ceros) y se montan sus matrices con un matmul
+    apilado; después un solo np.linalg.solve por lote. Los lotes se reparten
+    entre hilos; NumPy libera el GIL en esas operaciones.
+    """
+    n_rows, k = R.shape[0], Y.shape[1]
+    X = np.zeros((n_rows, k), dtype=np.float32)
+    # Y con una fila de ceros al final: es la que recogen las posiciones de relleno
+    Y_pad = np.vstack([Y.astype(np.float64), np.zeros((1, k))])
+    base = regularization * np.eye(k, dtype=np.float64)
+    if implicit:
+        base += Y_pad.T @ Y_pad
+    max_gathered = max(1, GATHER_BLOCK_BYTES // (8 * k))
+
+    def solve_batch(start: int) -> None:
+        stop = min(start + SOLVE_BATCH_SIZE, n_rows)
+        counts = np.diff(R.indptr[start:stop + 1])
+        A = np.empty((stop - start, k, k), dtype=np.float64)
+        b = np.empty((stop - start, k), dtype=np.float64)
+
+        for rows, length in _length_groups(counts, max_gathered):
+            # Ratings de las filas del grupo, rellenados hasta `length` con
+            # peso 0 y la fila de ceros de Y_pad
+            offsets = np.arange(length)
+            valid = offsets < counts[rows][:, None]
+            pos = np.where(valid, R.indptr[start + rows][:, None] + offsets, 0)
+            Yi = Y_pad[np.where(valid, R.indices[pos], len(Y_pad) - 1)]  # (filas, length, k)
+            r = np.where(valid, R.data[pos], 0.0)
+
+            # A = base + Y_I^T diag(w) Y_I y b = Y_I^T c de todas las filas a
+            # la vez (matmul apilado: BLAS por fila, sin el GIL)
+            w = alpha * r if implicit else valid.astype(np.float64)
+            c = np.where(valid, 1.0 + alpha * r, 0.0) if implicit else r
+            A[rows] = base + (Yi * w[..., None]).transpose(0, 2, 1) @ Yi
+            b[rows] = (c[:, None, :] @ Yi)[:, 0]
+
+        X[start:stop] = np.linalg.solve(A, b[..., None])[..., 0]
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        list(pool.map(solve_batch, range(0, n_rows, SOLVE_BATCH_SIZE)))
+    return X
+
+
+_ARRAY_NAMES = ("user_ids", "book_ids", "user_factors", "item_factors", "num_ratings")
+
+
+def _read_meta(directory: Path) -> dict:
+    try:
+        return json.loads((directory / "meta.json").read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+
+
+def _prune_versions(directory: Path, keep) -> None:
+    """Borra los subdirectorios de versiones que no están en `keep`."""
+    for path in directory.glob("v*"):
+        if path.is_dir() and path.name not in keep:
+            # En Linux los procesos que aún los tengan mapeados siguen
+            # leyéndolos; en Windows el borrado falla y se reintenta en el
+            # siguiente entrenamiento
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class ALSModel:
+    """
+    Factorización de matrices (ALS) sobre la matriz usuario × libro.
+
+    Los factores se pueden guardar como .npy y cargarse con mmap_mode="r",
+    de forma que varios workers de la API comparten las mismas páginas de
+    memoria sin copiarlas. Recomendar a un usuario es un producto
+    matriz-vector (item_factors · user_factor) más un argpartition.
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        book_ids: np.ndarray,
+        user_factors: np.ndarray,
+        item_factors: np.ndarray,
+        num_ratings: np.ndarray,
+    ):
+        self.user_ids = user_ids
+        self.book_ids = book_ids
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.num_ratings = num_ratings
+
+    @classmethod
+    def train(
+        cls,
+        uim: UserItemMatrix,
+        factors: int = 64,
+        regularization: float = 0.1,
+        iterations: int = 10,
+        implicit: bool = False,
+        alpha: float = 40.0,
+        n_threads: Optional[int] = None,
+        seed: int = 0,
+    ) -> "ALSModel":
+        n_threads = n_threads or os.cpu_count() or 1
+        R = uim.matrix.tocsr()
+        Rt = R.T.tocsr()
+
+        rng = np.random.default_rng(seed)
+        V = (rng.standard_normal((R.shape[1], factors)) * 0.01).astype(np.float32)
+        U = np.zeros((R.shape[0], factors), dtype=np.float32)
+
+        for _ in range(iterations):
+            U = _solve_side(R, V, regularization, implicit, alpha, n_threads)
+            V = _solve_side(Rt, U, regularization, implicit, alpha, n_threads)
+
+        return cls(
+            user_ids=uim.user_ids,
+            book_ids=uim.book_ids,
+            user_factors=U,
+            item_factors=V,
+            num_ratings=np.diff(R.tocsc().indptr),
+        )
+
+    def save(self, directory: Path = ALS_MODEL_DIR) -> Path:
+        """
+        Guarda los arrays del modelo como ficheros .npy en un subdirectorio
+        nuevo de `directory` (una versión por entrenamiento) y la publica
+        reemplazando meta.json de forma atómica (os.replace).
+
+        Nunca se sobrescriben los .npy de una versión anterior: los procesos
+        que los tienen mapeados con mmap seguirían leyendo ficheros
+        truncados (SIGBUS). Se conservan la versión nueva y la anterior.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        previous = _read_meta(directory).get("version")
+
+        version = f"v{time.time_ns()}"
+        target = directory / version
+        target.mkdir()
+        for name in _ARRAY_NAMES:
+            np.save(target / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+        meta = {"version": version, "n_users": len(self.user_ids), "n_books": len(self.book_ids),
+                "factors": int(self.item_factors.shape[1])}
+        tmp = directory / f".meta-{version}.json"
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, directory / "meta.json")
+
+        _prune_versions(directory, keep={version, previous})
+        return directory
+
+    @classmethod
+    def load(cls, directory: Path = ALS_MODEL_DIR, mmap: bool = True) -> "ALSModel":
+        """
+        Carga la versión publicada en meta.json; con mmap=True los factores se
+        mapean en memoria (solo lectura).
+        """
+        directory = Path(directory)
+        # Modelos guardados antes de versionar: los .npy están en `directory`
+        source = directory / _read_meta(directory).get("version", "")
+        mode = "r" if mmap else None
+        arrays = {name: np.load(source / f"{name}.npy", mmap_mode=mode) for name in _ARRAY_NAMES}
+        return cls(**arrays)
+
+
+_model: Optional[ALSModel] = None
+_model_key: Optional[tuple] = None
+_model_lock = threading.Lock()
+
+
+def get_als_model(directory: Path = ALS_MODEL_DIR) -> Optional[ALSModel]:
+    """
+    Modelo ALS del proceso, cargado con mmap desde `directory`.
+    Devuelve None si todavía no se ha entrenado (no existe meta.json).
+
+    Se vuelve a cargar cuando se publica una versión nueva (cambia meta.json),
+    así que un reentrenamiento llega a los procesos en marcha.
+    """
+    global _model, _model_key
+    meta_path = Path(directory) / "meta.json"
+    with _model_lock:
+        try:
+            st = meta_path.stat()
+        except FileNotFoundError:
+            _model, _model_key = None, None
+            return None
+        key = (str(meta_path), st.st_ino, st.st_mtime_ns, st.st_size)
+        if _model is None or key != _model_key:
+            _model, _model_key = ALSModel.load(directory), key
+        return _model
+
+
+def reset_als_model() -> None:
+    """Descarta el modelo cargado; se vuelve a leer de disco en la siguiente petición."""
+    global _model, _model_key
+    with _model_lock:
+        _model, _model_key = None, None
+
+
+def train_and_save(directory: Path = ALS_MODEL_DIR, **kwargs) -> Path:
+    """Entrena ALS con los ratings actuales de la BD y guarda los factores."""
+    model = ALSModel.train(load_user_item_matrix(get_read_engine()), **kwargs)
+    path = model.save(directory)
+    # Las recomendaciones ALS cambian: nueva versión de los datos para la API
+    with get_engine().begin() as conn:
+        bump_data_version(conn)
+    return path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Entrena el modelo ALS y guarda los factores.")
+    parser.add_argument("--factors", type=int, default=64)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--regularization", type=float, default=0.1)
+    parser.add_argument("--implicit", action="store_true", help="ALS implícito (confianza 1 + alpha·r)")
+    parser.add_argument("--alpha", type=float, default=40.0)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    out = train_and_save(
+        factors=args.factors,
+        iterations=args.iterations,
+        regularization=args.regularization,
+        implicit=args.implicit,
+        alpha=args.alpha,
+        n_threads=args.threads,
+    )
+    print(f"Modelo ALS guardado en {out}")
@@ -0,0 +1,350 @@
+import math
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from app.recommender.age_stats import apply_age_batch_delta, apply_age_rating_delta
+from app.recommender.dashboard import apply_dashboard_delta
+from app.recommender.tables import bump_data_version, has_table
+from app.recommender.user_recs import USER_RECS_TABLE, invalidate_user_recs
+
+# Tabla materializada con estadísticas de popularidad por libro.
+# La construye el ETL y la mantienen al día las escrituras de ratings
+# (POST /ratings y la UI) aplicando deltas, de forma que las lecturas del
+# recomendador no tengan que agregar toda la tabla RATING en cada petición.
+BOOK_STATS_TABLE = "BOOK_STATS"
+
+_CREATE_BOOK_STATS = """
+CREATE TABLE BOOK_STATS (
+    book_id     INTEGER PRIMARY KEY,
+    num_ratings INTEGER NOT NULL,
+    sum_rating  INTEGER NOT NULL,
+    mean_rating REAL    NOT NULL,
+    score       REAL    NOT NULL
+)
+"""
+
+
+def compute_score(mean_rating, num_ratings):
+    """
+    Score de popularidad: mean_rating * log(1 + num_ratings).
+    Acepta escalares o arrays de NumPy / Series de pandas.
+    """
+    if np.isscalar(mean_rating) and np.isscalar(num_ratings):
+        return float(mean_rating) * math.log1p(num_ratings)
+    return mean_rating * np.log1p(num_ratings)
+
+
+def has_book_stats(conn) -> bool:
+    """Indica si la BD ya tiene la tabla BOOK_STATS."""
+    return has_table(conn, BOOK_STATS_TABLE)
+
+
+def build_book_stats(conn) -> int:
+    """
+    (Re)construye BOOK_STATS a partir de RATING y COPY.
+
+    Se ejecuta una vez al final del ETL. Devuelve el nº de libros con stats.
+    """
+    agg = pd.read_sql(
+        text(
+            """
+            SELECT
+                c.book_id,
+                COUNT(r.rating) AS num_ratings,
+                SUM(r.rating)   AS sum_rating
+            FROM RATING r
+            JOIN COPY c ON r.copy_id = c.copy_id
+            GROUP BY c.book_id
+            """
+        ),
+        conn,
+    )
+    agg["mean_rating"] = agg["sum_rating"] / agg["num_ratings"]
+    agg["score"] = compute_score(agg["mean_rating"], agg["num_ratings"])
+
+    conn.execute(text(f"DROP TABLE IF EXISTS {BOOK_STATS_TABLE}"))
+    conn.execute(text(_CREATE_BOOK_STATS))
+    if not agg.empty:
+        conn.execute(
+            text(
+                """
+                INSERT INTO BOOK_STATS (book_id, num_ratings, sum_rating, mean_rating, score)
+                VALUES (:book_id, :num_ratings, :sum_rating, :mean_rating, :score)
+                """
+            ),
+            agg.astype(object).to_dict(orient="records"),
+        )
+    return len(agg)
+
+
+def apply_rating_delta(
+    conn,
+    copy_id: int,
+    rating: int,
+    old_rating: Optional[int] = None,
+) -> None:
+    """
+    Actualiza BOOK_STATS tras escribir un rating, sin reagregar RATING.
+
+    - Si old_rating es None (inserción): suma 1 a num_ratings y rating a sum_rating.
+    - Si no (actualización): ajusta sum_rating con (rating - old_rating).
+
+    Debe llamarse dentro de la misma transacción que escribe en RATING.
+    """
+    if not has_book_stats(conn):
+        return
+
+    book_id = conn.execute(
+        text("SELECT book_id FROM COPY WHERE copy_id = :cid"),
+        {"cid": copy_id},
+    ).scalar()
+    if book_id is None:
+        return
+
+    row = conn.execute(
+        text("SELECT num_ratings, sum_rating FROM BOOK_STATS WHERE book_id = :bid"),
+        {"bid": book_id},
+    ).first()
+    num_ratings, sum_rating = (row.num_ratings, row.sum_rating) if row else (0, 0)
+
+    if old_rating is None:
+        num_ratings += 1
+        sum_rating += rating
+    else:
+        sum_rating += rating - old_rating
+
+    if num_ratings == 0:
+        return
+
+    mean_rating = sum_rating / num_ratings
+    conn.execute(
+        text(
+            """
+            INSERT INTO BOOK_STATS (book_id, num_ratings, sum_rating, mean_rating, score)
+            VALUES (:bid, :num, :total, :mean, :score)
+            ON CONFLICT(book_id) DO UPDATE SET
+                num_ratings = excluded.num_ratings,
+                sum_rating  = excluded.sum_rating,
+                mean_rating = excluded.mean_rating,
+                score       = excluded.score
+            """
+        ),
+        {
+            "bid": book_id,
+            "num": num_ratings,
+            "total": sum_rating,
+            "mean": mean_rating,
+            "score": compute_score(mean_rating, num_ratings),
+        },
+    )
+
+
+def save_rating(conn, user_id: int, copy_id: int, rating: int) -> Optional[int]:
+    """
+    Inserta o actualiza el rating (user_id, copy_id) y mantiene BOOK_STATS,
+    BOOK_AGE_STATS y el contador de ratings de DASHBOARD_AGG.
+    Las recomendaciones precalculadas del usuario (USER_RECS) se descartan y
+    se incrementa la versión de los datos (META).
+
+    Se asume que USER y COPY ya se han validado. Devuelve el rating anterior
+    (None si era una inserción).
+    """
+    params = {"uid": user_id, "cid": copy_id, "rating": rating}
+
+    # Primero una escritura (ver save_ratings): con el bloqueo de escritura ya
+    # tomado, nadie puede insertar el mismo par ni mover BOOK_STATS entre la
+    # lectura de old_rating y la escritura de los deltas.
+    bump_data_version(conn)
+
+    old_rating = conn.execute(
+        text("SELECT rating FROM RATING WHERE user_id = :uid AND copy_id = :cid"),
+        params,
+    ).scalar()
+
+    if old_rating is None:
+        conn.execute(
+            text(
+                """
+                INSERT INTO RATING (user_id, copy_id, rating)
+                VALUES (:uid, :cid, :rating)
+                """
+            ),
+            params,
+        )
+    else:
+        conn.execute(
+            text(
+                """
+                UPDATE RATING
+                SET rating = :rating
+                WHERE user_id = :uid AND copy_id = :cid
+                """
+            ),
+            params,
+        )
+
+    apply_rating_delta(conn, copy_id, rating, old_rating=old_rating)
+    apply_age_rating_delta(conn, user_id, copy_id, rating, old_rating=old_rating)
+    apply_dashboard_delta(conn, new_ratings=int(old_rating is None))
+    invalidate_user_recs(conn, user_id)
+    return old_rating
+
+
+_CREATE_RATING_BATCH = """
+CREATE TEMP TABLE IF NOT EXISTS RATING_BATCH (
+    user_id INTEGER NOT NULL,
+    copy_id INTEGER NOT NULL,
+    rating  INTEGER NOT NULL,
+    PRIMARY KEY (user_id, copy_id)
+)
+"""
+
+
+def save_ratings(conn, ratings: Dict[Tuple[int, int], int]) -> int:
+    """
+    Versión por lotes de save_rating: escribe {(user_id, copy_id): rating} con
+    un único INSERT ... ON CONFLICT DO UPDATE y aplica a BOOK_STATS los deltas
+    agregados por libro (y a BOOK_AGE_STATS y DASHBOARD_AGG los suyos), en la
+    transacción de `conn`.
+
+    Los pares cuyo USER o COPY no existen se ignoran. Invalida USER_RECS de los
+    usuarios afectados e incrementa una sola vez la versión de los datos.
+    Devuelve el nº de ratings escritos.
+    """
+    if not ratings:
+        return 0
+
+    # La primera sentencia sobre la BD principal debe ser una escritura: así
+    # la transacción toma el bloqueo de escritura (esperando busy_timeout si
+    # hace falta) antes de leer nada. Si leyera primero, en modo WAL otra
+    # conexión podría confirmar entre medias y la escritura posterior
+    # fallaría al momento con SQLITE_BUSY_SNAPSHOT ("database is locked").
+    bump_data_version(conn)
+
+    _stage_ratings(conn, [{"uid": uid, "cid": cid, "rating": rating} for (uid, cid), rating in ratings.items()])
+    return _write_staged_ratings(conn)
+
+
+def insert_new_ratings(conn, ratings: pd.DataFrame) -> int:
+    """
+    Inserta los ratings de `ratings` (columnas user_id, copy_id, rating) que
+    aún no existan en RATING, como ON CONFLICT DO NOTHING, manteniendo las
+    tablas derivadas con los mismos deltas por lotes que save_ratings.
+    Lo usa el ETL incremental; no incrementa la versión de los datos.
+
+    Devuelve el nº de ratings insertados.
+    """
+    if ratings.empty:
+        return 0
+    _stage_ratings(conn, [
+        {"uid": uid, "cid": cid, "rating": rating}
+        for uid, cid, rating in zip(*(ratings[c].to_numpy().tolist() for c in ("user_id", "copy_id", "rating")))
+    ])
+    # Se conservan los ratings existentes (p. ej. escritos desde la API)
+    conn.execute(
+        text(
+            """
+            DELETE FROM temp.RATING_BATCH
+            WHERE EXISTS (
+                SELECT 1 FROM RATING r
+                WHERE r.user_id = RATING_BATCH.user_id AND r.copy_id = RATING_BATCH.copy_id
+            )
+            """
+        )
+    )
+    return _write_staged_ratings(conn)
+
+
+def _stage_ratings(conn, rows) -> None:
+    """Carga `rows` ({uid, cid, rating}) en temp.RATING_BATCH, sin los que no apuntan a un USER y una COPY."""
+    conn.execute(text(_CREATE_RATING_BATCH))
+    conn.execute(text("DELETE FROM temp.RATING_BATCH"))
+    conn.execute(
+        text("INSERT INTO temp.RATING_BATCH (user_id, copy_id, rating) VALUES (:uid, :cid, :rating)"),
+        rows,
+    )
+    conn.execute(
+        text(
+            """
+            DELETE FROM temp.RATING_BATCH
+            WHERE user_id NOT IN (SELECT user_id FROM USER)
+               OR copy_id NOT IN (SELECT copy_id FROM COPY)
+            """
+        )
+    )
+
+
+def _write_staged_ratings(conn) -> int:
+    """
+    Escribe en RATING los ratings de temp.RATING_BATCH y aplica sus deltas a
+    BOOK_STATS, BOOK_AGE_STATS y DASHBOARD_AGG; descarta USER_RECS de sus
+    usuarios. Devuelve el nº de ratings escritos.
+    """
+    # Deltas por libro, calculados antes de sobrescribir los ratings anteriores
+    deltas = pd.read_sql(
+        text(
+            """
+            SELECT
+                c.book_id,
+                SUM(r.rating IS NULL)                  AS d_num,
+                SUM(b.rating - COALESCE(r.rating, 0)) AS d_sum
+            FROM temp.RATING_BATCH b
+            JOIN COPY c ON c.copy_id = b.copy_id
+            LEFT JOIN RATING r ON r.user_id = b.user_id AND r.copy_id = b.copy_id
+            GROUP BY c.book_id
+            """
+        ),
+        conn,
+    )
+
+    apply_age_batch_delta(conn)
+
+    written = conn.execute(
+        text(
+            """
+            INSERT INTO RATING (user_id, copy_id, rating)
+            SELECT user_id, copy_id, rating FROM temp.RATING_BATCH WHERE true
+            ON CONFLICT (user_id, copy_id) DO UPDATE SET rating = excluded.rating
+            """
+        )
+    ).rowcount
+
+    if has_book_stats(conn) and not deltas.empty:
+        current = pd.read_sql(
+            text("SELECT book_id, num_ratings, sum_rating FROM BOOK_STATS WHERE book_id IN :bids").bindparams(
+                bindparam("bids", expanding=True)
+            ),
+            conn,
+            params={"bids": deltas["book_id"].tolist()},
+        )
+        stats = deltas.merge(current, on="book_id", how="left").fillna({"num_ratings": 0, "sum_rating": 0})
+        stats["num_ratings"] = (stats["num_ratings"] + stats["d_num"]).astype("int64")
+        stats["sum_rating"] = (stats["sum_rating"] + stats["d_sum"]).astype("int64")
+        stats = stats[stats["num_ratings"] > 0]
+        stats["mean_rating"] = stats["sum_rating"] / stats["num_ratings"]
+        stats["score"] = compute_score(stats["mean_rating"], stats["num_ratings"])
+        conn.execute(
+            text(
+                """
+                INSERT INTO BOOK_STATS (book_id, num_ratings, sum_rating, mean_rating, score)
+                VALUES (:book_id, :num_ratings, :sum_rating, :mean_rating, :score)
+                ON CONFLICT(book_id) DO UPDATE SET
+                    num_ratings = excluded.num_ratings,
+                    sum_rating  = excluded.sum_rating,
+                    mean_rating = excluded.mean_rating,
+                    score       = excluded.score
+                """
+            ),
+            stats[["book_id", "num_ratings", "sum_rating", "mean_rating", "score"]]
+            .astype(object)
+            .to_dict(orient="records"),
+        )
+
+    apply_dashboard_delta(conn, new_ratings=int(deltas["d_num"].sum()))
+    if has_table(conn, USER_RECS_TABLE):
+        conn.execute(text("DELETE FROM USER_RECS WHERE user_id IN (SELECT user_id FROM temp.RATING_BATCH)"))
+    conn.execute(text("DELETE FROM temp.RATING_BATCH"))
+    return written
@@ -0,0 +1,227 @@
+import itertools
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+# TTL (segundos) de la caché de popularidad; configurable por variable de entorno.
+DEFAULT_TTL_SECONDS = float(os.environ.get("RECOMMENDER_CACHE_TTL", "60"))
+
+STATS_COLUMNS = [
+    "book_id",
+    "title",
+    "authors",
+    "language_code",
+    "num_ratings",
+    "mean_rating",
+    "score",
+]
+
+
+@dataclass(frozen=True)
+class PartitionIndex:
+    """
+    Filas de BookStatsArrays agrupadas por una clave (idioma; en el futuro,
+    género de BOOK_GENRE, donde un libro puede estar en varias particiones).
+
+    Las filas de cada partición se guardan en orden de score descendente
+    (formato CSR: `rows[offsets[i]:offsets[i + 1]]` es la partición
+    `keys[i]`), así que el top N de una partición es un prefijo de su lista
+    y cualquier `min_ratings` se aplica con una máscara sobre ella.
+    """
+
+    keys: np.ndarray
+    offsets: np.ndarray
+    rows: np.ndarray
+
+    @classmethod
+    def from_pairs(cls, rows: np.ndarray, keys: np.ndarray) -> "PartitionIndex":
+        """Índice a partir de pares (fila, clave); las claves nulas se ignoran."""
+        keys = np.asarray(keys, dtype=object)
+        valid = pd.notna(keys)
+        rows, keys = np.asarray(rows, dtype=np.int64)[valid], keys[valid].astype(str)
+        # Orden por clave y, dentro de cada clave, por fila (= por score)
+        order = np.lexsort((rows, keys))
+        unique, starts = np.unique(keys[order], return_index=True)
+        return cls(
+            keys=unique,
+            offsets=np.append(starts, len(order)).astype(np.int64),
+            rows=rows[order],
+        )
+
+    def rows_for(self, key: str) -> np.ndarray:
+        """Filas de la partición `key` ordenadas por score (vacío si no existe)."""
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return self.rows[:0]
+        return self.rows[self.offsets[i]:self.offsets[i + 1]]
+
+
+@dataclass(frozen=True)
+class BookStatsArrays:
+    """
+    Estadísticas de popularidad por libro en forma de arrays de NumPy,
+    ya puntuadas y ordenadas por score descendente.
+    """
+
+    book_id: np.ndarray
+    title: np.ndarray
+    authors: np.ndarray
+    language_code: np.ndarray
+    num_ratings: np.ndarray
+    mean_rating: np.ndarray
+    score: np.ndarray
+    # Permutación que ordena book_id (para buscar libros por id)
+    by_book: np.ndarray
+    # Filas por language_code, cada partición ordenada por score
+    by_language: PartitionIndex
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "BookStatsArrays":
+        df = df.sort_values("score", ascending=False, kind="stable")
+        return cls(
+            book_id=df["book_id"].to_numpy(dtype=np.int64),
+            title=df["title"].to_numpy(dtype=object),
+            authors=df["authors"].to_numpy(dtype=object),
+            language_code=df["language_code"].to_numpy(dtype=object),
+            num_ratings=df["num_ratings"].to_numpy(dtype=np.int64),
+            mean_rating=df["mean_rating"].to_numpy(dtype=np.float64),
+            score=df["score"].to_numpy(dtype=np.float64),
+            by_book=np.argsort(df["book_id"].to_numpy(dtype=np.int64), kind="stable"),
+            by_language=PartitionIndex.from_pairs(np.arange(len(df)), df["language_code"].to_numpy(dtype=object)),
+        )
+
+    def __len__(self) -> int:
+        return len(self.book_id)
+
+    def positions(self, book_ids) -> np.ndarray:
+        """Posición de cada book_id en los arrays; -1 si el libro no tiene stats."""
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(book_ids.shape, -1, dtype=np.int64)
+        sorted_ids = self.book_id[self.by_book]
+        pos = np.minimum(np.searchsorted(sorted_ids, book_ids), len(self) - 1)
+        return np.where(sorted_ids[pos] == book_ids, self.by_book[pos], -1)
+
+    def to_frame(self, idx: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Construye un DataFrame con las filas `idx` (todas si es None)."""
+        if idx is None:
+            idx = np.arange(len(self))
+        return pd.DataFrame({col: getattr(self, col)[idx] for col in STATS_COLUMNS})
+
+
+@dataclass(frozen=True)
+class AgeCube:
+    """
+    Cubo BOOK_AGE_STATS en forma densa: filas = años de nacimiento
+    (consecutivos), columnas = libros, con sumas acumuladas por año. El total
+    de un rango de años es la resta de dos filas (suma de prefijos), para
+    todos los libros a la vez.
+    """
+
+    first_year: int
+    book_id: np.ndarray
+    # cum_*[i] = totales de los años < first_year + i (cum_*[0] = 0)
+    cum_num: np.ndarray
+    cum_sum: np.ndarray
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "AgeCube":
+        if df.empty:
+            empty = np.zeros((1, 0), dtype=np.int64)
+            return cls(first_year=0, book_id=np.empty(0, dtype=np.int64), cum_num=empty, cum_sum=empty)
+
+        years = df["birth_year"].to_numpy(dtype=np.int64)
+        book_id, col = np.unique(df["book_id"].to_numpy(dtype=np.int64), return_inverse=True)
+        first_year = int(years.min())
+        row = years - first_year + 1
+        shape = (int(years.max()) - first_year + 2, len(book_id))
+
+        num = np.zeros(shape, dtype=np.int64)
+        total = np.zeros(shape, dtype=np.int64)
+        np.add.at(num, (row, col), df["num_ratings"].to_numpy(dtype=np.int64))
+        np.add.at(total, (row, col), df["sum_rating"].to_numpy(dtype=np.int64))
+        return cls(
+            first_year=first_year,
+            book_id=book_id,
+            cum_num=np.cumsum(num, axis=0),
+            cum_sum=np.cumsum(total, axis=0),
+        )
+
+    def range_totals(self, year_from: int, year_to: int):
+        """(num_ratings, sum_rating) por libro de los usuarios nacidos en [year_from, year_to]."""
+        last = self.cum_num.shape[0] - 1
+        lo = int(np.clip(year_from - self.first_year, 0, last))
+        hi = int(np.clip(year_to - self.first_year + 1, 0, last))
+        if hi <= lo:
+            zeros = np.zeros(len(self.book_id), dtype=np.int64)
+            return zeros, zeros
+        return self.cum_num[hi] - self.cum_num[lo], self.cum_sum[hi] - self.cum_sum[lo]
+
+
+class PopularityCache:
+    """
+    Caché en proceso de las estadísticas de popularidad.
+
+    - Guarda durante `ttl_seconds` (0 desactiva la caché) el resultado de
+      `build` sobre el DataFrame de `loader` (por defecto, un BookStatsArrays).
+    - `invalidate()` la vacía; se llama tras cada escritura de ratings. No
+      toma el lock (que get() mantiene mientras carga), así que no espera a
+      una carga en curso: solo cambia la generación, y lo cargado con una
+      generación anterior deja de valer.
+    - Lleva contadores de aciertos/fallos para monitorización.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], pd.DataFrame],
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        build: Callable[[pd.DataFrame], Any] = BookStatsArrays.from_frame,
+    ):
+        self._loader = loader
+        self._build = build
+        self.ttl_seconds = ttl_seconds
+        self._value: Any = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._generations = itertools.count()
+        self._generation = next(self._generations)
+        self._value_generation = -1
+        self.hits = 0
+        self.misses = 0
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._value is not None
+            and self._value_generation == self._generation
+            and self.ttl_seconds > 0
+            and time.monotonic() - self._loaded_at < self.ttl_seconds
+        )
+
+    def get(self) -> Any:
+        with self._lock:
+            if self._is_fresh():
+                self.hits += 1
+                return self._value
+
+            self.misses += 1
+            generation = self._generation
+            value = self._build(self._loader())
+            self._value, self._value_generation = value, generation
+            self._loaded_at = time.monotonic()
+            return value
+
+    def invalidate(self) -> None:
+        self._generation = next(self._generations)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl_seconds": self.ttl_seconds,
+            "cached": self._value is not None and self._value_generation == self._generation,
+        }
@@ -1,50 +1,229 @@
-from typing import Optional
+from typing import Literal, Sequence, Tuple, get_args
+
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
+from sqlalchemy import bindparam, text
 
-from app.recommender.popularity import get_engine, _base_book_stats
+from app.recommender.als import get_als_model
+from app.recommender.item_cf import get_item_cf_model
+from app.recommender.matrix import lookup_ids
+from app.recommender.popularity import get_book_stats_arrays, get_read_engine
 
+# Métodos de recomendación disponibles
+RecommendationMethod = Literal["popularity", "item_cf", "als"]
+RECOMMENDATION_METHODS = get_args(RecommendationMethod)
 
-def get_recommendations_for_user(
-    user_id: int,
+# Usuarios que se puntúan juntos (y que se piden a la BD en un mismo IN (...))
+BATCH_CHUNK_SIZE = 500
+
+BATCH_COLUMNS = [
+    "user_id",
+    "rank",
+    "book_id",
+    "title",
+    "authors",
+    "language_code",
+    "num_ratings",
+    "mean_rating",
+    "score",
+]
+
+
+def _get_users_book_ratings(user_ids: np.ndarray) -> pd.DataFrame:
+    """Libros que cada usuario YA ha valorado, con su rating medio por libro."""
+    query_rated = text(
+        """
+        SELECT r.user_id, c.book_id, AVG(r.rating) AS rating
+        FROM RATING r
+        JOIN COPY c ON r.copy_id = c.copy_id
+        WHERE r.user_id IN :user_ids
+        GROUP BY r.user_id, c.book_id
+        """
+    ).bindparams(bindparam("user_ids", expanding=True))
+    return pd.read_sql(
+        query_rated, get_read_engine(), params={"user_ids": [int(u) for u in user_ids]}
+    )
+
+
+def _ratings_matrix(rated: pd.DataFrame, user_ids: np.ndarray, cols: np.ndarray, n_cols: int) -> sp.csr_matrix:
+    """
+    Matriz dispersa (usuarios del lote × columnas) con los ratings de `rated`.
+    `cols` es la columna de cada fila de `rated` (-1 si no está en el espacio destino).
+    """
+    rows = lookup_ids(user_ids, rated["user_id"].to_numpy())
+    keep = (rows >= 0) & (cols >= 0)
+    return sp.csr_matrix(
+        (rated["rating"].to_numpy(dtype=np.float32)[keep], (rows[keep], cols[keep])),
+        shape=(len(user_ids), n_cols),
+    )
+
+
+def _top_n_per_row(scores: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-N de cada fila de una matriz densa de scores (un argpartition para todo
+    el lote). Devuelve (índices, scores) de forma (filas × N); los huecos
+    (scores -inf) se marcan con índice -1.
+    """
+    n = min(n, scores.shape[1])
+    if n == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64), np.empty((scores.shape[0], 0))
+    part = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+    vals = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-vals, axis=1, kind="stable")
+    idx = np.take_along_axis(part, order, axis=1)
+    vals = np.take_along_axis(vals, order, axis=1)
+    idx[~np.isfinite(vals)] = -1
+    return idx, vals
+
+
+def _pad(a: np.ndarray, width: int, fill) -> np.ndarray:
+    """Rellena por la derecha las filas de `a` hasta `width` columnas."""
+    if a.shape[1] >= width:
+        return a
+    pad = np.full((a.shape[0], width - a.shape[1]), fill, dtype=np.result_type(a, type(fill)))
+    return np.hstack([a.astype(pad.dtype), pad])
+
+
+def _popularity_batch(user_ids: np.ndarray, rated: pd.DataFrame, n: int, min_ratings: int):
+    # Popularidad global (desde la caché en proceso, ya ordenada por score)
+    stats = get_book_stats_arrays()
+    read = _ratings_matrix(rated, user_ids, stats.positions(rated["book_id"].to_numpy()), len(stats))
+
+    # Basta con los primeros n + (máx. libros leídos por un usuario) candidatos
+    candidates = np.flatnonzero(stats.num_ratings >= min_ratings)
+    max_read = int(np.diff(read.indptr).max()) if len(user_ids) else 0
+    top = candidates[: n + max_read]
+
+    # Excluimos libros ya leídos por cada usuario, todos a la vez
+    scores = np.where(read[:, top].toarray() > 0, -np.inf, stats.score[top][None, :])
+    idx, vals = _top_n_per_row(scores, n)
+    return np.where(idx >= 0, stats.book_id[top[idx]], -1), vals
+
+
+def _item_cf_batch(user_ids: np.ndarray, rated: pd.DataFrame, n: int, min_ratings: int):
+    model = get_item_cf_model()
+    R = _ratings_matrix(
+        rated, user_ids, lookup_ids(model.book_ids, rated["book_id"].to_numpy()), len(model.book_ids)
+    )
+
+    # r_u · W para todos los usuarios del lote: un solo producto disperso
+    scores = (R @ model.neighbours).toarray()
+    scores[scores <= 0] = -np.inf
+    scores[R.nonzero()] = -np.inf
+    scores[:, model.num_ratings < min_ratings] = -np.inf
+
+    idx, vals = _top_n_per_row(scores, n)
+    return np.where(idx >= 0, model.book_ids[idx], -1), vals
+
+
+def _als_batch(user_ids: np.ndarray, rated: pd.DataFrame, n: int, min_ratings: int):
+    model = get_als_model()
+    if model is None:
+        return np.full((len(user_ids), 0), -1), np.empty((len(user_ids), 0))
+
+    rows = lookup_ids(model.user_ids, user_ids)
+    known = rows >= 0
+    scores = np.full((len(user_ids), len(model.book_ids)), -np.inf, dtype=np.float32)
+    scores[known] = model.user_factors[rows[known]] @ model.item_factors.T
+
+    read = _ratings_matrix(
+        rated, user_ids, lookup_ids(model.book_ids, rated["book_id"].to_numpy()), len(model.book_ids)
+    )
+    scores[read.nonzero()] = -np.inf
+    scores[:, model.num_ratings < min_ratings] = -np.inf
+
+    idx, vals = _top_n_per_row(scores, n)
+    return np.where(idx >= 0, np.asarray(model.book_ids)[idx], -1), vals
+
+
+_BATCH_SCORERS = {
+    "popularity": _popularity_batch,
+    "item_cf": _item_cf_batch,
+    "als": _als_batch,
+}
+
+
+def _recommend_chunk(user_ids: np.ndarray, n: int, min_ratings: int, method: str) -> pd.DataFrame:
+    rated = _get_users_book_ratings(user_ids)
+    book_ids, scores = _BATCH_SCORERS[method](user_ids, rated, n, min_ratings)
+
+    # Usuarios sin candidatos del modelo -> baseline de popularidad
+    empty = ~(book_ids >= 0).any(axis=1)
+    if method != "popularity" and empty.any():
+        pop_ids, pop_scores = _popularity_batch(
+            user_ids[empty], rated[rated["user_id"].isin(user_ids[empty])], n, min_ratings
+        )
+        width = max(book_ids.shape[1], pop_ids.shape[1])
+        book_ids = _pad(book_ids, width, -1)
+        scores = _pad(scores, width, -np.inf)
+        book_ids[empty] = _pad(pop_ids, width, -1)
+        scores[empty] = _pad(pop_scores, width, -np.inf)
+
+    # Formato largo: una fila por (usuario, posición) con la info del libro
+    stats = get_book_stats_arrays()
+    rows, ranks = np.nonzero(book_ids >= 0)
+    pos = stats.positions(book_ids[rows, ranks])
+    found = pos >= 0
+    df = stats.to_frame(pos[found])
+    df["score"] = scores[rows, ranks][found].astype(np.float64)
+    df.insert(0, "rank", ranks[found] + 1)
+    df.insert(0, "user_id", user_ids[rows[found]])
+    return df
+
+
+def get_recommendations_for_users(
+    user_ids: Sequence[int],
     n: int = 10,
     min_ratings: int = 20,
+    method: RecommendationMethod = "popularity",
 ) -> pd.DataFrame:
     """
-    Recomendaciones para un usuario concreto.
+    Recomendaciones para muchos usuarios a la vez (campañas, precálculo).
 
-    Versión inicial (baseline):
-    - Calcula popularidad global de libros.
-    - Excluye los libros que el usuario ya ha valorado.
-    - Devuelve los N libros más recomendados.
+    Los usuarios se procesan en lotes de BATCH_CHUNK_SIZE: de cada lote se
+    leen los ratings con una sola consulta, se construye una matriz dispersa
+    usuario × libro y se puntúa y se enmascaran los libros leídos de todo el
+    lote con operaciones vectorizadas.
 
-    Más adelante se puede sustituir la parte de popularidad global
-    por un modelo colaborativo user-based o item-based.
+    Devuelve un DataFrame en formato largo con columnas
+    [user_id, rank, book_id, title, authors, language_code, num_ratings, mean_rating, score].
     """
-    engine = get_engine()
+    if method not in RECOMMENDATION_METHODS:
+        raise ValueError(f"Método de recomendación desconocido: {method}")
 
-    # Libros que el usuario YA ha valorado
-    query_rated = """
-    SELECT DISTINCT c.book_id
-    FROM RATING r
-    JOIN COPY c ON r.copy_id = c.copy_id
-    WHERE r.user_id = :user_id
-    """
-    rated = pd.read_sql(query_rated, engine, params={"user_id": user_id})
-    already_read = set(rated["book_id"].tolist())
+    user_ids = np.unique(np.asarray(user_ids, dtype=np.int64))
+    chunks = [
+        _recommend_chunk(user_ids[start:start + BATCH_CHUNK_SIZE], n, min_ratings, method)
+        for start in range(0, len(user_ids), BATCH_CHUNK_SIZE)
+    ]
+    if not chunks:
+        return pd.DataFrame(columns=BATCH_COLUMNS)
+    return pd.concat(chunks, ignore_index=True)
 
-    # Popularidad global
-    stats = _base_book_stats(engine)
-    stats = stats[stats["num_ratings"] >= min_ratings]
 
-    # Añadimos score (mismo criterio que en popularity.py)
-    stats = stats.copy()
-    import numpy as np
-    stats["score"] = stats["mean_rating"] * np.log1p(stats["num_ratings"])
+def get_recommendations_for_user(
+    user_id: int,
+    n: int = 10,
+    min_ratings: int = 20,
+    method: RecommendationMethod = "popularity",
+) -> pd.DataFrame:
+    """
+    Recomendaciones para un usuario concreto.
+
+    - method="popularity" (baseline): popularidad global excluyendo los
+      libros que el usuario ya ha valorado.
+    - method="item_cf": filtrado colaborativo item-based (ver item_cf.py);
+      el score es la suma de similitudes ponderada por los ratings del
+      usuario.
+    - method="als": factorización de matrices (ver als.py), con los factores
+      entrenados offline con `python -m app.recommender.als`.
 
-    # Excluimos libros ya leídos por el usuario
-    if already_read:
-        stats = stats[~stats["book_id"].isin(already_read)]
+    Si el usuario no tiene ratings, el modelo no está entrenado o no
+    encuentra candidatos, se recurre al baseline de popularidad.
 
-    # Devolvemos top N
-    stats = stats.sort_values("score", ascending=False)
-    return stats.head(n).reset_index(drop=True)
+    Devuelve los N libros más recomendados. Es el caso de un solo usuario de
+    get_recommendations_for_users.
+    """
+    df = get_recommendations_for_users([user_id], n=n, min_ratings=min_ratings, method=method)
+    return df.drop(columns=["user_id", "rank"]).reset_index(drop=True)
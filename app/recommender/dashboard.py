@@ -0,0 +1,134 @@
+from dataclasses import dataclass
+from typing import Dict
+
+from sqlalchemy import text
+
+from app.recommender.tables import has_table
+
+# Agregados de los dashboards (UI y GET /stats) precalculados en una tabla.
+# La construye el ETL y las escrituras de ratings mantienen el contador de
+# ratings, de forma que los dashboards leen unas pocas filas en vez de contar
+# RATING (~6M filas) y parsear todas las fechas de nacimiento.
+DASHBOARD_AGG_TABLE = "DASHBOARD_AGG"
+
+_CREATE_DASHBOARD_AGG = """
+CREATE TABLE DASHBOARD_AGG (
+    metric TEXT    NOT NULL,
+    bucket INTEGER NOT NULL,
+    value  INTEGER NOT NULL,
+    PRIMARY KEY (metric, bucket)
+) WITHOUT ROWID
+"""
+
+# Cada agregado como SELECT (metric, bucket, value). Los contadores usan bucket 0;
+# los histogramas, el año (de nacimiento del usuario o de publicación del libro).
+# Los de USER y BOOK (_CATALOG_QUERIES) son baratos de recalcular; el contador
+# de ratings se mantiene con deltas (apply_dashboard_delta).
+_RATINGS_QUERY = "SELECT 'ratings', 0, COUNT(*) FROM RATING"
+_CATALOG_QUERIES = [
+    "SELECT 'users', 0, COUNT(*) FROM USER",
+    "SELECT 'books', 0, COUNT(*) FROM BOOK",
+    """
+    SELECT 'birth_year', CAST(strftime('%Y', fecha_nacimiento) AS INTEGER) AS year, COUNT(*)
+    FROM USER
+    WHERE strftime('%Y', fecha_nacimiento) IS NOT NULL
+    GROUP BY year
+    """,
+    """
+    SELECT 'publication_year', original_publication_year, COUNT(*)
+    FROM BOOK
+    WHERE original_publication_year IS NOT NULL
+    GROUP BY original_publication_year
+    """,
+]
+_AGGREGATE_QUERIES = _CATALOG_QUERIES + [_RATINGS_QUERY]
+
+
+@dataclass(frozen=True)
+class DashboardAggregates:
+    n_users: int
+    n_books: int
+    n_ratings: int
+    # Nº de usuarios por año de nacimiento y de libros por año de publicación
+    users_by_birth_year: Dict[int, int]
+    books_by_year: Dict[int, int]
+
+    def users_by_age(self, reference_year: int) -> Dict[int, int]:
+        """Nº de usuarios por edad (aproximada por el año) en `reference_year`."""
+        by_age: Dict[int, int] = {}
+        for year, count in self.users_by_birth_year.items():
+            age = reference_year - year
+            by_age[age] = by_age.get(age, 0) + count
+        return dict(sorted(by_age.items()))
+
+
+def has_dashboard_agg(conn) -> bool:
+    """Indica si la BD ya tiene la tabla DASHBOARD_AGG."""
+    return has_table(conn, DASHBOARD_AGG_TABLE)
+
+
+def build_dashboard_agg(conn) -> int:
+    """
+    (Re)construye DASHBOARD_AGG a partir de USER, BOOK y RATING.
+
+    Se ejecuta al final del ETL. Devuelve el nº de filas de la tabla.
+    """
+    conn.execute(text(f"DROP TABLE IF EXISTS {DASHBOARD_AGG_TABLE}"))
+    conn.execute(text(_CREATE_DASHBOARD_AGG))
+    for query in _AGGREGATE_QUERIES:
+        conn.execute(text(f"INSERT INTO DASHBOARD_AGG (metric, bucket, value) {query}"))
+    return conn.execute(text("SELECT COUNT(*) FROM DASHBOARD_AGG")).scalar()
+
+
+def refresh_dashboard_catalog(conn) -> None:
+    """
+    Recalcula los agregados de USER y BOOK de DASHBOARD_AGG sin volver a
+    contar RATING (ETL incremental). Sin la tabla, la construye entera.
+    """
+    if not has_dashboard_agg(conn):
+        build_dashboard_agg(conn)
+        return
+    conn.execute(text("DELETE FROM DASHBOARD_AGG WHERE metric <> 'ratings'"))
+    for query in _CATALOG_QUERIES:
+        conn.execute(text(f"INSERT INTO DASHBOARD_AGG (metric, bucket, value) {query}"))
+
+
+def apply_dashboard_delta(conn, new_ratings: int) -> None:
+    """
+    Suma `new_ratings` al contador de ratings tras insertar ratings nuevos
+    (las actualizaciones de un rating existente no cambian ningún agregado).
+
+    Debe llamarse dentro de la misma transacción que escribe en RATING.
+    """
+    if new_ratings and has_dashboard_agg(conn):
+        conn.execute(
+            text("UPDATE DASHBOARD_AGG SET value = value + :n WHERE metric = 'ratings' AND bucket = 0"),
+            {"n": new_ratings},
+        )
+
+
+def load_dashboard_agg(conn) -> DashboardAggregates:
+    """
+    Agregados de los dashboards. Se leen de DASHBOARD_AGG; en una BD sin la
+    tabla (ETL antiguo) se calculan con las mismas consultas.
+    """
+    if has_dashboard_agg(conn):
+        rows = conn.execute(text("SELECT metric, bucket, value FROM DASHBOARD_AGG")).all()
+    else:
+        rows = [row for query in _AGGREGATE_QUERIES for row in conn.execute(text(query)).all()]
+
+    metrics: Dict[str, Dict[int, int]] = {}
+    for metric, bucket, value in rows:
+        metrics.setdefault(metric, {})[int(bucket)] = int(value)
+
+    def counter(metric: str) -> int:
+        return metrics.get(metric, {}).get(0, 0)
+
+    return DashboardAggregates(
+        n_users=counter("users"),
+        n_books=counter("books"),
+        n_ratings=counter("ratings"),
+        users_by_birth_year=dict(sorted(metrics.get("birth_year", {}).items())),
+        books_by_year=dict(sorted(metrics.get("publication_year", {}).items())),
+    )
+
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from app.recommender.matrix import UserItemMatrix, load_user_item_matrix
+from app.recommender.popularity import get_read_engine
+from app.recommender.tables import get_data_version
+
+# Nº de vecinos que se guardan por libro y tamaño de bloque al calcular similitudes
+DEFAULT_NEIGHBOURS = 50
+SIMILARITY_BLOCK_SIZE = 512
+# Segundos mínimos entre reentrenamientos en segundo plano cuando cambian los ratings
+RETRAIN_INTERVAL_SECONDS = float(os.environ.get("ITEM_CF_RETRAIN_SECONDS", "300"))
+
+
+class ItemCFModel:
+    """
+    Filtrado colaborativo item-based sobre la matriz dispersa usuario × libro.
+
+    - fit(): calcula la similitud coseno entre libros por bloques (producto
+      disperso X^T·X con columnas normalizadas) y se queda con los top-k
+      vecinos de cada libro en una CSR (n_books × n_books).
+    - score(): para los ratings de un usuario, el score de cada candidato es
+      sum_i rating_i · sim(i, candidato), calculado como un producto disperso.
+    """
+
+    def __init__(self, n_neighbours: int = DEFAULT_NEIGHBOURS):
+        self.n_neighbours = n_neighbours
+        self.book_ids: Optional[np.ndarray] = None
+        self.num_ratings: Optional[np.ndarray] = None
+        self.neighbours: Optional[sp.csr_matrix] = None
+
+    def fit(self, uim: UserItemMatrix) -> "ItemCFModel":
+        X = uim.matrix.astype(np.float32)
+        n_items = X.shape[1]
+
+        # Normalizamos cada columna (libro) para que X^T·X sea la similitud coseno
+        norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=0)).ravel())
+        norms[norms == 0] = 1.0
+        Xn = (X @ sp.diags(1.0 / norms).astype(np.float32)).tocsr()
+        XnT = Xn.T.tocsr()
+
+        k = min(self.n_neighbours, max(n_items - 1, 0))
+        rows, cols, vals = [], [], []
+
+        for start in range(0, n_items, SIMILARITY_BLOCK_SIZE):
+            stop = min(start + SIMILARITY_BLOCK_SIZE, n_items)
+            block = (XnT[start:stop] @ Xn).toarray()  # (bloque × n_items)
+
+            # Sin auto-similitud
+            block[np.arange(stop - start), np.arange(start, stop)] = 0.0
+
+            if k == 0:
+                continue
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            top_vals = np.take_along_axis(block, top, axis=1)
+            keep = top_vals > 0
+
+            rows.append(np.repeat(np.arange(start, stop), k)[keep.ravel()])
+            cols.append(top[keep])
+            vals.append(top_vals[keep])
+
+        if rows:
+            rows, cols, vals = np.concatenate(rows), np.concatenate(cols), np.concatenate(vals)
+        else:
+            rows = cols = np.array([], dtype=np.int64)
+            vals = np.array([], dtype=np.float32)
+
+        self.neighbours = sp.csr_matrix(
+            (vals.astype(np.float32), (rows, cols)), shape=(n_items, n_items)
+        )
+        self.book_ids = uim.book_ids
+        self.num_ratings = np.diff(uim.matrix.tocsc().indptr)
+        return self
+
+
+_model: Optional[ItemCFModel] = None
+_model_lock = threading.Lock()
+# Sello del modelo: versión de los datos (META) con la que se entrenó y cuándo
+_trained_version: Optional[int] = None
+_trained_at = 0.0
+# Última versión de los datos vista por el proceso (la API la notifica)
+_latest_version: Optional[int] = None
+_retrain_thread: Optional[threading.Thread] = None
+
+
+def _fit(engine) -> Tuple[ItemCFModel, int]:
+    """Entrena un modelo nuevo; devuelve también la versión de los datos leída antes de entrenar."""
+    with engine.connect() as conn:
+        version = get_data_version(conn)
+    return ItemCFModel().fit(load_user_item_matrix(engine)), version
+
+
+def _retrain(engine) -> None:
+    global _model, _trained_version, _trained_at, _retrain_thread
+    try:
+        model, version = _fit(engine)
+        with _model_lock:
+            _model, _trained_version = model, version
+    finally:
+        with _model_lock:
+            _trained_at = time.monotonic()
+            _retrain_thread = None
+
+
+def get_item_cf_model(engine=None) -> ItemCFModel:
+    """
+    Modelo item-based del proceso. Se entrena la primera vez que se pide
+    (lectura de RATING + similitudes) y después se reutiliza.
+
+    Si desde el entrenamiento han cambiado los datos (note_data_version) y ha
+    pasado RETRAIN_INTERVAL_SECONDS, se reentrena en un hilo aparte y mientras
+    tanto se sigue sirviendo el modelo anterior: los vecinos cambian poco con
+    unos ratings más, y los libros ya leídos se excluyen con los ratings
+    actuales del usuario.
+    """
+    global _model, _trained_version, _trained_at, _retrain_thread
+    engine = engine or get_read_engine()
+    with _model_lock:
+        if _model is None:
+            _model, _trained_version = _fit(engine)
+            _trained_at = time.monotonic()
+        elif (
+            _retrain_thread is None
+            and _latest_version is not None
+            and _latest_version != _trained_version
+            and time.monotonic() - _trained_at >= RETRAIN_INTERVAL_SECONDS
+        ):
+            _retrain_thread = threading.Thread(target=_retrain, args=(engine,), daemon=True)
+            _retrain_thread.start()
+        return _model
+
+
+def set_item_cf_model(model: ItemCFModel) -> None:
+    """Instala un modelo ya entrenado (p. ej. el del proceso padre en los workers de precompute_recs)."""
+    global _model, _trained_version, _trained_at
+    with _model_lock:
+        _model, _trained_version, _trained_at = model, None, time.monotonic()
+
+
+def note_data_version(version: int) -> None:
+    """
+    Registra la versión actual de los datos. No bloquea (no toma el lock del
+    modelo): se puede llamar desde el callback de DataVersion.
+    """
+    global _latest_version
+    _latest_version = version
+
+
+def reset_item_cf_model() -> None:
+    """Descarta el modelo; se reentrena en la siguiente petición."""
+    global _model, _trained_version
+    with _model_lock:
+        _model, _trained_version = None, None
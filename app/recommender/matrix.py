@@ -0,0 +1,79 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+@dataclass(frozen=True)
+class UserItemMatrix:
+    """
+    Matriz dispersa usuario × libro construida a partir de RATING.
+
+    - matrix: CSR (n_users × n_books) con el rating (float32). Si un usuario
+      valoró varias copias del mismo libro se guarda la media.
+    - user_ids / book_ids: ids ordenados; la fila i es user_ids[i] y la
+      columna j es book_ids[j].
+    """
+
+    matrix: sp.csr_matrix
+    user_ids: np.ndarray
+    book_ids: np.ndarray
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def user_index(self, user_id: int) -> Optional[int]:
+        """Fila de un usuario, o None si no tiene ratings en la matriz."""
+        pos = int(lookup_ids(self.user_ids, [user_id])[0])
+        return pos if pos >= 0 else None
+
+
+def lookup_ids(sorted_ids: np.ndarray, ids) -> np.ndarray:
+    """Posición de cada id en `sorted_ids` (búsqueda binaria); -1 si no está."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(sorted_ids) == 0:
+        return np.full(ids.shape, -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+    return np.where(sorted_ids[pos] == ids, pos, -1)
+
+
+def user_item_matrix_from_frame(df: pd.DataFrame) -> UserItemMatrix:
+    """
+    Construye la matriz a partir de un DataFrame [user_id, book_id, rating].
+    """
+    user_ids, rows = np.unique(df["user_id"].to_numpy(dtype=np.int64), return_inverse=True)
+    book_ids, cols = np.unique(df["book_id"].to_numpy(dtype=np.int64), return_inverse=True)
+    ratings = df["rating"].to_numpy(dtype=np.float32)
+
+    shape = (len(user_ids), len(book_ids))
+    # coo -> csr suma duplicados; dividimos por el nº de duplicados para quedarnos con la media
+    sums = sp.csr_matrix((ratings, (rows, cols)), shape=shape, dtype=np.float32)
+    counts = sp.csr_matrix(
+        (np.ones_like(ratings), (rows, cols)), shape=shape, dtype=np.float32
+    )
+    sums.sum_duplicates()
+    counts.sum_duplicates()
+    sums.data /= counts.data
+
+    return UserItemMatrix(matrix=sums, user_ids=user_ids, book_ids=book_ids)
+
+
+def load_user_item_matrix(engine) -> UserItemMatrix:
+    """
+    Lee RATING (mapeando copy_id -> book_id a través de COPY) y construye
+    la matriz dispersa usuario × libro.
+    """
+    query = """
+    SELECT r.user_id, c.book_id, r.rating
+    FROM RATING r
+    JOIN COPY c ON r.copy_id = c.copy_id
+    """
+    df = pd.read_sql(
+        query,
+        engine,
+        dtype={"user_id": "int64", "book_id": "int64", "rating": "float32"},
+    )
+    return user_item_matrix_from_frame(df)
@@ -1,17 +1,13 @@
-from pathlib import Path
 import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-
-# Ruta a la base de datos SQLite generada por el ETL
-BASE_DIR = Path(__file__).resolve().parents[2]
-DB_PATH = BASE_DIR / "app" / "db" / "library.db"
-
-
-def get_engine():
-    """Crea una conexión SQLAlchemy a la base de datos SQLite."""
-    return create_engine(f"sqlite:///{DB_PATH}")
+from sqlalchemy import text
 
+# get_engine y DB_PATH se mantienen importables desde aquí: son el engine
+# compartido y la ruta a la BD de app/api/dependencies.py
+from app.api.dependencies import DB_PATH, get_engine, get_read_engine  # noqa: F401
+from app.recommender.age_stats import has_book_age_stats
+from app.recommender.book_stats import has_book_stats
+from app.recommender.cache import STATS_COLUMNS, AgeCube, BookStatsArrays, PopularityCache
 
 def _base_book_stats(engine=None) -> pd.DataFrame:
     """
@@ -21,10 +17,32 @@ def _base_book_stats(engine=None) -> pd.DataFrame:
 
     Devuelve un DataFrame con columnas:
     [book_id, title, authors, language_code, num_ratings, mean_rating]
+
+    Si existe la tabla materializada BOOK_STATS se lee de ella; si no,
+    se agrega RATING completo como en la versión original.
     """
     if engine is None:
-        engine = get_engine()
-
+        engine = get_read_engine()
+
+    with engine.connect() as conn:
+        materialized = has_book_stats(conn)
+
+    if materialized:
+        # Lectura de la tabla materializada BOOK_STATS (~10k filas)
+        query = """
+        SELECT
+            b.book_id,
+            b.title,
+            b.authors,
+            b.language_code,
+            s.num_ratings,
+            s.mean_rating
+        FROM BOOK_STATS s
+        JOIN BOOK b ON b.book_id = s.book_id
+        """
+        return pd.read_sql(text(query), engine)
+
+    # BD sin BOOK_STATS (generada con un ETL antiguo): agregamos RATING
     query = """
     SELECT
         b.book_id,
@@ -52,6 +70,43 @@ def _apply_score(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+# Caché en proceso de las estadísticas puntuadas (ver app/recommender/cache.py)
+_popularity_cache = PopularityCache(loader=lambda: _apply_score(_base_book_stats()))
+
+
+def get_book_stats_arrays() -> BookStatsArrays:
+    """Estadísticas puntuadas por libro (ordenadas por score), servidas desde caché."""
+    return _popularity_cache.get()
+
+
+def _load_age_cube_frame() -> pd.DataFrame:
+    return pd.read_sql(
+        text("SELECT birth_year, book_id, num_ratings, sum_rating FROM BOOK_AGE_STATS"),
+        get_read_engine(),
+    )
+
+
+# Caché en proceso del cubo BOOK_AGE_STATS con sus sumas acumuladas
+_age_cube_cache = PopularityCache(loader=_load_age_cube_frame, build=AgeCube.from_frame)
+
+
+def invalidate_popularity_cache() -> None:
+    """Invalida las cachés de popularidad (global y por edad). Llamar tras escribir ratings."""
+    _popularity_cache.invalidate()
+    _age_cube_cache.invalidate()
+
+
+def popularity_cache_stats() -> dict:
+    """Contadores de aciertos/fallos de la caché de popularidad."""
+    return _popularity_cache.stats()
+
+
+def _top_n(arrays: BookStatsArrays, mask: np.ndarray, n: int) -> pd.DataFrame:
+    """Primeros N libros que cumplen `mask` (los arrays ya vienen ordenados por score)."""
+    idx = np.flatnonzero(mask)[:n]
+    return arrays.to_frame(idx)
+
+
 def get_top_books_global(n: int = 10, min_ratings: int = 50) -> pd.DataFrame:
     """
     Devuelve el top N de libros más populares a nivel global.
@@ -59,12 +114,8 @@ def get_top_books_global(n: int = 10, min_ratings: int = 50) -> pd.DataFrame:
     - Filtra libros con al menos `min_ratings` valoraciones.
     - Ordena por 'score' (media ponderada por nº de ratings).
     """
-    engine = get_engine()
-    df = _base_book_stats(engine)
-    df = df[df["num_ratings"] >= min_ratings]
-    df = _apply_score(df)
-    df = df.sort_values("score", ascending=False)
-    return df.head(n).reset_index(drop=True)
+    arrays = get_book_stats_arrays()
+    return _top_n(arrays, arrays.num_ratings >= min_ratings, n)
 
 
 def get_top_books_by_genre(genre: str, n: int = 10, min_ratings: int = 20) -> pd.DataFrame:
@@ -74,17 +125,18 @@ def get_top_books_by_genre(genre: str, n: int = 10, min_ratings: int = 20) -> pd
     En el dataset no tenemos géneros explícitos, así que por ahora
     interpretamos 'genre' como el código de idioma (language_code),
     por ejemplo: 'eng', 'spa', etc.
-    """
-    engine = get_engine()
-    df = _base_book_stats(engine)
 
-    # Aquí genre == language_code (ej.: 'eng')
-    df = df[df["language_code"] == genre]
+    Se sirve del índice por idioma de la caché de popularidad
+    (BookStatsArrays.by_language): el coste depende del tamaño del idioma,
+    no del catálogo completo.
+    """
+    arrays = get_book_stats_arrays()
 
-    df = df[df["num_ratings"] >= min_ratings]
-    df = _apply_score(df)
-    df = df.sort_values("score", ascending=False)
-    return df.head(n).reset_index(drop=True)
+    # Aquí genre == language_code (ej.: 'eng'): solo se recorre la partición
+    # de ese idioma, ya ordenada por score, y min_ratings se aplica con una máscara
+    rows = arrays.by_language.rows_for(genre)
+    idx = rows[arrays.num_ratings[rows] >= min_ratings][:n]
+    return arrays.to_frame(idx)
 
 
 def get_top_books_for_age_range(
@@ -98,9 +150,51 @@ def get_top_books_for_age_range(
     Devuelve libros populares entre usuarios cuya edad está en [age_min, age_max].
 
     Se usa fecha_nacimiento de la tabla USER (solo la tienen ~500 usuarios),
-    así que el resultado se basa en ese subconjunto.
+    así que el resultado se basa en ese subconjunto. La edad se aproxima como
+    reference_year - año de nacimiento.
+
+    Con el cubo BOOK_AGE_STATS (año de nacimiento × libro) el rango de edad
+    se traduce a un rango de años y los totales por libro salen de una resta
+    de sumas acumuladas, sin recorrer RATING.
     """
-    engine = get_engine()
+    with get_read_engine().connect() as conn:
+        materialized = has_book_age_stats(conn)
+    if not materialized:
+        return _top_books_for_age_range_from_ratings(age_min, age_max, n, min_ratings, reference_year)
+
+    cube = _age_cube_cache.get()
+    num_ratings, sum_rating = cube.range_totals(reference_year - age_max, reference_year - age_min)
+
+    candidates = np.flatnonzero((num_ratings >= min_ratings) & (num_ratings > 0))
+    if len(candidates) == 0:
+        return pd.DataFrame(columns=STATS_COLUMNS)
+
+    mean_rating = sum_rating[candidates] / num_ratings[candidates]
+    score = mean_rating * np.log1p(num_ratings[candidates])
+    top = np.argsort(-score, kind="stable")[:n]
+    idx = candidates[top]
+
+    # Título, autores e idioma de los libros elegidos (de la caché de popularidad)
+    arrays = get_book_stats_arrays()
+    pos = arrays.positions(cube.book_id[idx])
+    df = arrays.to_frame(np.maximum(pos, 0))[["book_id", "title", "authors", "language_code"]]
+    df.loc[pos < 0, ["title", "authors", "language_code"]] = None
+    df["book_id"] = cube.book_id[idx]
+    df["num_ratings"] = num_ratings[idx]
+    df["mean_rating"] = mean_rating[top]
+    df["score"] = score[top]
+    return df.reset_index(drop=True)
+
+
+def _top_books_for_age_range_from_ratings(
+    age_min: int,
+    age_max: int,
+    n: int,
+    min_ratings: int,
+    reference_year: int,
+) -> pd.DataFrame:
+    """get_top_books_for_age_range en una BD sin BOOK_AGE_STATS: se agrega RATING."""
+    engine = get_read_engine()
     query = """
     SELECT
         b.book_id,
@@ -0,0 +1,52 @@
+import time
+
+from sqlalchemy import text
+
+
+def has_table(conn, name: str) -> bool:
+    """Indica si la BD tiene la tabla `name` (las BDs de ETL antiguos no tienen las derivadas)."""
+    row = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": name},
+    ).first()
+    return row is not None
+
+
+# Versión de los datos (tabla META): la incrementan el ETL y cada escritura
+# que cambia lo que devuelven la API y el recomendador (ratings, precálculos).
+# La API la usa como ETag de sus respuestas cacheadas.
+_CREATE_META = """
+CREATE TABLE IF NOT EXISTS META (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+)
+"""
+
+
+def get_data_version(conn) -> int:
+    """Versión actual de los datos (0 si la BD aún no tiene tabla META)."""
+    if not has_table(conn, "META"):
+        return 0
+    value = conn.execute(text("SELECT value FROM META WHERE key = 'data_version'")).scalar()
+    return int(value or 0)
+
+
+def bump_data_version(conn) -> int:
+    """
+    Incrementa la versión de los datos y devuelve la nueva.
+
+    Se toma el máximo entre la versión anterior + 1 y el instante actual en
+    milisegundos, de forma que la versión sigue creciendo aunque la BD se
+    regenere desde cero (y un ETag antiguo nunca vuelve a ser válido).
+    """
+    conn.execute(text(_CREATE_META))
+    conn.execute(
+        text(
+            """
+            INSERT INTO META (key, value) VALUES ('data_version', :now_ms)
+            ON CONFLICT (key) DO UPDATE SET value = MAX(value + 1, :now_ms)
+            """
+        ),
+        {"now_ms": time.time_ns() // 1_000_000},
+    )
+    return get_data_version(conn)
@@ -0,0 +1,152 @@
+from datetime import datetime
+from typing import Optional
+
+import pandas as pd
+from sqlalchemy import text
+
+from app.recommender.tables import has_table
+
+# Recomendaciones precalculadas por usuario (las escribe app/etl/precompute_recs.py).
+# USER_RECS_META guarda, por (method, min_ratings), cuántas posiciones se
+# calcularon, para saber si una petición con `n` se puede servir desde la tabla.
+USER_RECS_TABLE = "USER_RECS"
+
+_CREATE_USER_RECS = """
+CREATE TABLE IF NOT EXISTS USER_RECS (
+    user_id     INTEGER NOT NULL,
+    method      TEXT    NOT NULL,
+    min_ratings INTEGER NOT NULL,
+    rank        INTEGER NOT NULL,
+    book_id     INTEGER NOT NULL,
+    score       REAL    NOT NULL,
+    PRIMARY KEY (user_id, method, min_ratings, rank)
+) WITHOUT ROWID
+"""
+
+_CREATE_USER_RECS_META = """
+CREATE TABLE IF NOT EXISTS USER_RECS_META (
+    method      TEXT    NOT NULL,
+    min_ratings INTEGER NOT NULL,
+    top_n       INTEGER NOT NULL,
+    computed_at TEXT    NOT NULL,
+    PRIMARY KEY (method, min_ratings)
+)
+"""
+
+
+def write_user_recs(conn, recs: pd.DataFrame, method: str, min_ratings: int, top_n: int) -> int:
+    """
+    Sustituye las recomendaciones precalculadas de (method, min_ratings) por
+    `recs` [user_id, rank, book_id, score], insertándolas en bloque.
+    """
+    conn.execute(text(_CREATE_USER_RECS))
+    conn.execute(text(_CREATE_USER_RECS_META))
+
+    params = {"method": method, "min_ratings": min_ratings}
+    conn.execute(
+        text("DELETE FROM USER_RECS WHERE method = :method AND min_ratings = :min_ratings"),
+        params,
+    )
+
+    rows = recs[["user_id", "rank", "book_id", "score"]].astype(object).assign(**params)
+    if not rows.empty:
+        conn.execute(
+            text(
+                """
+                INSERT INTO USER_RECS (user_id, method, min_ratings, rank, book_id, score)
+                VALUES (:user_id, :method, :min_ratings, :rank, :book_id, :score)
+                """
+            ),
+            rows.to_dict(orient="records"),
+        )
+
+    conn.execute(
+        text(
+            """
+            INSERT OR REPLACE INTO USER_RECS_META (method, min_ratings, top_n, computed_at)
+            VALUES (:method, :min_ratings, :top_n, :computed_at)
+            """
+        ),
+        {**params, "top_n": top_n, "computed_at": datetime.now().isoformat(timespec="seconds")},
+    )
+    return len(rows)
+
+
+# num_ratings y mean_rating de los libros recomendados: de BOOK_STATS o, en una
+# BD sin la tabla (ETL antiguo), agregando los ratings de esos libros
+_STATS_FROM_BOOK_STATS = "LEFT JOIN BOOK_STATS s ON s.book_id = ur.book_id"
+
+_STATS_FROM_RATINGS = """
+            LEFT JOIN (
+                SELECT c.book_id, COUNT(*) AS num_ratings, AVG(r.rating) AS mean_rating
+                FROM COPY c
+                JOIN RATING r ON r.copy_id = c.copy_id
+                WHERE c.book_id IN (
+                    SELECT book_id FROM USER_RECS
+                    WHERE user_id = :uid AND method = :method AND min_ratings = :min_ratings
+                )
+                GROUP BY c.book_id
+            ) s ON s.book_id = ur.book_id"""
+
+
+def get_precomputed_recommendations(
+    conn,
+    user_id: int,
+    n: int,
+    min_ratings: int,
+    method: str,
+) -> Optional[pd.DataFrame]:
+    """
+    Recomendaciones precalculadas de un usuario (lectura por clave primaria).
+
+    Devuelve None si no hay precálculo válido: tabla inexistente, usuario
+    nuevo o con ratings posteriores al precálculo, o `n` mayor que el top_n
+    calculado. En ese caso hay que calcularlas en vivo.
+    """
+    if not has_table(conn, USER_RECS_TABLE):
+        return None
+
+    # (has_table y no book_stats.has_book_stats: book_stats importa este módulo)
+    stats_join = _STATS_FROM_BOOK_STATS if has_table(conn, "BOOK_STATS") else _STATS_FROM_RATINGS
+    df = pd.read_sql(
+        text(
+            f"""
+            SELECT
+                b.book_id,
+                b.title,
+                b.authors,
+                b.language_code,
+                COALESCE(s.num_ratings, 0) AS num_ratings,
+                COALESCE(s.mean_rating, 0) AS mean_rating,
+                ur.score
+            FROM USER_RECS_META m
+            JOIN USER_RECS ur
+              ON ur.method = m.method AND ur.min_ratings = m.min_ratings
+            JOIN BOOK b ON b.book_id = ur.book_id
+            {stats_join}
+            WHERE m.method = :method
+              AND m.min_ratings = :min_ratings
+              AND m.top_n >= :n
+              AND ur.user_id = :uid
+            ORDER BY ur.rank
+            LIMIT :n
+            """
+        ),
+        conn,
+        params={"uid": user_id, "n": n, "min_ratings": min_ratings, "method": method},
+    )
+    if df.empty:
+        return None
+    return df
+
+
+def invalidate_user_recs(conn, user_id: int) -> None:
+    """Descarta las recomendaciones precalculadas de un usuario (p. ej. tras un rating nuevo)."""
+    if has_table(conn, USER_RECS_TABLE):
+        conn.execute(text("DELETE FROM USER_RECS WHERE user_id = :uid"), {"uid": user_id})
+
+
+def clear_user_recs(conn) -> None:
+    """Borra todo el precálculo (tras recargar los datos en el ETL queda obsoleto)."""
+    conn.execute(text("DROP TABLE IF EXISTS USER_RECS"))
+    conn.execute(text("DROP TABLE IF EXISTS USER_RECS_META"))
@@ -0,0 +1,105 @@
+from typing import Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import text
+
+from app.recommender.book_stats import has_book_stats
+
+# Consulta del catálogo de la UI (página "Catálogo"): libros filtrados por
+# idioma y año, con su nº de ratings y su media.
+#
+# Con BOOK_STATS los filtros y el LIMIT se aplican sobre BOOK (índices
+# idx_book_lang_year / idx_book_year_title) y las métricas se añaden con una
+# búsqueda por clave en BOOK_STATS por libro, sin tocar RATING. Sin BOOK_STATS
+# (BD de un ETL antiguo) se agrega RATING entero como en la versión original.
+
+_CATALOG_WITH_STATS = """
+SELECT
+    b.book_id,
+    b.title,
+    b.authors,
+    b.language_code,
+    b.original_publication_year,
+    COALESCE(s.num_ratings, 0) AS num_ratings,
+    s.mean_rating
+FROM BOOK b
+LEFT JOIN BOOK_STATS s ON s.book_id = b.book_id
+WHERE 1=1
+"""
+
+_CATALOG_FROM_RATINGS = """
+SELECT
+    b.book_id,
+    b.title,
+    b.authors,
+    b.language_code,
+    b.original_publication_year,
+    COUNT(r.rating) AS num_ratings,
+    AVG(r.rating)   AS mean_rating
+FROM BOOK b
+LEFT JOIN COPY c   ON c.book_id = b.book_id
+LEFT JOIN RATING r ON r.copy_id = c.copy_id
+WHERE 1=1
+"""
+
+_CATALOG_GROUP_BY = """
+GROUP BY
+    b.book_id, b.title, b.authors, b.language_code, b.original_publication_year
+"""
+
+_CATALOG_ORDER = """
+ORDER BY
+    COALESCE(b.original_publication_year, 0) DESC,
+    num_ratings DESC,
+    b.book_id
+LIMIT :limit
+"""
+
+
+def catalog_query(
+    language: Optional[str] = None,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    limit: int = 200,
+    materialized: bool = True,
+) -> Tuple[str, dict]:
+    """SQL y parámetros del catálogo; materialized=False es la agregación sobre RATING."""
+    sql = _CATALOG_WITH_STATS if materialized else _CATALOG_FROM_RATINGS
+    params = {"limit": limit}
+
+    if language:
+        sql += " AND b.language_code = :lang"
+        params["lang"] = language
+
+    if year_from is not None:
+        sql += " AND b.original_publication_year >= :y_from"
+        params["y_from"] = year_from
+
+    if year_to is not None:
+        sql += " AND b.original_publication_year <= :y_to"
+        params["y_to"] = year_to
+
+    if not materialized:
+        sql += _CATALOG_GROUP_BY
+    sql += _CATALOG_ORDER
+    return sql, params
+
+
+def load_catalog(
+    conn,
+    language: Optional[str] = None,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    limit: int = 200,
+    materialized: Optional[bool] = None,
+) -> pd.DataFrame:
+    """
+    Catálogo de libros con nº de ratings y media, ordenado por año de
+    publicación (más recientes primero) y nº de ratings.
+
+    Por defecto usa BOOK_STATS si existe (materialized=None).
+    """
+    if materialized is None:
+        materialized = has_book_stats(conn)
+    sql, params = catalog_query(language, year_from, year_to, limit, materialized=materialized)
+    return pd.read_sql(text(sql), conn, params=params)
@@ -12,12 +12,26 @@ ROOT_DIR = Path(__file__).resolve().parents[2]
 if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
-from app.api.dependencies import get_engine
-from app.recommender.popularity import get_top_books_global
+from app.api.dependencies import get_engine, get_read_engine
+from app.ui import catalog
+from app.recommender.popularity import get_top_books_global, invalidate_popularity_cache
 from app.recommender.collaborative import get_recommendations_for_user
+from app.recommender.book_stats import save_rating
+from app.recommender.dashboard import DashboardAggregates, load_dashboard_agg
+from app.recommender.tables import get_data_version
 
-# Engine global a la base de datos
-engine = get_engine()
+# Nº máximo de resultados guardados por cada función cacheada
+CACHE_MAX_ENTRIES = 64
+
+
+@st.cache_resource
+def _engines():
+    """Engines a la base de datos, compartidos por todas las sesiones y reruns."""
+    return get_engine(), get_read_engine()
+
+
+# Engines globales a la base de datos: escritura (ratings) y solo lectura (resto)
+engine, read_engine = _engines()
 
 
 # =========================
@@ -28,49 +42,12 @@ def load_catalog(language=None, year_from=None, year_to=None, limit=200) -> pd.D
     """
     Devuelve un catálogo de libros con algunas métricas de popularidad.
     Permite filtrar por idioma y año de publicación.
-    """
-    sql = """
-    SELECT
-        b.book_id,
-        b.title,
-        b.authors,
-        b.language_code,
-        b.original_publication_year,
-        COUNT(r.rating) AS num_ratings,
-        AVG(r.rating)   AS mean_rating
-    FROM BOOK b
-    LEFT JOIN COPY c   ON c.book_id = b.book_id
-    LEFT JOIN RATING r ON r.copy_id = c.copy_id
-    WHERE 1=1
-    """
-    params = {}
-
-    if language:
-        sql += " AND b.language_code = :lang"
-        params["lang"] = language
-
-    if year_from is not None:
-        sql += " AND b.original_publication_year >= :y_from"
-        params["y_from"] = year_from
-
-    if year_to is not None:
-        sql += " AND b.original_publication_year <= :y_to"
-        params["y_to"] = year_to
-
-    sql += """
-    GROUP BY
-        b.book_id, b.title, b.authors, b.language_code, b.original_publication_year
-    ORDER BY
-        COALESCE(b.original_publication_year, 0) DESC,
-        num_ratings DESC
-    LIMIT :limit
-    """
-    params["limit"] = limit
 
-    with engine.connect() as conn:
-        df = pd.read_sql(text(sql), conn, params=params)
-
-    return df
+    Los filtros y el límite se aplican sobre BOOK y las métricas se toman de
+    BOOK_STATS (ver app/ui/catalog.py).
+    """
+    with read_engine.connect() as conn:
+        return catalog.load_catalog(conn, language=language, year_from=year_from, year_to=year_to, limit=limit)
 
 
 def get_user_ratings(user_id: int) -> pd.DataFrame:
@@ -92,7 +69,7 @@ def get_user_ratings(user_id: int) -> pd.DataFrame:
     WHERE r.user_id = :uid
     ORDER BY r.rating DESC
     """
-    with engine.connect() as conn:
+    with read_engine.connect() as conn:
         df = pd.read_sql(text(sql), conn, params={"uid": user_id})
     return df
 
@@ -102,8 +79,6 @@ def upsert_rating(user_id: int, copy_id: int, rating: int):
     Inserta o actualiza un rating (user_id, copy_id).
     Devuelve (ok: bool, mensaje: str).
     """
-    params = {"uid": user_id, "cid": copy_id, "rating": rating}
-
     with engine.begin() as conn:
         # Comprobar COPY
         copy_exists = conn.execute(
@@ -121,32 +96,81 @@ def upsert_rating(user_id: int, copy_id: int, rating: int):
         if not user_exists:
             return False, "El user_id no existe en la base de datos."
 
-        # Intentar actualizar primero
-        result = conn.execute(
-            text(
-                """
-                UPDATE RATING
-                SET rating = :rating
-                WHERE user_id = :uid AND copy_id = :cid
-                """
-            ),
-            params,
-        )
-        if result.rowcount == 0:
-            # Si no había, insertamos
-            conn.execute(
-                text(
-                    """
-                    INSERT INTO RATING (user_id, copy_id, rating)
-                    VALUES (:uid, :cid, :rating)
-                    """
-                ),
-                params,
-            )
+        # Insertar o actualizar el rating, manteniendo BOOK_STATS por deltas
+        save_rating(conn, user_id, copy_id, rating)
+
+    # Las estadísticas cacheadas en memoria ya no son válidas
+    invalidate_popularity_cache()
 
     return True, "Rating guardado correctamente."
 
 
+def load_filter_options():
+    """Idiomas y años de publicación distintos del catálogo (opciones de los filtros)."""
+    with read_engine.connect() as conn:
+        langs = pd.read_sql(
+            text("SELECT DISTINCT language_code FROM BOOK WHERE language_code IS NOT NULL ORDER BY language_code"),
+            conn,
+        )["language_code"].tolist()
+
+        years = pd.read_sql(
+            text("SELECT DISTINCT original_publication_year FROM BOOK WHERE original_publication_year IS NOT NULL ORDER BY original_publication_year"),
+            conn,
+        )["original_publication_year"].tolist()
+    return langs, years
+
+
+def load_dashboard() -> DashboardAggregates:
+    """Agregados de los dashboards (tabla precalculada DASHBOARD_AGG)."""
+    with read_engine.connect() as conn:
+        return load_dashboard_agg(conn)
+
+
+# =========================
+# Caché de datos de la UI
+# =========================
+# Streamlit vuelve a ejecutar el script en cada interacción. Las consultas se
+# cachean con st.cache_data usando como parte de la clave la versión de los
+# datos (META.data_version), que incrementan el ETL y cada escritura de
+# ratings: mientras no cambia, los reruns no vuelven a consultar la BD; en
+# cuanto cambia, las entradas anteriores dejan de usarse.
+
+def current_data_version() -> int:
+    """Versión actual de los datos (una lectura por clave en META)."""
+    with read_engine.connect() as conn:
+        return get_data_version(conn)
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_filter_options(data_version: int):
+    return load_filter_options()
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_catalog(data_version: int, language, year_from, year_to, limit) -> pd.DataFrame:
+    return load_catalog(language=language, year_from=year_from, year_to=year_to, limit=limit)
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_user_ratings(data_version: int, user_id: int) -> pd.DataFrame:
+    return get_user_ratings(user_id)
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_recommendations(data_version: int, user_id: int, n: int, min_ratings: int) -> pd.DataFrame:
+    return get_recommendations_for_user(user_id=user_id, n=n, min_ratings=min_ratings)
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_dashboard(data_version: int) -> DashboardAggregates:
+    return load_dashboard()
+
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def cached_top_books(data_version: int, n: int, min_ratings: int) -> pd.DataFrame:
+    return get_top_books_global(n=n, min_ratings=min_ratings)
+
+
 # =========================
 # Páginas de Streamlit
 # =========================
@@ -175,16 +199,8 @@ def render_catalog():
     # Filtros en la barra lateral
     st.sidebar.subheader("Filtros catálogo")
 
-    with engine.connect() as conn:
-        langs = pd.read_sql(
-            text("SELECT DISTINCT language_code FROM BOOK WHERE language_code IS NOT NULL ORDER BY language_code"),
-            conn,
-        )["language_code"].tolist()
-
-        years = pd.read_sql(
-            text("SELECT DISTINCT original_publication_year FROM BOOK WHERE original_publication_year IS NOT NULL ORDER BY original_publication_year"),
-            conn,
-        )["original_publication_year"].tolist()
+    version = current_data_version()
+    langs, years = cached_filter_options(version)
 
     language = st.sidebar.selectbox("Idioma (language_code)", ["(todos)"] + langs)
     year_min = st.sidebar.selectbox("Año mínimo", ["(sin mínimo)"] + years)
@@ -195,7 +211,7 @@ def render_catalog():
     y_from = None if year_min == "(sin mínimo)" else int(year_min)
     y_to = None if year_max == "(sin máximo)" else int(year_max)
 
-    df = load_catalog(language=lang_filter, year_from=y_from, year_to=y_to, limit=limit)
+    df = cached_catalog(version, lang_filter, y_from, y_to, limit)
 
     st.write(f"Mostrando {len(df)} libros")
     st.dataframe(df)
@@ -220,7 +236,7 @@ def render_recommendations():
             return
 
         # Comprobar que el usuario existe
-        with engine.connect() as conn:
+        with read_engine.connect() as conn:
             exists = conn.execute(
                 text("SELECT 1 FROM USER WHERE user_id = :uid"),
                 {"uid": int(user_id)},
@@ -230,11 +246,7 @@ def render_recommendations():
             st.error("El user_id no existe en la base de datos.")
             return
 
-        df = get_recommendations_for_user(
-            user_id=int(user_id),
-            n=int(n),
-            min_ratings=int(min_ratings),
-        )
+        df = cached_recommendations(current_data_version(), int(user_id), int(n), int(min_ratings))
 
         if df.empty:
             st.warning("No se han encontrado recomendaciones para este usuario (quizá tiene muy pocas valoraciones).")
@@ -251,7 +263,7 @@ def render_ratings():
     user_id = st.number_input("User ID para consultar tus puntuaciones", min_value=1, step=1, format="%d")
 
     if user_id:
-        df = get_user_ratings(int(user_id))
+        df = cached_user_ratings(current_data_version(), int(user_id))
         if df.empty:
             st.info("Este usuario aún no tiene puntuaciones registradas.")
         else:
@@ -276,21 +288,19 @@ def render_ratings():
 
 def render_dashboards():
     st.title("Dashboards de uso y estadísticas")
+    version = current_data_version()
 
-    # Métricas básicas
-    with engine.connect() as conn:
-        n_users = conn.execute(text("SELECT COUNT(*) FROM USER")).scalar()
-        n_books = conn.execute(text("SELECT COUNT(*) FROM BOOK")).scalar()
-        n_ratings = conn.execute(text("SELECT COUNT(*) FROM RATING")).scalar()
+    # Métricas básicas (precalculadas en DASHBOARD_AGG)
+    aggregates = cached_dashboard(version)
 
     col1, col2, col3 = st.columns(3)
-    col1.metric("Usuarios", n_users)
-    col2.metric("Libros", n_books)
-    col3.metric("Ratings", n_ratings)
+    col1.metric("Usuarios", aggregates.n_users)
+    col2.metric("Libros", aggregates.n_books)
+    col3.metric("Ratings", aggregates.n_ratings)
 
     # Top libros por nº de ratings (usamos el recomendador de popularidad)
     st.subheader("Libros más populares (por número de ratings)")
-    top_pop = get_top_books_global(n=10, min_ratings=50)
+    top_pop = cached_top_books(version, n=10, min_ratings=50)
     if not top_pop.empty:
         st.dataframe(top_pop[["title", "authors", "num_ratings", "mean_rating"]])
 
@@ -301,44 +311,20 @@ def render_dashboards():
 
     # Distribución de edad de usuarios
     st.subheader("Distribución de edad de usuarios (usuarios con fecha de nacimiento)")
-    with engine.connect() as conn:
-        df_users = pd.read_sql(
-            text("SELECT fecha_nacimiento FROM USER WHERE fecha_nacimiento IS NOT NULL"),
-            conn,
-        )
-
-    if not df_users.empty:
-        df_users["fecha_nacimiento"] = pd.to_datetime(df_users["fecha_nacimiento"], errors="coerce")
-        df_users = df_users.dropna(subset=["fecha_nacimiento"])
-        current_year = pd.Timestamp.now().year
-        df_users["edad"] = current_year - df_users["fecha_nacimiento"].dt.year
+    ages = pd.Series(aggregates.users_by_age(pd.Timestamp.now().year), name="count").rename_axis("edad")
 
-        st.write(f"Nº usuarios con edad conocida: {len(df_users)}")
-        st.bar_chart(df_users["edad"].value_counts().sort_index())
+    if not ages.empty:
+        st.write(f"Nº usuarios con edad conocida: {int(ages.sum())}")
+        st.bar_chart(ages)
     else:
         st.info("No hay información de edad disponible.")
 
     # Evolución por año de publicación (proxy temporal)
     st.subheader("Número de libros por año de publicación")
-    with engine.connect() as conn:
-        df_years = pd.read_sql(
-            text(
-                """
-                SELECT
-                    original_publication_year AS year,
-                    COUNT(*) AS num_books
-                FROM BOOK
-                WHERE original_publication_year IS NOT NULL
-                GROUP BY original_publication_year
-                ORDER BY original_publication_year
-                """
-            ),
-            conn,
-        )
+    books_by_year = pd.Series(aggregates.books_by_year, name="num_books").rename_axis("year")
 
-    if not df_years.empty:
-        df_years = df_years.set_index("year")
-        st.line_chart(df_years["num_books"])
+    if not books_by_year.empty:
+        st.line_chart(books_by_year)
     else:
         st.info("No hay datos de año de publicación para los libros.")
 
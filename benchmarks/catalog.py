@@ -0,0 +1,74 @@
+"""
+Latencia de la consulta del catálogo de la UI (página "Catálogo") para cada
+combinación de filtros de la barra lateral: paginando BOOK y añadiendo las
+métricas de BOOK_STATS frente a la agregación original sobre RATING.
+
+Uso (con la BD del ETL ya generada):
+    python benchmarks/catalog.py [--repeat 5] [--limit 200]
+"""
+import argparse
+import itertools
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from sqlalchemy import text
+
+from app.api.dependencies import get_read_engine
+from app.ui.catalog import load_catalog
+
+
+def _best_ms(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=200, help="Valor del slider 'Número máximo de libros'")
+    args = parser.parse_args()
+
+    with get_read_engine().connect() as conn:
+        # Idioma más frecuente y menos frecuente; años en el primer y último tercio
+        langs = conn.execute(
+            text(
+                """
+                SELECT language_code FROM BOOK WHERE language_code IS NOT NULL
+                GROUP BY language_code ORDER BY COUNT(*) DESC
+                """
+            )
+        ).scalars().all()
+        y_min, y_max = conn.execute(
+            text("SELECT MIN(original_publication_year), MAX(original_publication_year) FROM BOOK")
+        ).first()
+        span = (y_max - y_min) // 3
+
+        combos = itertools.product(
+            [None] + sorted({langs[0], langs[-1]}),
+            [None, y_min + span],
+            [None, y_max - span],
+        )
+
+        print(f"limit={args.limit}, mejor de {args.repeat} ejecuciones")
+        print(f"{'idioma':<10}{'año mín':>9}{'año máx':>9}{'RATING (ms)':>14}{'BOOK_STATS (ms)':>17}{'mejora':>9}")
+        for language, year_from, year_to in combos:
+            filters = {"language": language, "year_from": year_from, "year_to": year_to, "limit": args.limit}
+            legacy = _best_ms(lambda: load_catalog(conn, materialized=False, **filters), args.repeat)
+            fast = _best_ms(lambda: load_catalog(conn, materialized=True, **filters), args.repeat)
+            print(
+                f"{language or '(todos)':<10}{year_from or '-':>9}{year_to or '-':>9}"
+                f"{legacy:>14.1f}{fast:>17.1f}{legacy / fast:>8.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Coste de serializar las respuestas de la API: camino clásico (un modelo
+Pydantic por fila + validación y serialización de FastAPI con el
+response_model) frente al camino rápido de app/api/responses.py.
+
+Uso (con la BD del ETL ya generada):
+    python benchmarks/serialization.py [--repeat 2000]
+"""
+import argparse
+import asyncio
+import sys
+import timeit
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+from sqlalchemy import text
+
+from app.api import responses
+from app.api.main import (
+    BOOK_FIELDS,
+    RECOMMENDATION_FIELDS,
+    BookOut,
+    RecommendationOut,
+    app,
+    read_engine,
+)
+from app.recommender.collaborative import get_recommendations_for_user
+
+
+def _response_field(path: str):
+    for route in app.routes:
+        if isinstance(route, APIRoute) and route.path == path:
+            return route.response_field
+    raise LookupError(path)
+
+
+_loop = asyncio.new_event_loop()
+
+
+def _classic(field, models) -> bytes:
+    # Lo que hacía FastAPI con la lista de modelos devuelta por el endpoint
+    content = _loop.run_until_complete(serialize_response(field=field, response_content=models))
+    return JSONResponse(content).body
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    with read_engine.connect() as conn:
+        rows = conn.execute(
+            text(f"SELECT {', '.join(BOOK_FIELDS)} FROM BOOK ORDER BY book_id LIMIT 100")
+        ).mappings().all()
+        user_id = conn.execute(text("SELECT user_id FROM RATING LIMIT 1")).scalar()
+    recs = get_recommendations_for_user(user_id, n=50, min_ratings=1)
+
+    books_field = _response_field("/books")
+    recs_field = _response_field("/users/{user_id}/recommendations")
+
+    cases = {
+        "/books limit=100": (
+            lambda: _classic(books_field, [BookOut(**row) for row in rows]),
+            lambda: responses.FastJSONResponse(responses.row_records(rows, BOOK_FIELDS)).body,
+        ),
+        "/recommendations n=50": (
+            lambda: _classic(
+                recs_field, [RecommendationOut(**rec) for rec in recs.to_dict(orient="records")]
+            ),
+            lambda: responses.FastJSONResponse(responses.frame_records(recs, RECOMMENDATION_FIELDS)).body,
+        ),
+    }
+
+    backend = "orjson" if responses.orjson is not None else "json"
+    print(f"Serialización rápida con: {backend} ({args.repeat} repeticiones)")
+    print(f"{'respuesta':<24}{'modelos (µs)':>14}{'rápido (µs)':>14}{'mejora':>9}")
+    for name, (classic, fast) in cases.items():
+        t_classic = min(timeit.repeat(classic, number=args.repeat, repeat=3)) / args.repeat * 1e6
+        t_fast = min(timeit.repeat(fast, number=args.repeat, repeat=3)) / args.repeat * 1e6
+        print(f"{name:<24}{t_classic:>14.1f}{t_fast:>14.1f}{t_classic / t_fast:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
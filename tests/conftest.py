@@ -0,0 +1,76 @@
+"""Configuración común de los tests.
+
+Los tests no usan data/ ni app/db/library.db del repositorio: antes de que se
+importe la aplicación se apuntan las rutas (LIBRARY_DB_PATH, LIBRARY_DATA_DIR,
+ETL_REPORTS_DIR, ALS_MODEL_DIR) a un directorio temporal y se genera ahí un
+dataset pequeño y determinista con el mismo formato que los CSV originales.
+El ETL de cada módulo de tests construye la BD a partir de él.
+"""
+from pathlib import Path
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+TMP_DIR = Path(tempfile.mkdtemp(prefix="library_tests_"))
+RAW_DIR = TMP_DIR / "data" / "raw"
+
+os.environ["LIBRARY_DB_PATH"] = str(TMP_DIR / "library.db")
+os.environ["LIBRARY_DATA_DIR"] = str(TMP_DIR / "data")
+os.environ["ETL_REPORTS_DIR"] = str(TMP_DIR / "reportes")
+os.environ["ALS_MODEL_DIR"] = str(TMP_DIR / "models" / "als")
+
+N_BOOKS = 300
+N_COPIES = 1500
+N_USERS_INFO = 100
+N_RATING_USERS = 150
+N_RATINGS = 8000
+
+
+def _write_raw_fixtures(raw_dir: Path, seed: int = 42) -> None:
+    """Genera books, copies, user_info y ratings con los mismos casos sucios que los originales."""
+    rng = np.random.default_rng(seed)
+    raw_dir.mkdir(parents=True)
+
+    book_ids = np.arange(1, N_BOOKS + 1)
+    years = rng.integers(1900, 2020, N_BOOKS).astype(float)
+    years[rng.random(N_BOOKS) < 0.05] = np.nan  # años ausentes
+    pd.DataFrame({
+        "book_id": book_ids,
+        "isbn": [f"isbn{i}" for i in book_ids],
+        "authors": [f"Autor {i % 40}" for i in book_ids],
+        "original_publication_year": years,
+        "original_title": [f"Original {i}" for i in book_ids],
+        "title": [f"Título del libro {i}" for i in book_ids],
+        "language_code": rng.choice(["eng", "spa", "fre", "ger"], N_BOOKS),
+        "image_url": "http://x",
+    }).to_csv(raw_dir / "books.csv", index=False)
+
+    pd.DataFrame({
+        "copy_id": np.arange(1, N_COPIES + 1),
+        "book_id": rng.integers(1, N_BOOKS + 1, N_COPIES),
+    }).to_csv(raw_dir / "copies(ejemplares).csv", index=False)
+
+    birth = pd.Timestamp("2005-01-01") - pd.to_timedelta(rng.integers(0, 60 * 365, N_USERS_INFO), unit="D")
+    pd.DataFrame({
+        "user_id": np.arange(1, N_USERS_INFO + 1),
+        "sexo": rng.choice(["M", "F"], N_USERS_INFO),
+        "comentario": "x",
+        "fecha_nacimiento": birth.strftime("%d/%m/%Y"),
+    }).to_csv(raw_dir / "user_info.csv", index=False)
+
+    # Ratings con 0 (inválidos), duplicados y copy_id huérfanos (> N_COPIES)
+    pd.DataFrame({
+        "user_id": rng.integers(1, N_RATING_USERS + 1, N_RATINGS),
+        "copy_id": rng.integers(1, N_COPIES + 5, N_RATINGS),
+        "rating": rng.integers(0, 6, N_RATINGS),
+    }).to_csv(raw_dir / "ratings.csv", index=False)
+
+
+_write_raw_fixtures(RAW_DIR)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
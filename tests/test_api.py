@@ -10,10 +10,9 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
 from app.etl.run_etl import run_etl
-from app.api.dependencies import get_engine
+from app.api.dependencies import DB_PATH, get_engine
 from app.api.main import app
 
-DB_PATH = ROOT_DIR / "app" / "db" / "library.db"
 if not DB_PATH.exists():
     run_etl()
 
@@ -96,3 +95,516 @@ def test_post_rating_endpoint():
     assert data["user_id"] == user_id
     assert data["copy_id"] == copy_id
     assert data["rating"] == 4
+
+
+def test_post_rating_updates_book_stats():
+    user_id, copy_id = _get_any_user_and_copy()
+
+    def _book_stats():
+        with engine.connect() as conn:
+            return conn.execute(
+                text(
+                    """
+                    SELECT s.num_ratings, s.sum_rating, r.rating
+                    FROM BOOK_STATS s
+                    JOIN COPY c ON c.book_id = s.book_id
+                    JOIN RATING r ON r.copy_id = c.copy_id
+                    WHERE r.user_id = :uid AND r.copy_id = :cid
+                    """
+                ),
+                {"uid": user_id, "cid": copy_id},
+            ).first()
+
+    before = _book_stats()
+    new_rating = 1 if before.rating != 1 else 5
+
+    resp = client.post("/ratings", json={"user_id": user_id, "copy_id": copy_id, "rating": new_rating})
+    assert resp.status_code in (200, 201)
+
+    after = _book_stats()
+    assert after.num_ratings == before.num_ratings
+    assert after.sum_rating == before.sum_rating + new_rating - before.rating
+
+
+def test_batch_recommendations_endpoint():
+    user_id = _get_user_id_with_ratings()
+    single = client.get(f"/users/{user_id}/recommendations?n=5&min_ratings=1").json()
+
+    resp = client.post(
+        "/recommendations/batch",
+        json={"user_ids": [user_id, -1], "n": 5, "min_ratings": 1},
+    )
+    assert resp.status_code == 200
+    data = resp.json()
+
+    assert data["unknown_user_ids"] == [-1]
+    assert [r["user_id"] for r in data["results"]] == [user_id]
+    batch_books = [rec["book_id"] for rec in data["results"][0]["recommendations"]]
+    assert batch_books == [rec["book_id"] for rec in single]
+
+
+def test_recommendations_served_from_precomputed_table():
+    from app.etl.precompute_recs import precompute_recommendations
+
+    stats = precompute_recommendations(n=10, min_ratings=3, workers=1)
+    assert stats["rows"] > 0
+
+    user_id = _get_user_id_with_ratings()
+    with engine.connect() as conn:
+        stored = conn.execute(
+            text(
+                """
+                SELECT book_id FROM USER_RECS
+                WHERE user_id = :uid AND method = 'popularity' AND min_ratings = 3
+                ORDER BY rank
+                """
+            ),
+            {"uid": user_id},
+        ).scalars().all()
+
+    resp = client.get(f"/users/{user_id}/recommendations?n=5&min_ratings=3")
+    assert resp.status_code == 200
+    assert [rec["book_id"] for rec in resp.json()] == stored[:5]
+
+    # Un rating nuevo invalida el precálculo de ese usuario
+    _, copy_id = _get_any_user_and_copy()
+    client.post("/ratings", json={"user_id": user_id, "copy_id": copy_id, "rating": 5})
+    with engine.connect() as conn:
+        left = conn.execute(
+            text("SELECT COUNT(*) FROM USER_RECS WHERE user_id = :uid"), {"uid": user_id}
+        ).scalar()
+    assert left == 0
+
+
+def test_books_search_fts_folds_accents_and_follows_updates():
+    """La búsqueda usa BOOK_FTS (sin acentos) y los triggers la mantienen al día con BOOK."""
+    book_id = _get_any_book_id()
+    with engine.begin() as conn:
+        old_title = conn.execute(
+            text("SELECT title FROM BOOK WHERE book_id = :id"), {"id": book_id}
+        ).scalar()
+        conn.execute(
+            text("UPDATE BOOK SET title = 'Canción del Zapatéro Ñoño' WHERE book_id = :id"),
+            {"id": book_id},
+        )
+
+    try:
+        resp = client.get("/books", params={"q": "zapatero nono"})
+        assert resp.status_code == 200
+        assert [b["book_id"] for b in resp.json()] == [book_id]
+
+        # Sintaxis de FTS5 en la búsqueda: se trata como texto normal
+        assert client.get("/books", params={"q": '"zapat* OR'}).status_code == 200
+    finally:
+        with engine.begin() as conn:
+            conn.execute(
+                text("UPDATE BOOK SET title = :title WHERE book_id = :id"),
+                {"title": old_title, "id": book_id},
+            )
+
+    assert client.get("/books", params={"q": "zapatero"}).json() == []
+
+
+def test_books_cursor_pagination_matches_offset():
+    """Recorrer el catálogo con X-Next-Cursor devuelve los mismos libros que con offset."""
+    with engine.connect() as conn:
+        total = conn.execute(text("SELECT COUNT(*) FROM BOOK")).scalar()
+
+    by_offset = []
+    for offset in range(0, total, 50):
+        by_offset += [b["book_id"] for b in client.get("/books", params={"limit": 50, "offset": offset}).json()]
+
+    by_cursor = []
+    params = {"limit": 50}
+    while True:
+        resp = client.get("/books", params=params)
+        assert resp.status_code == 200
+        by_cursor += [b["book_id"] for b in resp.json()]
+        next_cursor = resp.headers.get("X-Next-Cursor")
+        if next_cursor is None:
+            break
+        params = {"limit": 50, "cursor": next_cursor}
+
+    assert len(by_cursor) == total
+    assert by_cursor == by_offset
+
+    assert client.get("/books", params={"cursor": "no-es-un-cursor"}).status_code == 400
+
+
+def test_recommender_backpressure_does_not_block_book_lookups(monkeypatch):
+    """Con el pool del recomendador lleno se responde 503 y las consultas baratas siguen atendiéndose."""
+    import asyncio
+    import threading
+
+    import httpx
+
+    import app.api.main as api
+    from app.api.executors import recommender_pool
+
+    release = threading.Event()
+    original = api.get_recommendations_for_user
+
+    def slow_recommendations(**kwargs):
+        release.wait(timeout=10)
+        return original(**kwargs)
+
+    monkeypatch.setattr(api, "get_recommendations_for_user", slow_recommendations)
+    monkeypatch.setattr(recommender_pool, "max_pending", 1)
+    user_id = _get_user_id_with_ratings()
+    book_id = _get_any_book_id()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            url = f"/users/{user_id}/recommendations?n=5&min_ratings=1&method=item_cf"
+            slow = asyncio.create_task(ac.get(url))
+            while recommender_pool.pending == 0:
+                await asyncio.sleep(0.01)
+
+            rejected = await ac.get(url)
+            book = await ac.get(f"/books/{book_id}")
+            release.set()
+            return rejected, book, await slow
+
+    rejected, book, slow = asyncio.run(scenario())
+
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == "1"
+    assert book.status_code == 200
+    assert slow.status_code == 200
+
+
+def test_shared_engines_use_wal_pool_and_read_only_connections():
+    """Engine compartido: pool real, WAL y PRAGMAs al conectar; el de lectura no puede escribir."""
+    import pytest
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.pool import QueuePool
+
+    from app.api.dependencies import BUSY_TIMEOUT_MS, get_read_engine
+    from app.recommender.popularity import get_engine as recommender_engine
+
+    read_engine = get_read_engine()
+    assert recommender_engine() is engine
+    assert isinstance(engine.pool, QueuePool)
+
+    with read_engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == BUSY_TIMEOUT_MS
+        assert conn.execute(text("SELECT COUNT(*) FROM BOOK")).scalar() > 0
+        with pytest.raises(OperationalError):
+            conn.execute(text("UPDATE BOOK SET title = title"))
+
+
+def test_response_cache_etag_and_invalidation_on_rating():
+    """Las respuestas GET llevan ETag = versión de los datos; un rating nuevo la cambia."""
+    book_id = _get_any_book_id()
+    url = f"/books/{book_id}"
+
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert "must-revalidate" in first.headers["Cache-Control"]
+
+    again = client.get(url)
+    assert again.headers["X-Cache"] == "HIT"
+    assert again.json() == first.json()
+
+    not_modified = client.get(url, headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == etag
+
+    user_id, copy_id = _get_any_user_and_copy()
+    client.post("/ratings", json={"user_id": user_id, "copy_id": copy_id, "rating": 3})
+
+    after = client.get(url, headers={"If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != etag
+    assert after.headers["X-Cache"] == "MISS"
+
+
+def _book_stats_consistent(book_id: int) -> bool:
+    with engine.connect() as conn:
+        stats = conn.execute(
+            text("SELECT num_ratings, sum_rating FROM BOOK_STATS WHERE book_id = :bid"),
+            {"bid": book_id},
+        ).first()
+        actual = conn.execute(
+            text(
+                """
+                SELECT COUNT(*) AS num_ratings, SUM(r.rating) AS sum_rating
+                FROM RATING r JOIN COPY c ON c.copy_id = r.copy_id
+                WHERE c.book_id = :bid
+                """
+            ),
+            {"bid": book_id},
+        ).first()
+    return tuple(stats) == tuple(actual)
+
+
+def test_ratings_batch_endpoint_upserts_and_skips_unknown_ids():
+    """POST /ratings/batch: un upsert por lote, último valor por par y BOOK_STATS coherente."""
+    with engine.connect() as conn:
+        book_id, copy_id = conn.execute(
+            text("SELECT book_id, MIN(copy_id) FROM COPY GROUP BY book_id LIMIT 1")
+        ).first()
+        users = conn.execute(text("SELECT user_id FROM USER ORDER BY user_id DESC LIMIT 3")).scalars().all()
+
+    payload = {
+        "ratings": [
+            {"user_id": users[0], "copy_id": copy_id, "rating": 2},
+            {"user_id": users[1], "copy_id": copy_id, "rating": 4},
+            {"user_id": users[0], "copy_id": copy_id, "rating": 5},
+            {"user_id": -1, "copy_id": copy_id, "rating": 3},
+            {"user_id": users[2], "copy_id": -7, "rating": 3},
+        ]
+    }
+    resp = client.post("/ratings/batch", json=payload)
+    assert resp.status_code == 201
+    data = resp.json()
+    assert data == {"accepted": 2, "unknown_user_ids": [-1], "unknown_copy_ids": [-7], "committed": True}
+
+    with engine.connect() as conn:
+        written = conn.execute(
+            text("SELECT user_id, rating FROM RATING WHERE copy_id = :cid AND user_id IN (:u0, :u1)"),
+            {"cid": copy_id, "u0": users[0], "u1": users[1]},
+        ).all()
+    assert dict(written) == {users[0]: 5, users[1]: 4}
+    assert _book_stats_consistent(book_id)
+
+
+def test_rating_write_queue_coalesces_in_async_and_batch_modes(monkeypatch):
+    """Modo async: 202 y los ratings repetidos de un par se escriben una vez; modo batch: 201 tras el commit."""
+    import app.api.main as api
+
+    user_id, copy_id = _get_any_user_and_copy()
+    with engine.connect() as conn:
+        book_id = conn.execute(text("SELECT book_id FROM COPY WHERE copy_id = :cid"), {"cid": copy_id}).scalar()
+
+    monkeypatch.setattr(api, "RATING_WRITE_MODE", "async")
+    monkeypatch.setattr(api.rating_queue, "flush_interval", 60)
+    flushed_before = api.rating_queue.stats()["flushed_batches"]
+    for rating in (1, 2, 3):
+        resp = client.post("/ratings", json={"user_id": user_id, "copy_id": copy_id, "rating": rating})
+        assert resp.status_code == 202
+    assert api.rating_queue.pending == 1
+
+    api.rating_queue.flush(timeout=10)
+    assert api.rating_queue.stats()["flushed_batches"] == flushed_before + 1
+    with engine.connect() as conn:
+        stored = conn.execute(
+            text("SELECT rating FROM RATING WHERE user_id = :uid AND copy_id = :cid"),
+            {"uid": user_id, "cid": copy_id},
+        ).scalar()
+    assert stored == 3
+    assert _book_stats_consistent(book_id)
+
+    monkeypatch.setattr(api, "RATING_WRITE_MODE", "batch")
+    monkeypatch.setattr(api.rating_queue, "flush_interval", 0.01)
+    resp = client.post("/ratings", json={"user_id": user_id, "copy_id": copy_id, "rating": 5})
+    assert resp.status_code == 201
+    with engine.connect() as conn:
+        stored = conn.execute(
+            text("SELECT rating FROM RATING WHERE user_id = :uid AND copy_id = :cid"),
+            {"uid": user_id, "cid": copy_id},
+        ).scalar()
+    assert stored == 5
+    assert _book_stats_consistent(book_id)
+
+    assert client.post("/ratings", json={"user_id": -1, "copy_id": copy_id, "rating": 5}).status_code == 400
+
+
+def test_fast_json_responses_match_models_and_openapi(monkeypatch):
+    """Los listados se serializan sin modelos por fila, pero cumplen su response_model y el OpenAPI no cambia."""
+    import json
+
+    from pydantic import TypeAdapter
+
+    import app.api.responses as responses
+    from app.api.main import BookOut, RecommendationOut
+
+    books = client.get("/books?limit=100")
+    assert books.status_code == 200
+    assert len(books.json()) == 100
+    assert TypeAdapter(list[BookOut]).validate_python(books.json())
+    assert "X-Next-Cursor" in books.headers
+
+    user_id = _get_user_id_with_ratings()
+    recs = client.get(f"/users/{user_id}/recommendations?n=50&min_ratings=1")
+    assert recs.status_code == 200
+    validated = TypeAdapter(list[RecommendationOut]).validate_python(recs.json())
+    assert [rec.model_dump() for rec in validated] == recs.json()
+
+    schema = app.openapi()["paths"]["/books"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert schema["items"]["$ref"].endswith("/BookOut")
+
+    # Sin orjson se recurre a json con el mismo resultado
+    payload = recs.json()
+    monkeypatch.setattr(responses, "orjson", None)
+    assert json.loads(responses.dumps(payload)) == payload
+
+
+def test_stats_endpoint_reads_dashboard_agg_and_counts_new_ratings():
+    """GET /stats sale de DASHBOARD_AGG, que cuadra con las tablas y suma los ratings nuevos."""
+    from app.recommender.dashboard import build_dashboard_agg, has_dashboard_agg
+
+    with engine.begin() as conn:
+        if not has_dashboard_agg(conn):
+            build_dashboard_agg(conn)
+        n_ratings = conn.execute(text("SELECT COUNT(*) FROM RATING")).scalar()
+        n_dated_users = conn.execute(
+            text("SELECT COUNT(*) FROM USER WHERE fecha_nacimiento IS NOT NULL")
+        ).scalar()
+        n_dated_books = conn.execute(
+            text("SELECT COUNT(*) FROM BOOK WHERE original_publication_year IS NOT NULL")
+        ).scalar()
+        user_id = conn.execute(text("SELECT MAX(user_id) FROM USER")).scalar()
+        copy_id = conn.execute(
+            text("SELECT MIN(copy_id) FROM COPY WHERE copy_id NOT IN (SELECT copy_id FROM RATING WHERE user_id = :uid)"),
+            {"uid": user_id},
+        ).scalar()
+
+    resp = client.get("/stats?top_n=5&min_ratings=1")
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["n_ratings"] == n_ratings
+    assert sum(row["num_users"] for row in data["users_by_age"]) == n_dated_users
+    assert len(data["top_books"]) == 5
+    assert sum(row["num_books"] for row in data["books_by_year"]) == n_dated_books
+
+    # Un rating nuevo suma 1; actualizarlo no cambia el contador
+    for rating in (4, 2):
+        client.post("/ratings", json={"user_id": user_id, "copy_id": copy_id, "rating": rating})
+    after = client.get("/stats?top_n=5&min_ratings=1").json()
+    assert after["n_ratings"] == n_ratings + 1
+
+
+def test_concurrent_rating_batches_do_not_hit_busy_snapshot():
+    """Varios lotes escritos a la vez (POST /ratings/batch en modo sync) no fallan con 'database is locked'."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    import app.api.main as api
+
+    with engine.connect() as conn:
+        pairs = conn.execute(text("SELECT user_id, copy_id FROM RATING LIMIT 240")).all()
+
+    def flush(i):
+        uid, cid = pairs[i]
+        return api._flush_ratings({(uid, cid): 1 + i % 5})
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(flush, range(len(pairs))))
+    assert results == [1] * len(pairs)
+
+
+def test_if_none_match_does_not_hide_missing_resources(monkeypatch):
+    """Un ETag vigente en If-None-Match no convierte un 404 en 304."""
+    from app.api import main as api
+
+    # Fijamos la versión de los datos durante el test: sin relecturas de META
+    api.data_version.current()
+    monkeypatch.setattr(api.data_version, "ttl_seconds", 3600)
+    etag = client.get(f"/books/{_get_any_book_id()}").headers["ETag"]
+
+    for url in ("/books/99999999", "/users/99999999/recommendations"):
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 404, url
+
+    # Sin entrada cacheada se ejecuta el endpoint y, como el ETag coincide, 304
+    url = "/books?limit=7"
+    response = client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert client.get(url).headers["X-Cache"] == "HIT"
+
+
+def test_data_version_change_from_other_process_refreshes_recommender_caches(monkeypatch):
+    """
+    Al ver una versión nueva escrita por otro proceso, item-CF se reentrena en
+    segundo plano sin dejar de servir el modelo anterior, y el callback no
+    espera a los locks de los modelos ni de la caché de popularidad.
+    """
+    import threading
+
+    from app.api import main as api
+    from app.api.cache import DataVersion
+    from app.recommender import item_cf, popularity
+    from app.recommender.tables import bump_data_version
+
+    seen = []
+    version = {"value": 1}
+    tracker = DataVersion(loader=lambda: version["value"], ttl_seconds=0,
+                              on_change=lambda old, new: seen.append((old, new)))
+    tracker.current()
+    tracker.current()
+    version["value"] = 2
+    assert tracker.current() == 2
+    assert seen == [(1, 2)]
+
+    model = item_cf.get_item_cf_model()
+    api.data_version.current()
+    with engine.begin() as conn:
+        bump_data_version(conn)
+    api.data_version.invalidate()
+
+    # Un entrenamiento o una carga en curso (locks tomados) no bloquean current()
+    with item_cf._model_lock, popularity._popularity_cache._lock:
+        reader = threading.Thread(target=api.data_version.current)
+        reader.start()
+        reader.join(timeout=5)
+        assert not reader.is_alive()
+    new_version = api.data_version.current()
+    assert item_cf._model is model
+
+    monkeypatch.setattr(item_cf, "RETRAIN_INTERVAL_SECONDS", 0)
+    assert item_cf.get_item_cf_model() is model
+    retrain = item_cf._retrain_thread
+    if retrain is not None:
+        retrain.join()
+    assert item_cf._trained_version == new_version
+    assert item_cf.get_item_cf_model() is not model
+
+
+def test_rating_write_queue_retries_failed_flushes_and_counts_in_flight(caplog):
+    """Un lote que falla se reintenta (y se registra); el lote en escritura cuenta como pendiente."""
+    import threading
+    import time
+
+    import pytest
+    from fastapi import HTTPException
+
+    from app.api.write_queue import RatingWriteQueue
+
+    calls = []
+    release = threading.Event()
+
+    def flaky_flush(ratings):
+        calls.append(dict(ratings))
+        release.wait(timeout=10)
+        if len(calls) < 3:
+            raise RuntimeError("database is locked")
+        return len(ratings)
+
+    queue = RatingWriteQueue(flaky_flush, flush_interval_ms=0, max_pending=2, retry_ms=1)
+    done = queue.submit([(1, 10, 5), (2, 10, 4)])
+    while not calls:
+        time.sleep(0.01)
+    # El lote ya no está en la cola, pero se está escribiendo: cuenta para la backpressure
+    assert queue.pending == 2
+    with pytest.raises(HTTPException) as exc:
+        queue.submit([(3, 10, 1)])
+    assert exc.value.status_code == 503
+
+    release.set()
+    assert done.result(timeout=10) == 2
+    assert len(calls) == 3 and calls[0] == calls[2]
+    assert queue.stats()["failed_batches"] == 0
+    assert queue.pending == 0
+    assert "se reintenta" in caplog.text
+
+    failing = RatingWriteQueue(lambda ratings: 1 / 0, flush_interval_ms=0, max_retries=1, retry_ms=1)
+    with pytest.raises(ZeroDivisionError):
+        failing.submit([(1, 10, 5)]).result(timeout=10)
+    assert failing.stats()["failed_batches"] == 1
+    assert "se descarta" in caplog.text
+    queue.close()
+    failing.close()
@@ -7,9 +7,7 @@ ROOT_DIR = Path(__file__).resolve().parents[1]
 if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
-from app.etl.run_etl import run_etl
-
-DB_PATH = ROOT_DIR / "app" / "db" / "library.db"
+from app.etl.run_etl import DB_PATH, run_etl
 
 # Si la BD no existe, ejecutamos el ETL una vez
 if not DB_PATH.exists():
@@ -30,3 +28,52 @@ def test_tables_exist():
         assert row is not None, f"La tabla {table} no existe"
 
     conn.close()
+
+
+def test_hot_queries_use_indexes():
+    """Las consultas críticas de la API deben resolverse con índices, no con recorridos completos."""
+    from app.etl.schema import check_query_plans
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        failed = [p for p in check_query_plans(conn) if not p["ok"]]
+    finally:
+        conn.close()
+
+    assert not failed, f"Consultas sin el índice esperado: {failed}"
+
+
+def test_rating_user_copy_is_unique():
+    """Un usuario solo puede valorar una vez cada ejemplar."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        user_id, copy_id = conn.execute("SELECT user_id, copy_id FROM RATING LIMIT 1").fetchone()
+        try:
+            conn.execute(
+                "INSERT INTO RATING (user_id, copy_id, rating) VALUES (?, ?, 3)",
+                (user_id, copy_id),
+            )
+            duplicated = True
+        except sqlite3.IntegrityError:
+            duplicated = False
+    finally:
+        conn.rollback()
+        conn.close()
+
+    assert not duplicated
+
+
+def test_catalog_from_book_stats_matches_rating_aggregation():
+    """El catálogo de la UI leído de BOOK_STATS coincide con la agregación sobre RATING."""
+    import pandas as pd
+
+    from app.api.dependencies import get_read_engine
+    from app.ui.catalog import load_catalog
+
+    with get_read_engine().connect() as conn:
+        lang = conn.exec_driver_sql("SELECT language_code FROM BOOK WHERE language_code IS NOT NULL LIMIT 1").scalar()
+        for filters in ({}, {"language": lang}, {"year_from": 1990, "year_to": 2010}):
+            fast = load_catalog(conn, limit=50, materialized=True, **filters)
+            slow = load_catalog(conn, limit=50, materialized=False, **filters)
+            assert not fast.empty
+            pd.testing.assert_frame_equal(fast, slow, check_dtype=False)
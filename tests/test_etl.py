@@ -9,5 +9,343 @@ if str(ROOT_DIR) not in sys.path:
 
 from app.etl.run_etl import run_etl
 
-BASE_DIR = ROOT_DIR
-DB_PATH = BASE_DIR / "app" / "db" / "library.db"
+
+def _write_raw_ratings(path: Path):
+    path.write_text(
+        "user_id,copy_id,rating\n"
+        "1,10,5\n"
+        "1,11,0\n"   # rating inválido
+        "2,10,4\n"
+        "1,10,3\n"   # duplicado (user_id, copy_id)
+        "3,12,x\n"   # rating no numérico
+        "2,11,2\n"
+        "2,10,1\n",  # duplicado en otro trozo
+        encoding="utf-8",
+    )
+
+
+def test_clean_ratings_streaming_matches_full(tmp_path):
+    """El modo por trozos debe producir el mismo fichero que el modo completo."""
+    import pandas as pd
+
+    from app.etl.clean_ratings import clean_ratings
+
+    raw = tmp_path / "ratings.csv"
+    _write_raw_ratings(raw)
+
+    full = clean_ratings(raw_path=raw, out_path=tmp_path / "full.csv")
+    streamed = clean_ratings(raw_path=raw, out_path=tmp_path / "chunked.csv", chunksize=2, track_memory=True)
+
+    for key in ("input_rows", "output_rows", "dropped_rows"):
+        assert full[key] == streamed[key]
+    assert streamed["output_rows"] == 3
+    assert streamed["peak_memory_mb"] is not None
+    assert full["peak_memory_mb"] is None  # tracemalloc solo si se pide
+
+    df_full = pd.read_csv(tmp_path / "full.csv")
+    df_chunked = pd.read_csv(tmp_path / "chunked.csv")
+    assert df_full.equals(df_chunked)
+    assert list(df_chunked.itertuples(index=False, name=None)) == [(1, 10, 5), (2, 10, 4), (2, 11, 2)]
+
+
+def test_seen_keys_keeps_first_occurrence():
+    import numpy as np
+
+    from app.etl.streaming import SeenKeys
+
+    seen = SeenKeys()
+    assert seen.add_new(np.array([5, 3, 5, 7])).tolist() == [True, True, False, True]
+    assert seen.add_new(np.array([7, 1, 1, 3])).tolist() == [False, True, False, False]
+    assert len(seen) == 4
+    assert seen.values().tolist() == [1, 3, 5, 7]
+
+
+def test_clean_ratings_returns_frame_without_export(tmp_path):
+    """Con out_path=None no se escribe fichero y el DataFrame se devuelve en memoria."""
+    from app.etl.clean_ratings import clean_ratings
+
+    raw = tmp_path / "ratings.csv"
+    _write_raw_ratings(raw)
+
+    stats, df = clean_ratings(raw_path=raw, out_path=None, chunksize=3, return_frame=True)
+
+    assert stats["output_path"] is None
+    assert list(tmp_path.iterdir()) == [raw]
+    assert len(df) == stats["output_rows"] == 3
+    assert str(df["rating"].dtype) == "int8"
+    assert str(df["user_id"].dtype) == "int32"
+
+
+def test_bulk_load_creates_schema_and_indexes(tmp_path):
+    """bulk_load crea las tablas con el esquema declarado, carga todas las filas y crea los índices."""
+    import datetime
+
+    import pandas as pd
+
+    from app.etl.bulk_load import bulk_load
+
+    db = tmp_path / "test.db"
+    users = pd.DataFrame({
+        "user_id": pd.Series([1, 2], dtype="int32"),
+        "sexo": pd.Series(["M", None], dtype="string"),
+        "fecha_nacimiento": [datetime.date(1990, 5, 1), None],
+        "tiene_info_demografica": [True, False],
+    })
+    ratings = pd.DataFrame({
+        "user_id": pd.Series([1, 1, 2], dtype="int32"),
+        "copy_id": pd.Series([10, 11, 10], dtype="int32"),
+        "rating": pd.Series([5, 3, 4], dtype="int8"),
+    })
+
+    timings = bulk_load(db, {"USER": users, "RATING": ratings}, batch_rows=2)
+
+    assert timings["RATING"]["rows"] == 3
+    conn = sqlite3.connect(db)
+    try:
+        assert conn.execute("SELECT * FROM USER ORDER BY user_id").fetchall() == [
+            (1, "M", "1990-05-01", 1),
+            (2, None, None, 0),
+        ]
+        assert conn.execute("SELECT COUNT(*) FROM RATING").fetchone()[0] == 3
+        indexes = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {"ux_rating_user_copy", "idx_rating_copy"} <= indexes
+    finally:
+        conn.close()
+
+
+def _write_raw_dataset(raw_dir: Path):
+    raw_dir.mkdir()
+    (raw_dir / "books.csv").write_text(
+        "book_id,isbn,authors,original_publication_year,original_title,title,language_code,image_url\n"
+        "1,i1,Autor A,2001,T1,Título 1,eng,http://x\n"
+        "2,i2,Autor B,1999,T2,Título 2,spa,http://x\n",
+        encoding="utf-8",
+    )
+    (raw_dir / "copies(ejemplares).csv").write_text("copy_id,book_id\n10,1\n11,1\n20,2\n", encoding="utf-8")
+    (raw_dir / "user_info.csv").write_text(
+        "user_id,sexo,comentario,fecha_nacimiento\n1,M,x,08/11/1981\n9,F,y,01/02/1990\n",
+        encoding="utf-8",
+    )
+    (raw_dir / "ratings.csv").write_text(
+        "user_id,copy_id,rating\n1,10,5\n2,11,4\n2,20,3\n", encoding="utf-8"
+    )
+
+
+def test_detect_change_appended_vs_changed(tmp_path):
+    from app.etl.incremental import APPENDED, CHANGED, UNCHANGED, detect_change, file_fingerprint, read_delta
+
+    path = tmp_path / "ratings.csv"
+    path.write_text("user_id,copy_id,rating\n1,10,5\n", encoding="utf-8")
+    previous = file_fingerprint(path)
+
+    assert detect_change(path, previous)[0] == UNCHANGED
+
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("2,11,4\n")
+    kind, offset, _ = detect_change(path, previous)
+    assert kind == APPENDED
+    assert read_delta(path, offset).read() == b"user_id,copy_id,rating\n2,11,4\n"
+
+    path.write_text("user_id,copy_id,rating\n1,10,3\n2,11,4\n", encoding="utf-8")
+    assert detect_change(path, previous)[0] == CHANGED
+
+
+def test_incremental_etl_applies_delta_and_keeps_live_writes(tmp_path, monkeypatch):
+    """El modo incremental carga solo las filas añadidas y no pisa los ratings escritos en vivo."""
+    import app.etl.run_etl as etl
+
+    raw_dir = tmp_path / "raw"
+    _write_raw_dataset(raw_dir)
+    db_path = tmp_path / "library.db"
+    monkeypatch.setattr(etl, "RAW_DIR", raw_dir)
+    monkeypatch.setattr(etl, "DB_PATH", db_path)
+    monkeypatch.setattr(etl, "REPORTS_DIR", tmp_path / "reportes")
+
+    etl.run_etl()
+
+    # Rating escrito desde la API después de la carga
+    from sqlalchemy import create_engine
+
+    from app.recommender.book_stats import save_rating
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    with engine.begin() as sa_conn:
+        save_rating(sa_conn, 1, 20, 1)
+    engine.dispose()
+
+    with open(raw_dir / "ratings.csv", "a", encoding="utf-8") as f:
+        f.write("1,20,5\n")   # mismo par que el rating en vivo
+        f.write("9,10,2\n")   # usuario nuevo (con datos en user_info)
+        f.write("9,99,4\n")   # copy_id inexistente
+    with open(raw_dir / "copies(ejemplares).csv", "a", encoding="utf-8") as f:
+        f.write("21,2\n")
+
+    result = etl.run_incremental_etl()
+
+    assert result["mode"] == "incremental"
+    assert result["files"]["ratings"]["change"] == "appended"
+    assert result["files"]["ratings"]["delta_rows"] == 3
+    assert result["files"]["ratings"]["applied_rows"] == 1
+    assert result["files"]["books"]["change"] == "unchanged"
+
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT rating FROM RATING WHERE user_id = 1 AND copy_id = 20").fetchone() == (1,)
+        assert conn.execute("SELECT COUNT(*) FROM RATING").fetchone() == (5,)
+        assert conn.execute("SELECT COUNT(*) FROM COPY").fetchone() == (4,)
+        assert conn.execute(
+            "SELECT sexo, tiene_info_demografica FROM USER WHERE user_id = 9"
+        ).fetchone() == ("F", 1)
+        # BOOK_STATS actualizada con el delta
+        assert conn.execute(
+            "SELECT num_ratings, sum_rating FROM BOOK_STATS WHERE book_id = 1"
+        ).fetchone() == (3, 11)
+        # (de BOOK_STATS solo los contadores: mean y score pueden diferir en el último decimal)
+        derived = {
+            "BOOK_STATS": "SELECT book_id, num_ratings, sum_rating FROM BOOK_STATS ORDER BY 1",
+            "BOOK_AGE_STATS": "SELECT * FROM BOOK_AGE_STATS ORDER BY 1, 2",
+            "DASHBOARD_AGG": "SELECT * FROM DASHBOARD_AGG ORDER BY 1, 2",
+        }
+        incremental = {table: conn.execute(sql).fetchall() for table, sql in derived.items()}
+    finally:
+        conn.close()
+
+    # Los deltas dejan las tablas derivadas igual que reconstruirlas enteras
+    from app.recommender.age_stats import build_book_age_stats
+    from app.recommender.book_stats import build_book_stats
+    from app.recommender.dashboard import build_dashboard_agg
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    with engine.begin() as sa_conn:
+        for build in (build_book_stats, build_book_age_stats, build_dashboard_agg):
+            build(sa_conn)
+        for table, sql in derived.items():
+            assert [tuple(r) for r in sa_conn.exec_driver_sql(sql)] == incremental[table], table
+    engine.dispose()
+
+    # Sin cambios en los CSV no se aplica nada
+    result = etl.run_incremental_etl()
+    assert {f["change"] for f in result["files"].values()} == {"unchanged"}
+
+
+def test_parallel_etl_matches_serial(tmp_path, monkeypatch):
+    """Con los limpiadores en paralelo la BD resultante es la misma que en serie."""
+    import app.etl.run_etl as etl
+
+    raw_dir = tmp_path / "raw"
+    _write_raw_dataset(raw_dir)
+    monkeypatch.setattr(etl, "RAW_DIR", raw_dir)
+    monkeypatch.setattr(etl, "REPORTS_DIR", tmp_path / "reportes")
+
+    contents = []
+    for workers in (1, 2):
+        db_path = tmp_path / f"library_{workers}.db"
+        monkeypatch.setattr(etl, "DB_PATH", db_path)
+        timings = etl.run_etl(workers=workers)
+        assert {"limpieza books", "limpieza ratings", "integridad", "carga SQLite", "total"} <= set(timings)
+
+        conn = sqlite3.connect(db_path)
+        contents.append({
+            table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall()
+            for table in ["USER", "BOOK", "COPY", "RATING", "BOOK_STATS"]
+        })
+        conn.close()
+
+    assert contents[0] == contents[1]
+
+
+def test_filter_foreign_key_reports_orphans(monkeypatch):
+    """El filtrado por FK da el mismo resultado con bitmap y con searchsorted, y lista los huérfanos."""
+    import numpy as np
+    import pandas as pd
+
+    import app.etl.integrity as integrity
+
+    ratings = pd.DataFrame({"copy_id": np.array([3, 7, 3, -1, 12, 5], dtype="int32")})
+    valid = integrity.sorted_ids([5, 3, 12, 5])
+
+    for bitmap_max_id in (integrity.BITMAP_MAX_ID, 0):
+        monkeypatch.setattr(integrity, "BITMAP_MAX_ID", bitmap_max_id)
+        result = integrity.filter_foreign_key(ratings, "copy_id", valid)
+
+        assert result.frame["copy_id"].tolist() == [3, 3, 12, 5]
+        assert result.dropped_rows == 2
+        assert result.orphan_ids.tolist() == [-1, 7]
+
+
+def test_bulk_load_streams_chunks(tmp_path):
+    """bulk_load acepta un iterable de trozos y los inserta según llegan."""
+    import pandas as pd
+
+    from app.etl.bulk_load import bulk_load
+
+    ratings = pd.DataFrame({
+        "user_id": pd.Series([1, 1, 2, 3], dtype="int32"),
+        "copy_id": pd.Series([10, 11, 10, 12], dtype="int32"),
+        "rating": pd.Series([5, 3, 4, 1], dtype="int8"),
+    })
+    consumed = []
+
+    def chunks():
+        for start in (0, 2):
+            consumed.append(start)
+            yield ratings.iloc[start:start + 2]
+
+    timings = bulk_load(tmp_path / "test.db", {"RATING": chunks(), "BOOK": iter([])})
+
+    assert consumed == [0, 2]
+    assert timings["RATING"]["rows"] == 4
+    assert timings["BOOK"]["rows"] == 0
+    conn = sqlite3.connect(tmp_path / "test.db")
+    try:
+        assert conn.execute("SELECT user_id, copy_id, rating FROM RATING ORDER BY rating_id").fetchall() == [
+            (1, 10, 5), (1, 11, 3), (2, 10, 4), (3, 12, 1),
+        ]
+        assert conn.execute("SELECT COUNT(*) FROM BOOK").fetchone() == (0,)
+    finally:
+        conn.close()
+
+
+def test_clean_books_fills_or_drops_missing_titles(tmp_path):
+    """BOOK.title es NOT NULL: sin título se usa original_title y, si tampoco hay, se descarta el libro."""
+    from app.etl.clean_books import clean_books
+
+    raw = tmp_path / "books.csv"
+    raw.write_text(
+        "book_id,title,original_title,original_publication_year\n"
+        "1,Dune,Dune,1965\n"
+        "2,,Solaris,1961\n"
+        "3,  ,,2000\n"
+        "3,Ubik,Ubik,1969\n",  # duplicado de un libro descartado: se conserva
+        encoding="utf-8",
+    )
+
+    stats, df = clean_books(raw_path=raw, out_path=None, chunksize=2, return_frame=True)
+
+    assert list(df[["book_id", "title"]].itertuples(index=False, name=None)) == [
+        (1, "Dune"), (2, "Solaris"), (3, "Ubik"),
+    ]
+    assert stats["dropped_rows"] == 1
+
+
+def test_prefetch_keeps_order_and_reraises_errors():
+    """Prefetch entrega los trozos en orden, relanza los errores del hilo y se puede cerrar a medias."""
+    import pytest
+
+    from app.etl.streaming import Prefetch
+
+    with Prefetch(iter(range(20)), max_pending=2) as items:
+        assert list(items) == list(range(20))
+
+    def failing():
+        yield 1
+        raise ValueError("trozo corrupto")
+
+    with Prefetch(failing()) as items:
+        with pytest.raises(ValueError, match="trozo corrupto"):
+            list(items)
+
+    # Sin consumir nada: al salir se para el hilo aunque la cola esté llena
+    with Prefetch(iter(range(100)), max_pending=1) as items:
+        pass
+    assert not items._thread.is_alive()
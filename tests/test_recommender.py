@@ -10,10 +10,9 @@ if str(ROOT_DIR) not in sys.path:
     sys.path.insert(0, str(ROOT_DIR))
 
 from app.etl.run_etl import run_etl
-from app.api.dependencies import get_engine
+from app.api.dependencies import DB_PATH, get_engine
 from app.recommender.collaborative import get_recommendations_for_user
 
-DB_PATH = ROOT_DIR / "app" / "db" / "library.db"
 if not DB_PATH.exists():
     run_etl()
 
@@ -70,3 +69,398 @@ def test_recommendations_do_not_include_already_rated_books():
     assert rated_set.isdisjoint(rec_books), (
         "Las recomendaciones incluyen libros ya valorados por el usuario"
     )
+
+
+def test_book_stats_matches_rating_aggregate():
+    """BOOK_STATS debe coincidir con la agregación completa de RATING."""
+    with engine.connect() as conn:
+        expected = conn.execute(
+            text(
+                """
+                SELECT c.book_id, COUNT(r.rating) AS num_ratings, SUM(r.rating) AS sum_rating
+                FROM RATING r
+                JOIN COPY c ON r.copy_id = c.copy_id
+                GROUP BY c.book_id
+                """
+            )
+        ).all()
+        materialized = conn.execute(
+            text("SELECT book_id, num_ratings, sum_rating FROM BOOK_STATS")
+        ).all()
+
+    assert sorted(map(tuple, expected)) == sorted(map(tuple, materialized))
+
+
+def test_popularity_cache_hits_and_invalidation():
+    """La caché de popularidad sirve desde memoria y se invalida explícitamente."""
+    from app.recommender.popularity import (
+        get_top_books_global,
+        invalidate_popularity_cache,
+        popularity_cache_stats,
+    )
+
+    invalidate_popularity_cache()
+    misses = popularity_cache_stats()["misses"]
+
+    first = get_top_books_global(n=5, min_ratings=1)
+    hits = popularity_cache_stats()["hits"]
+    second = get_top_books_global(n=5, min_ratings=1)
+
+    assert popularity_cache_stats()["misses"] == misses + 1
+    assert popularity_cache_stats()["hits"] == hits + 1
+    assert first.equals(second)
+    assert first["score"].is_monotonic_decreasing
+
+    invalidate_popularity_cache()
+    get_top_books_global(n=5, min_ratings=1)
+    assert popularity_cache_stats()["misses"] == misses + 2
+
+
+def test_item_cf_recommendations_exclude_rated_books():
+    """El modelo item-based tampoco debe recomendar libros ya valorados."""
+    user_id = _get_user_with_enough_ratings()
+
+    with engine.connect() as conn:
+        rated_books = conn.execute(
+            text(
+                """
+                SELECT DISTINCT c.book_id
+                FROM RATING r
+                JOIN COPY c ON r.copy_id = c.copy_id
+                WHERE r.user_id = :uid
+                """
+            ),
+            {"uid": user_id},
+        ).scalars().all()
+
+    recs = get_recommendations_for_user(user_id=user_id, n=10, min_ratings=1, method="item_cf")
+
+    assert not recs.empty
+    assert set(rated_books).isdisjoint(recs["book_id"].tolist())
+    assert recs["score"].is_monotonic_decreasing
+
+
+def test_item_cf_similarity_is_cosine():
+    """Los vecinos guardados deben ser similitudes coseno entre columnas."""
+    import numpy as np
+    import pandas as pd
+
+    from app.recommender.item_cf import ItemCFModel
+    from app.recommender.matrix import user_item_matrix_from_frame
+
+    df = pd.DataFrame(
+        {
+            "user_id": [1, 1, 2, 2, 3, 3, 3],
+            "book_id": [10, 20, 10, 20, 10, 30, 30],
+            "rating": [5, 4, 3, 3, 4, 2, 4],
+        }
+    )
+    uim = user_item_matrix_from_frame(df)
+    # Copias repetidas del mismo libro se promedian
+    assert uim.matrix[uim.user_index(3), 2] == 3.0
+
+    model = ItemCFModel(n_neighbours=2).fit(uim)
+    dense = uim.matrix.toarray()
+    a, b = dense[:, 0], dense[:, 1]
+    expected = a @ b / (np.linalg.norm(a) * np.linalg.norm(b))
+    assert np.isclose(model.neighbours[0, 1], expected)
+
+
+def test_als_factors_roundtrip_with_mmap(tmp_path):
+    """ALS aprende los ratings de entrenamiento y se carga desde .npy con mmap."""
+    import numpy as np
+    import pandas as pd
+
+    from app.recommender.als import ALSModel
+    from app.recommender.matrix import user_item_matrix_from_frame
+
+    rng = np.random.default_rng(0)
+    users, books = np.arange(1, 41), np.arange(100, 130)
+    true_u, true_v = rng.random((40, 3)), rng.random((30, 3))
+    df = pd.DataFrame(
+        [
+            (u, b, 1 + 4 * (true_u[i] @ true_v[j]) / 3)
+            for i, u in enumerate(users)
+            for j, b in enumerate(books)
+            if rng.random() < 0.6
+        ],
+        columns=["user_id", "book_id", "rating"],
+    )
+    uim = user_item_matrix_from_frame(df)
+
+    model = ALSModel.train(uim, factors=3, regularization=0.01, iterations=15, n_threads=2)
+    pred = model.user_factors @ model.item_factors.T
+    rows, cols = uim.matrix.nonzero()
+    rmse = np.sqrt(np.mean((pred[rows, cols] - np.asarray(uim.matrix[rows, cols]).ravel()) ** 2))
+    assert rmse < 0.1
+
+    loaded = ALSModel.load(model.save(tmp_path))
+    assert isinstance(loaded.item_factors, np.memmap)
+
+    for name in ("user_ids", "book_ids", "user_factors", "item_factors", "num_ratings"):
+        assert np.array_equal(getattr(loaded, name), getattr(model, name))
+
+
+@pytest.mark.parametrize("method", ["popularity", "item_cf"])
+def test_batch_recommendations_match_single_user(method):
+    """El camino vectorizado debe dar lo mismo que usuario a usuario."""
+    from app.recommender.collaborative import get_recommendations_for_users
+
+    with engine.connect() as conn:
+        user_ids = conn.execute(
+            text("SELECT DISTINCT user_id FROM RATING ORDER BY user_id LIMIT 20")
+        ).scalars().all()
+
+    batch = get_recommendations_for_users(user_ids, n=5, min_ratings=1, method=method)
+    assert set(batch["user_id"]) <= set(user_ids)
+
+    for uid in user_ids[:5]:
+        single = get_recommendations_for_user(uid, n=5, min_ratings=1, method=method)
+        from_batch = batch[batch["user_id"] == uid].sort_values("rank")
+        assert from_batch["book_id"].tolist() == single["book_id"].tolist()
+
+
+def test_age_range_cube_matches_rating_scan_and_follows_writes():
+    """El top por edad con BOOK_AGE_STATS coincide con el cálculo sobre RATING y sigue las escrituras."""
+    from sqlalchemy import text
+
+    from app.api.dependencies import DB_PATH, get_engine
+    from app.recommender.age_stats import build_book_age_stats
+    from app.recommender.book_stats import save_rating
+    from app.recommender.popularity import (
+        _top_books_for_age_range_from_ratings,
+        get_top_books_for_age_range,
+        invalidate_popularity_cache,
+    )
+
+    engine = get_engine()
+    with engine.begin() as conn:
+        build_book_age_stats(conn)
+    invalidate_popularity_cache()
+
+    for age_min, age_max in ((0, 120), (20, 40), (41, 60)):
+        fast = get_top_books_for_age_range(age_min, age_max, n=20, min_ratings=1)
+        slow = _top_books_for_age_range_from_ratings(age_min, age_max, 20, 1, 2025)
+        assert fast["score"].round(9).tolist() == slow["score"].round(9).tolist()
+        assert fast["num_ratings"].tolist() == slow["num_ratings"].tolist()
+
+    # Un rating nuevo de un usuario con fecha de nacimiento entra en su celda del cubo
+    with engine.begin() as conn:
+        user_id, birth_year = conn.execute(
+            text(
+                """
+                SELECT user_id, CAST(strftime('%Y', fecha_nacimiento) AS INTEGER)
+                FROM USER WHERE fecha_nacimiento IS NOT NULL LIMIT 1
+                """
+            )
+        ).first()
+        copy_id, book_id = conn.execute(
+            text(
+                """
+                SELECT copy_id, book_id FROM COPY
+                WHERE copy_id NOT IN (SELECT copy_id FROM RATING WHERE user_id = :uid)
+                LIMIT 1
+                """
+            ),
+            {"uid": user_id},
+        ).first()
+        cell = text(
+            "SELECT num_ratings, sum_rating FROM BOOK_AGE_STATS WHERE birth_year = :y AND book_id = :b"
+        )
+        before = conn.execute(cell, {"y": birth_year, "b": book_id}).first() or (0, 0)
+        save_rating(conn, user_id, copy_id, 4)
+        save_rating(conn, user_id, copy_id, 2)
+        after = conn.execute(cell, {"y": birth_year, "b": book_id}).first()
+    assert tuple(after) == (before[0] + 1, before[1] + 2)
+
+
+def test_top_books_by_genre_uses_language_partitions():
+    """El top por idioma desde el índice particionado coincide con filtrar todo el catálogo."""
+    import numpy as np
+
+    from app.recommender.popularity import get_book_stats_arrays, get_top_books_by_genre
+
+    arrays = get_book_stats_arrays()
+    index = arrays.by_language
+    assert index.offsets[-1] == np.count_nonzero(arrays.language_code != None)  # noqa: E711
+
+    for lang in list(index.keys) + ["xx"]:
+        rows = index.rows_for(lang)
+        assert (np.diff(rows) > 0).all()  # filas en orden de score
+        for min_ratings in (1, 5, 50):
+            expected = np.flatnonzero((arrays.language_code == lang) & (arrays.num_ratings >= min_ratings))[:10]
+            top = get_top_books_by_genre(lang, n=10, min_ratings=min_ratings)
+            assert top["book_id"].tolist() == arrays.book_id[expected].tolist()
+
+
+def test_als_retrain_publishes_new_version_without_touching_mapped_files(tmp_path):
+    """Guardar otra vez no reescribe los .npy mapeados; get_als_model recarga la versión nueva."""
+    import numpy as np
+
+    from app.recommender import als
+
+    def model(scale):
+        return als.ALSModel(
+            user_ids=np.array([1, 2]),
+            book_ids=np.array([10, 20, 30]),
+            user_factors=np.full((2, 2), scale, dtype=np.float32),
+            item_factors=np.full((3, 2), scale, dtype=np.float32),
+            num_ratings=np.array([1, 1, 1]),
+        )
+
+    als.reset_als_model()
+    model(1.0).save(tmp_path)
+    first = als.get_als_model(tmp_path)
+    assert isinstance(first.item_factors, np.memmap)
+    assert als.get_als_model(tmp_path) is first
+
+    model(2.0).save(tmp_path)
+    model(3.0).save(tmp_path)
+    # Los ficheros mapeados por el primer modelo siguen íntegros (en Linux, aunque ya se hayan podado)
+    assert np.all(first.item_factors == 1.0)
+
+    latest = als.get_als_model(tmp_path)
+    assert latest is not first
+    assert np.all(latest.item_factors == 3.0)
+    assert len([p for p in tmp_path.iterdir() if p.is_dir()]) == 2
+    als.reset_als_model()
+
+
+def test_precomputed_recommendations_without_book_stats():
+    """En una BD sin BOOK_STATS (ETL antiguo) el precálculo se sirve agregando RATING, con los mismos valores."""
+    import pandas as pd
+    from sqlalchemy import create_engine
+
+    from app.recommender.book_stats import build_book_stats
+    from app.recommender.user_recs import get_precomputed_recommendations, write_user_recs
+
+    mem_engine = create_engine("sqlite://")
+    with mem_engine.begin() as conn:
+        for ddl in (
+            "CREATE TABLE BOOK (book_id INTEGER PRIMARY KEY, title TEXT, authors TEXT, language_code TEXT)",
+            "CREATE TABLE COPY (copy_id INTEGER PRIMARY KEY, book_id INTEGER)",
+            "CREATE TABLE RATING (user_id INTEGER, copy_id INTEGER, rating INTEGER)",
+        ):
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql("INSERT INTO BOOK VALUES (1, 'A', NULL, 'en'), (2, 'B', NULL, 'es'), (3, 'C', NULL, 'en')")
+        conn.exec_driver_sql("INSERT INTO COPY VALUES (10, 1), (11, 1), (20, 2), (30, 3)")
+        conn.exec_driver_sql("INSERT INTO RATING VALUES (1, 10, 5), (2, 11, 2), (2, 20, 4)")
+        recs = pd.DataFrame({"user_id": [1, 1], "rank": [1, 2], "book_id": [2, 3], "score": [0.9, 0.5]})
+        write_user_recs(conn, recs, method="item_cf", min_ratings=1, top_n=2)
+
+        fallback = get_precomputed_recommendations(conn, 1, n=2, min_ratings=1, method="item_cf")
+        build_book_stats(conn)
+        materialized = get_precomputed_recommendations(conn, 1, n=2, min_ratings=1, method="item_cf")
+
+    assert fallback["book_id"].tolist() == [2, 3]
+    assert fallback["num_ratings"].tolist() == [1, 0]
+    assert fallback["mean_rating"].tolist() == [4.0, 0.0]
+    pd.testing.assert_frame_equal(fallback, materialized, check_dtype=False)
+
+
+def test_concurrent_save_rating_on_same_pairs_keeps_book_stats(tmp_path):
+    """Varios hilos escribiendo los mismos pares no fallan y BOOK_STATS sigue cuadrando con RATING."""
+    import random
+    import sqlite3
+    from concurrent.futures import ThreadPoolExecutor
+
+    from app.api.dependencies import create_sqlite_engine
+    from app.recommender.book_stats import save_rating
+
+    db_copy = tmp_path / "library.db"
+    src, dst = sqlite3.connect(DB_PATH), sqlite3.connect(db_copy)
+    src.backup(dst)
+    src.close()
+    dst.close()
+
+    write_engine = create_sqlite_engine(db_copy)
+    with write_engine.connect() as conn:
+        users = conn.execute(text("SELECT user_id FROM USER LIMIT 3")).scalars().all()
+        copies = conn.execute(
+            text("SELECT copy_id FROM COPY WHERE copy_id NOT IN (SELECT copy_id FROM RATING) LIMIT 3")
+        ).scalars().all()
+    pairs = [(u, c) for u in users for c in copies]
+
+    def writer(seed: int) -> None:
+        rng = random.Random(seed)
+        for _ in range(40):
+            uid, cid = rng.choice(pairs)
+            with write_engine.begin() as conn:
+                save_rating(conn, uid, cid, rng.randint(1, 5))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        for future in [pool.submit(writer, seed) for seed in range(8)]:
+            future.result()
+
+    with write_engine.connect() as conn:
+        expected = conn.execute(
+            text(
+                """
+                SELECT c.book_id, COUNT(r.rating), SUM(r.rating)
+                FROM RATING r
+                JOIN COPY c ON r.copy_id = c.copy_id
+                GROUP BY c.book_id
+                """
+            )
+        ).all()
+        materialized = conn.execute(text("SELECT book_id, num_ratings, sum_rating FROM BOOK_STATS")).all()
+    write_engine.dispose()
+
+    assert sorted(map(tuple, expected)) == sorted(map(tuple, materialized))
+
+
+def test_precompute_item_cf_fits_once_in_parent(tmp_path, monkeypatch):
+    """Con varios workers, item-CF se entrena una vez en el proceso padre y no en cada worker."""
+    import os
+
+    from app.etl import precompute_recs
+    from app.recommender import item_cf
+
+    fits = tmp_path / "fits.txt"
+    original_fit = item_cf.ItemCFModel.fit
+
+    def counting_fit(self, uim):
+        with open(fits, "a", encoding="utf-8") as f:
+            f.write(f"{os.getpid()}\n")
+        return original_fit(self, uim)
+
+    item_cf.reset_item_cf_model()
+    monkeypatch.setattr(item_cf.ItemCFModel, "fit", counting_fit)
+    monkeypatch.setattr(precompute_recs, "USERS_PER_TASK", 50)
+
+    stats = precompute_recs.precompute_recommendations(n=5, min_ratings=1, method="item_cf", workers=2)
+
+    assert stats["rows"] > 0
+    assert fits.read_text(encoding="utf-8").split() == [str(os.getpid())]
+
+
+@pytest.mark.parametrize("implicit", [False, True])
+def test_als_solve_side_matches_per_row_solve(implicit, monkeypatch):
+    """El medio paso vectorizado por lotes da lo mismo que resolver fila a fila."""
+    import numpy as np
+    import scipy.sparse as sp
+
+    from app.recommender import als
+
+    rng = np.random.default_rng(0)
+    R = sp.random(60, 40, density=0.15, format="csr", random_state=1, dtype=np.float32)
+    R.data = np.ceil(R.data * 5).astype(np.float32)
+    R = sp.csr_matrix(R.multiply(rng.random((60, 1)) > 0.1))  # algunas filas vacías
+    Y = rng.standard_normal((40, 8)).astype(np.float32)
+
+    # Lotes y grupos pequeños: varios grupos de longitud por lote
+    monkeypatch.setattr(als, "SOLVE_BATCH_SIZE", 16)
+    monkeypatch.setattr(als, "GATHER_BLOCK_BYTES", 8 * 8 * 20)
+    X = als._solve_side(R, Y, regularization=0.1, implicit=implicit, alpha=2.0, n_threads=2)
+
+    Y64 = Y.astype(np.float64)
+    for row in range(R.shape[0]):
+        cols, r = R[row].indices, R[row].data.astype(np.float64)
+        Yi = Y64[cols]
+        if implicit:
+            A = Y64.T @ Y64 + (Yi * (2.0 * r)[:, None]).T @ Yi + 0.1 * np.eye(8)
+            b = Yi.T @ (1.0 + 2.0 * r)
+        else:
+            A = Yi.T @ Yi + 0.1 * np.eye(8)
+            b = Yi.T @ r
+        np.testing.assert_allclose(X[row], np.linalg.solve(A, b), rtol=1e-4, atol=1e-5)